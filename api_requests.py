@@ -0,0 +1,256 @@
+import logging
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from config import (API_BATCH_SIZE, API_INITIAL_BACKOFF, API_MAX_BACKOFF, API_MAX_IN_FLIGHT, API_MAX_RETRIES,
+                    API_QUOTA_BUDGETS)
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Calls that add something each time they are applied: a server error or a lost response
+# may mean the call went through, so these are only retried when it certainly did not
+NON_IDEMPOTENT_METHODS = {
+    'sheets.spreadsheets.values.append',
+    'sheets.spreadsheets.create',
+    'drive.files.create',
+    'drive.permissions.create',
+}
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'RESOURCE_EXHAUSTED')
+# Google answers batch requests holding more calls than this with an error
+MAX_BATCH_CALLS = 100
+
+class AdaptiveRateLimiter:
+    """Token bucket with an in-flight window, both tuned by AIMD.
+
+    Every successful call additively raises the refill rate and the number of calls
+    allowed in flight; every throttled call halves both. The limits never exceed the
+    configured budget and never drop below one call per second and one call in flight.
+    """
+
+    def __init__(self, max_rate, max_in_flight, increase_fraction=0.01, decrease_factor=0.5):
+        self.max_rate = max_rate
+        self.max_in_flight = max_in_flight
+        self.rate = float(max_rate)
+        self.window = float(max_in_flight)
+        self._rate_step = max_rate * increase_fraction
+        self._window_step = max(max_in_flight * increase_fraction, 0.1)
+        self._decrease_factor = decrease_factor
+        self._tokens = float(max_rate)
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self.throttle_events = 0
+
+    def _reserve_token(self, cost=1):
+        """Take cost tokens, returning how long the caller must wait before using them."""
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= cost
+        return max(0.0, -self._tokens / self.rate)
+
+    @contextmanager
+    def slot(self, cost=1):
+        """Wait for an in-flight slot and cost tokens, holding the slot for the duration of the call."""
+        with self._condition:
+            while self._in_flight >= max(1, int(self.window)):
+                self._condition.wait()
+            self._in_flight += 1
+            wait = self._reserve_token(cost)
+        try:
+            if wait:
+                time.sleep(wait)
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            self.rate = min(self.max_rate, self.rate + self._rate_step)
+            self.window = min(self.max_in_flight, self.window + self._window_step)
+            self._condition.notify()
+
+    def on_throttle(self):
+        with self._condition:
+            self.throttle_events += 1
+            self.rate = max(1.0, self.rate * self._decrease_factor)
+            self.window = max(1.0, self.window * self._decrease_factor)
+            # Drop any saved-up burst so the lower rate takes effect immediately
+            self._tokens = min(self._tokens, 0.0)
+
+def parse_quota_budgets(value):
+    """Parse 'drive=20,sheets=1' into {'drive': 20.0, 'sheets': 1.0} requests per second."""
+    budgets = {}
+    for item in value.split(','):
+        if '=' in item:
+            endpoint, rate = item.split('=', 1)
+            budgets[endpoint.strip()] = float(rate)
+    return budgets
+
+_budgets = parse_quota_budgets(API_QUOTA_BUDGETS)
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(method_id):
+    """Return the limiter for the most specific budget matching a method id like 'drive.files.list'.
+
+    Method ids sharing a budget key share one limiter. Returns None when no budget applies.
+    """
+    if not method_id:
+        return None
+    parts = method_id.split('.')
+    for length in range(len(parts), 0, -1):
+        key = '.'.join(parts[:length])
+        if key in _budgets:
+            with _limiters_lock:
+                if key not in _limiters:
+                    _limiters[key] = AdaptiveRateLimiter(_budgets[key], API_MAX_IN_FLIGHT)
+                return _limiters[key]
+    return None
+
+def is_rate_limited(error):
+    """Return True if an HttpError reports throttling rather than a real failure."""
+    if error.resp.status == 429:
+        return True
+    if error.resp.status == 403:
+        content = error.content.decode('utf-8', 'replace') if isinstance(error.content, bytes) else str(error.content)
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return False
+
+def _backoff_delay(attempt, error=None):
+    """Exponential backoff with full jitter, honouring a Retry-After header when present."""
+    if error is not None:
+        retry_after = error.resp.get('retry-after')
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return random.uniform(0, min(API_MAX_BACKOFF, API_INITIAL_BACKOFF * 2 ** attempt))
+
+def is_idempotent(method_id):
+    """Return True if repeating a call that may already have been applied cannot change the outcome."""
+    return method_id not in NON_IDEMPOTENT_METHODS
+
+def call_with_retry(function, method_id=None, cost=1, idempotent=None):
+    """Call a function that performs one API round-trip, retrying throttling and transient errors.
+
+    The call is paced by the rate limiter for method_id, and its outcome feeds back into it.
+    cost is the number of calls the round-trip counts as against the budget, e.g. for a batch.
+    A call that is not idempotent, by default one in NON_IDEMPOTENT_METHODS, is only retried
+    when throttled or when the connection was refused, as then the request was never applied.
+    """
+    # googleapiclient is slow to import, so it is only loaded once an API call is made
+    from googleapiclient.errors import HttpError
+
+    limiter = get_rate_limiter(method_id)
+    if idempotent is None:
+        idempotent = is_idempotent(method_id)
+
+    for attempt in range(API_MAX_RETRIES + 1):
+        error = None
+        with limiter.slot(cost) if limiter else nullcontext():
+            metrics.record_api_call(method_id)
+            try:
+                result = function()
+            except HttpError as e:
+                throttled = is_rate_limited(e)
+                if throttled and limiter:
+                    limiter.on_throttle()
+                if not (throttled or (idempotent and e.resp.status in RETRYABLE_STATUSES)) or attempt == API_MAX_RETRIES:
+                    raise
+                error = e
+            except (socket.timeout, ConnectionError) as e:
+                if not (idempotent or isinstance(e, ConnectionRefusedError)) or attempt == API_MAX_RETRIES:
+                    raise
+                error = e
+            else:
+                if limiter:
+                    limiter.on_success()
+                return result
+
+        metrics.record_retry(method_id)
+        delay = _backoff_delay(attempt, error if isinstance(error, HttpError) else None)
+        logger.warning(f"{method_id or 'API call'} failed ({error}), retry {attempt + 1}/{API_MAX_RETRIES} in {delay:.1f}s")
+        time.sleep(delay)
+
+def execute(request):
+    """Execute a googleapiclient request through the shared retry and rate-limiting layer."""
+    return call_with_retry(request.execute, getattr(request, 'methodId', None))
+
+def _is_retryable(error, method_id):
+    return is_rate_limited(error) or (is_idempotent(method_id) and error.resp.status in RETRYABLE_STATUSES)
+
+def _execute_alone(request):
+    from googleapiclient.errors import HttpError
+
+    try:
+        return execute(request), None
+    except HttpError as e:
+        return None, e
+
+def _send_batch(service, requests, method_id):
+    """Send requests as one HTTP batch request, returning [(response, error), ...] in request order."""
+    outcomes = {}
+
+    def record(request_id, response, error):
+        outcomes[request_id] = (response, error)
+
+    batch = service.new_batch_http_request(callback=record)
+    for number, request in enumerate(requests):
+        batch.add(request, request_id=str(number))
+    idempotent = all(is_idempotent(getattr(request, 'methodId', None)) for request in requests)
+    call_with_retry(batch.execute, method_id, cost=len(requests), idempotent=idempotent)
+    metrics.count('batched_api_calls', len(requests))
+
+    results = [outcomes[str(number)] for number in range(len(requests))]
+    limiter = get_rate_limiter(method_id)
+    if limiter and any(error is not None and is_rate_limited(error) for _, error in results):
+        limiter.on_throttle()
+    return results
+
+def execute_batch(service, requests, batch_size=API_BATCH_SIZE):
+    """Execute independent requests to one service as HTTP batch requests of up to batch_size calls.
+
+    Returns [(response, error), ...] in request order, error being the HttpError of a call
+    that failed and None otherwise. A batch whose round-trip fails is retried whole; calls
+    throttled or failing transiently inside a batch are retried together in a later batch.
+    Non-idempotent calls are only retried when throttled, as with call_with_retry.
+    Each batch counts as one call per request against the rate limiter's budget. A lone
+    request is sent on its own, as a batch of one gains nothing.
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_CALLS))
+    method_ids = [getattr(request, 'methodId', None) for request in requests]
+    results = [None] * len(requests)
+    pending = list(range(len(requests)))
+
+    for attempt in range(API_MAX_RETRIES + 1):
+        retry = []
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            if len(chunk) == 1:
+                # execute() has already retried whatever can be retried
+                results[chunk[0]] = _execute_alone(requests[chunk[0]])
+                continue
+            batch_method_id = f"{(method_ids[chunk[0]] or 'api').split('.')[0]}.batch"
+            outcomes = _send_batch(service, [requests[index] for index in chunk], batch_method_id)
+            for index, (response, error) in zip(chunk, outcomes):
+                if error is not None and _is_retryable(error, method_ids[index]) and attempt < API_MAX_RETRIES:
+                    retry.append(index)
+                else:
+                    results[index] = (response, error)
+
+        if not retry:
+            break
+        for index in retry:
+            metrics.record_retry(method_ids[index])
+        delay = _backoff_delay(attempt)
+        logger.warning(f"{len(retry)} batched calls failed, retry {attempt + 1}/{API_MAX_RETRIES} in {delay:.1f}s")
+        time.sleep(delay)
+        pending = retry
+
+    return results
@@ -0,0 +1,201 @@
+"""Asyncio engine that runs the Drive-to-Sheets pipeline as overlapping stages.
+
+Listing, row building and sheet writes are separate tasks connected by bounded queues,
+so a slow stage holds the others back instead of letting work pile up in memory. The
+googleapiclient calls stay blocking and run in thread pools: listing and sheet writes each
+keep one dedicated thread, so their services are never shared between threads, and rows
+are built on DOWNLOAD_WORKERS threads with their own Drive services.
+
+The sheet ends up exactly as after the synchronous streaming pipeline: the header, then
+one row per group in listing order, written in the same STREAM_FLUSH_ROWS /
+STREAM_FLUSH_BYTES batches.
+
+Usage:
+    python async_pipeline.py
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+
+if __name__ == "__main__":
+    # Run as a script: load the .env settings before the imports below copy them
+    import config
+    config.load_settings()
+
+from config import *
+from create_image_dataset import (_build_row_in_worker, create_encode_pool, create_or_get_spreadsheet,
+                                  deduplicate_groups, get_header_row, iter_groups_by_prefix, iter_source_pages,
+                                  log_encoding_stats, resize_image_cells, share_linked_images,
+                                  write_rows_at, write_run_reports)
+from metrics import metrics
+from services import get_thread_drive_service, get_thread_sheets_service
+from thumbnails import thumbnail_stats
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's output on its queue
+_DONE = object()
+
+async def list_groups(loop, executor, drive_service, group_queue, window):
+    """Stage 1: list the source folder and group it, putting (position, group) on group_queue.
+
+    window bounds how many rows may be listed ahead of the last row written.
+    """
+    groups = share_linked_images(drive_service, islice(
+        deduplicate_groups(iter_groups_by_prefix(iter_source_pages(drive_service))), MAX_THUMBNAILS))
+    position = 0
+    while True:
+        await window.acquire()
+        group = await loop.run_in_executor(executor, next, groups, _DONE)
+        if group is _DONE:
+            window.release()
+            break
+        await group_queue.put((position, group))
+        position += 1
+    await group_queue.put(_DONE)
+
+async def build_rows(loop, executor, encode_pool, group_queue, row_queue):
+    """Stage 2: one of DOWNLOAD_WORKERS builders turning queued groups into (position, row) pairs."""
+    while True:
+        item = await group_queue.get()
+        if item is _DONE:
+            # Pass the marker on so every other builder stops too
+            await group_queue.put(_DONE)
+            await row_queue.put(_DONE)
+            return
+        position, group = item
+        row = await loop.run_in_executor(executor, partial(_build_row_in_worker, group, encode_pool))
+        await row_queue.put((position, row))
+
+async def append_rows(loop, executor, sheets_service, spreadsheet_id, row_queue, window, builder_count):
+    """Stage 3: put rows back in listing order and write them in STREAM_FLUSH_ROWS / STREAM_FLUSH_BYTES batches.
+
+    Returns (row_count, column_count) of everything written, header included.
+    """
+    def flush(batch, start_index):
+        # Written at a known offset rather than appended, so a retried flush cannot duplicate rows
+        write_rows_at(sheets_service, spreadsheet_id, start_index, batch)
+
+    header = get_header_row()
+    batch = [header]
+    batch_bytes = sum(len(str(value)) for value in header)
+    row_count = 1
+    column_count = len(header)
+    waiting = {}
+    next_position = 0
+    finished_builders = 0
+
+    while finished_builders < builder_count:
+        item = await row_queue.get()
+        if item is _DONE:
+            finished_builders += 1
+            continue
+
+        position, row = item
+        waiting[position] = row
+        while next_position in waiting:
+            row = waiting.pop(next_position)
+            next_position += 1
+            window.release()
+
+            batch.append(row)
+            batch_bytes += sum(len(str(value)) for value in row)
+            row_count += 1
+            column_count = max(column_count, len(row))
+
+            if len(batch) >= STREAM_FLUSH_ROWS or batch_bytes >= STREAM_FLUSH_BYTES:
+                # Builders keep working on the next rows while this batch is sent
+                await loop.run_in_executor(executor, flush, batch, row_count - len(batch))
+                batch = []
+                batch_bytes = 0
+
+    if batch:
+        await loop.run_in_executor(executor, flush, batch, row_count - len(batch))
+
+    return row_count, column_count
+
+async def run_async_pipeline(drive_service, sheets_service, spreadsheet_id, list_executor, sheets_executor):
+    """Run listing, row building and sheet writes concurrently. Returns the number of image sets written.
+
+    drive_service is only used on list_executor and sheets_service only on sheets_executor;
+    both executors must have a single thread, the one each service was built on.
+    """
+    loop = asyncio.get_running_loop()
+    builder_count = max(DOWNLOAD_WORKERS, 1)
+    window = asyncio.Semaphore(builder_count * 2)
+    group_queue = asyncio.Queue(maxsize=builder_count * 2)
+    row_queue = asyncio.Queue(maxsize=builder_count * 2)
+
+    thumbnail_stats.reset()
+    encode_pool = create_encode_pool()
+    try:
+        with ThreadPoolExecutor(max_workers=builder_count, thread_name_prefix='build') as build_executor:
+            tasks = [
+                asyncio.ensure_future(list_groups(loop, list_executor, drive_service, group_queue, window)),
+                asyncio.ensure_future(append_rows(loop, sheets_executor, sheets_service, spreadsheet_id,
+                                                  row_queue, window, builder_count)),
+            ]
+            tasks.extend(asyncio.ensure_future(build_rows(loop, build_executor, encode_pool, group_queue, row_queue))
+                         for _ in range(builder_count))
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            row_count, column_count = tasks[1].result()
+    finally:
+        if encode_pool is not None:
+            encode_pool.shutdown()
+
+    await loop.run_in_executor(sheets_executor, resize_image_cells, sheets_service, spreadsheet_id,
+                               row_count, column_count)
+    log_encoding_stats()
+
+    return row_count - 1
+
+async def main_async():
+    """Asyncio alternative to create_image_dataset.main(), writing the same sheet with all I/O overlapped."""
+    metrics.reset()
+    success = False
+    try:
+        print("Starting Google Drive to Sheets image transfer...")
+        if OUTPUT_BACKEND != 'sheets' or PARTITION_MAX_ROWS or PARTITION_MAX_BYTES or CHECKPOINTING or INCREMENTAL_SYNC:
+            logger.warning("The asyncio engine always writes a single sheet; OUTPUT_BACKEND, partitioning, "
+                           "CHECKPOINTING and INCREMENTAL_SYNC are ignored")
+
+        loop = asyncio.get_running_loop()
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='list') as list_executor, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix='sheets') as sheets_executor:
+            # Each service is built on the thread that uses it, so it gets that thread's transport
+            drive_service = await loop.run_in_executor(list_executor, get_thread_drive_service)
+            sheets_service = await loop.run_in_executor(sheets_executor, get_thread_sheets_service)
+
+            def create_spreadsheet():
+                return create_or_get_spreadsheet(get_thread_drive_service(), sheets_service,
+                                                 OUTPUT_SPREADSHEET_NAME, OUTPUT_FOLDER_ID)
+
+            spreadsheet_id = await loop.run_in_executor(sheets_executor, create_spreadsheet)
+            image_set_count = await run_async_pipeline(drive_service, sheets_service, spreadsheet_id,
+                                                       list_executor, sheets_executor)
+
+        spreadsheet_url = f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}"
+        logger.info(f"Successfully processed {image_set_count} image sets.")
+        logger.info(f"Spreadsheet available at: {spreadsheet_url}")
+        success = True
+        return spreadsheet_url
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+    finally:
+        write_run_reports(success)
+
+if __name__ == "__main__":
+    asyncio.run(main_async())
@@ -0,0 +1,79 @@
+import base64
+
+class EncodedSizeExceeded(Exception):
+    """Raised when base64 output would grow past the writer's limit."""
+
+class Base64Writer:
+    """File-like sink that base64-encodes bytes as they are written.
+
+    Chunks are encoded on arrival. The at most two bytes that do not fill a 3-byte group
+    are carried over to the next write, so the raw data itself is never held. Once the
+    encoded length would exceed max_length, write raises EncodedSizeExceeded, which lets a
+    download be abandoned as soon as its result can no longer be used. With keep_data the
+    raw chunks are kept as well, for callers that also need the original bytes.
+    """
+
+    def __init__(self, max_length=None, keep_data=False):
+        self.max_length = max_length
+        self._data_parts = [] if keep_data else None
+        self.encoded_length = 0
+        self.bytes_written = 0
+        self._parts = []
+        self._remainder = b''
+
+    def _append(self, data):
+        # Kept as text, so wrap can build the formula with one join and no decode of the whole
+        encoded = base64.b64encode(data).decode('ascii')
+        self.encoded_length += len(encoded)
+        self._parts.append(encoded)
+
+    def _check_length(self, extra=0):
+        if self.max_length is not None and self.encoded_length + extra > self.max_length:
+            raise EncodedSizeExceeded(
+                f"base64 data exceeds {self.max_length} characters after {self.bytes_written} bytes"
+            )
+
+    def write(self, data):
+        view = memoryview(data)
+        self.bytes_written += len(view)
+        if self._data_parts is not None:
+            self._data_parts.append(bytes(view))
+
+        if self._remainder:
+            needed = 3 - len(self._remainder)
+            if len(view) < needed:
+                self._remainder += bytes(view)
+                self._check_length(4)
+                return len(data)
+            self._append(self._remainder + bytes(view[:needed]))
+            view = view[needed:]
+
+        aligned = len(view) - len(view) % 3
+        if aligned:
+            self._append(view[:aligned])
+        self._remainder = bytes(view[aligned:])
+        self._check_length(4 if self._remainder else 0)
+        return len(data)
+
+    def tell(self):
+        return self.bytes_written
+
+    @property
+    def data(self):
+        """The raw bytes written so far; only available with keep_data."""
+        return b''.join(self._data_parts)
+
+    def _finish(self):
+        if self._remainder:
+            self._append(self._remainder)
+            self._remainder = b''
+        self._check_length()
+
+    def getvalue(self):
+        """Return the complete base64 text."""
+        return self.wrap('', '')
+
+    def wrap(self, prefix, suffix):
+        """Return prefix + base64 text + suffix, built with a single join."""
+        self._finish()
+        return ''.join([prefix, *self._parts, suffix])
@@ -0,0 +1,92 @@
+"""Benchmark the regex and pandas filename grouping engines on a synthetic listing.
+
+Neither engine is reliably faster: which one wins, and by how much, has varied between
+machines and pandas/pyarrow versions, so the versions are printed with the timings.
+Measure on the machine that runs the builds before switching GROUPING_ENGINE.
+
+Usage:
+    python bench_grouping.py [--files 1000000] [--repeat 3]
+"""
+import argparse
+import random
+import time
+
+import create_image_dataset
+
+IDENTIFIERS = ['front', 'back', 'detail', 'side']
+
+def make_listing(file_count, seed=0):
+    """Build a files.list-shaped listing of matching and non-matching filenames."""
+    rng = random.Random(seed)
+    files = []
+    prefix_number = 0
+    while len(files) < file_count:
+        prefix_number += 1
+        for identifier in IDENTIFIERS[:rng.randint(1, len(IDENTIFIERS))]:
+            # Names holding a second identifier, in either order, check that both engines pick the same one
+            suffix = rng.choice(['', '_v2', '_edit', f"_{rng.choice(IDENTIFIERS)}", f"_v2_{rng.choice(IDENTIFIERS)}"])
+            extension = rng.choice(['jpg', 'JPG', 'png'])
+            files.append({
+                'id': f"id{len(files)}",
+                'name': f"SKU{prefix_number:07d}_{identifier}{suffix}.{extension}",
+                'mimeType': 'image/jpeg',
+            })
+        if rng.random() < 0.05:
+            files.append({'id': f"id{len(files)}", 'name': f"notes_{prefix_number}.txt", 'mimeType': 'text/plain'})
+    return files[:file_count]
+
+def configure():
+    create_image_dataset.IMAGE_PREFIX_PATTERN = 'SKU[0-9]+'
+    create_image_dataset.COLUMN1_IDENTIFIER = 'front'
+    create_image_dataset.COLUMN2_IDENTIFIER = 'back'
+    create_image_dataset.COLUMN3_IDENTIFIER = 'detail'
+    create_image_dataset.ADDITIONAL_IDENTIFIERS = ['side']
+    create_image_dataset.DEBUG = False
+
+def time_engine(engine, files, repeat):
+    create_image_dataset.GROUPING_ENGINE = engine
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        grouped_files = create_image_dataset.group_files_by_prefix(files)
+        timings.append(time.perf_counter() - start)
+    return min(timings), grouped_files
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1_000_000, help='number of synthetic filenames')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per engine; the fastest is reported')
+    args = parser.parse_args()
+
+    import pandas as pd
+    try:
+        import pyarrow
+        arrow_version = pyarrow.__version__
+    except ImportError:
+        arrow_version = 'not installed, so Python re'
+
+    configure()
+    files = make_listing(args.files)
+    print(f"Synthetic listing: {len(files)} files, pandas {pd.__version__}, pyarrow {arrow_version}")
+
+    results = {}
+    timings = {}
+    for engine in ('regex', 'pandas'):
+        best, grouped_files = time_engine(engine, files, args.repeat)
+        results[engine] = grouped_files
+        timings[engine] = best
+        print(f"{engine:>7}: {best:8.3f}s  {len(files) / best:12,.0f} files/s  {len(grouped_files)} prefixes")
+    print(f"  pandas/regex time: {timings['pandas'] / timings['regex']:.2f}")
+
+    start = time.perf_counter()
+    create_image_dataset.build_grouping_frame(files)
+    pivot_time = time.perf_counter() - start
+    print(f"  pivot: {pivot_time:8.3f}s  {len(files) / pivot_time:12,.0f} files/s  "
+          f"(pandas engine before converting to grouped_files dicts)")
+
+    if results['regex'] != results['pandas']:
+        raise SystemExit("Engines produced different groupings")
+    print("Engines produced identical groupings")
+
+if __name__ == '__main__':
+    main()
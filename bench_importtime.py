@@ -0,0 +1,87 @@
+"""Guard startup latency by timing imports with `python -X importtime`.
+
+Each scenario runs in fresh interpreters. The median total import time of the modules
+the scenario itself imports is compared with its budget, and the scenario fails outright
+if it imports a module that is supposed to load lazily. The script exits non-zero on
+any failure, so it can run as a regression check.
+
+Usage:
+    python bench_importtime.py [--runs 5] [--scale 1.0]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+GOOGLE_CLIENT_MODULES = ['googleapiclient.discovery', 'googleapiclient.http', 'httplib2', 'google_auth_httplib2']
+
+# (name, interpreter arguments, import budget in ms, modules that must not be imported)
+SCENARIOS = [
+    ('cli --help', ['cli.py', '--help'], 40,
+     ['config', 'dotenv', 'pandas', 'numpy', 'PIL', 'googleapiclient', *GOOGLE_CLIENT_MODULES]),
+    ('cli check-config', ['cli.py', 'check-config'], 60,
+     ['pandas', 'numpy', 'PIL', 'googleapiclient', *GOOGLE_CLIENT_MODULES]),
+    ('import create_image_dataset', ['-c', 'import create_image_dataset'], 150,
+     ['dotenv', 'pandas', 'numpy', 'PIL', 'openpyxl', 'multiprocessing', 'googleapiclient', *GOOGLE_CLIENT_MODULES]),
+    ('import async_pipeline', ['-c', 'import async_pipeline'], 150,
+     ['dotenv', 'pandas', 'numpy', 'PIL', 'openpyxl', 'multiprocessing', 'googleapiclient', *GOOGLE_CLIENT_MODULES]),
+]
+
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+def parse_importtime(stderr):
+    """Return [(module, cumulative microseconds, nesting depth), ...] from -X importtime output."""
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            _, cumulative, indent, module = match.groups()
+            imports.append((module, int(cumulative), len(indent) // 2))
+    return imports
+
+def run_scenario(arguments):
+    """Return ({module: cumulative microseconds}, total microseconds) for the scenario's own imports."""
+    # Python's own startup imports (site, encodings, ...) happen whatever the scenario does
+    baseline = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'pass'],
+                              capture_output=True, text=True, cwd=REPO_DIR)
+    startup_modules = {module for module, _, _ in parse_importtime(baseline.stderr)}
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', *arguments],
+                            capture_output=True, text=True, cwd=REPO_DIR)
+    imports = [entry for entry in parse_importtime(result.stderr) if entry[0] not in startup_modules]
+    modules = {module: cumulative for module, cumulative, _ in imports}
+    total = sum(cumulative for _, cumulative, depth in imports if depth == 0)
+    return modules, total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='interpreters started per scenario')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every budget, e.g. for slow CI machines')
+    args = parser.parse_args()
+
+    failed = False
+    for name, arguments, budget_ms, forbidden in SCENARIOS:
+        samples = [run_scenario(arguments) for _ in range(args.runs)]
+        median_ms = statistics.median(total for _, total in samples) / 1000
+        modules = samples[-1][0]
+        leaked = sorted(module for module in forbidden if module in modules)
+        limit_ms = budget_ms * args.scale
+
+        status = 'ok' if median_ms <= limit_ms and not leaked else 'FAIL'
+        failed = failed or status == 'FAIL'
+        print(f"{status:>4} {name:<30} {median_ms:7.1f} ms of imports (budget {limit_ms:.0f} ms), "
+              f"{len(modules)} modules")
+        if leaked:
+            print(f"     imports modules that should load lazily: {', '.join(leaked)}")
+        if median_ms > limit_ms:
+            slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:5]
+            print(f"     slowest: {', '.join(f'{module} {cumulative / 1000:.1f} ms' for module, cumulative in slowest)}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
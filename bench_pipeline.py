@@ -0,0 +1,140 @@
+"""Benchmark main(), or the asyncio engine's main_async(), end to end against the in-process Drive and Sheets fake.
+
+Each folder size runs in a fresh interpreter, so peak RSS is measured per size. The source
+folder holds one small JPEG per file, named so that every group fills all three image
+columns. Settings are passed to the script as environment variables, so any feature can be
+compared by repeating a run with --env, e.g. --env STREAM_PIPELINE=True. The script's own
+API_QUOTA_BUDGETS still pace requests, so pass e.g. --env API_QUOTA_BUDGETS=drive=2000,sheets=50
+to measure the pipeline rather than the default budgets.
+
+Usage:
+    python bench_pipeline.py [--sizes 100,1000,10000,100000] [--latency 0.02]
+                             [--error-rate 0.01] [--sheets-quota 300] [--engine async]
+                             [--env KEY=VALUE ...]
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+IDENTIFIERS = ['front', 'back', 'side']
+
+def sample_image():
+    from PIL import Image
+
+    output = io.BytesIO()
+    Image.new('RGB', (160, 120), (200, 120, 40)).save(output, 'JPEG', quality=85)
+    return output.getvalue()
+
+def image_content(base, index):
+    # Bytes after the JPEG end marker are ignored by decoders but make every file unique
+    return base + index.to_bytes(4, 'big')
+
+def populate_source_folder(backend, folder_id, file_count):
+    base = sample_image()
+    indices = {}
+    for index in range(file_count):
+        group, identifier = divmod(index, len(IDENTIFIERS))
+        content = image_content(base, index)
+        file = backend.add_file(f"IMG{group:06d}_{IDENTIFIERS[identifier]}.jpg", folder_id,
+                                md5=hashlib.md5(content).hexdigest(), size=len(content))
+        indices[file['id']] = index
+    backend.content_factory = lambda file: image_content(base, indices[file['id']])
+
+def run_single(args):
+    """Run main() once in this interpreter and print a JSON result line."""
+    cache_dir = tempfile.TemporaryDirectory(prefix='bench-thumbnail-cache-')
+    os.environ.update({
+        'IMAGE_PREFIX_PATTERN': r'IMG\d+',
+        'COLUMN1_IDENTIFIER': IDENTIFIERS[0],
+        'COLUMN2_IDENTIFIER': IDENTIFIERS[1],
+        'COLUMN3_IDENTIFIER': IDENTIFIERS[2],
+        'ADDITIONAL_IDENTIFIERS': '',
+        'MAX_THUMBNAILS': str(args.single),
+        'OUTPUT_SPREADSHEET_NAME': 'Benchmark dataset',
+        'THUMBNAIL_CACHE_DIR': cache_dir.name,
+    })
+    for item in args.env:
+        key, value = item.split('=', 1)
+        os.environ[key] = value
+
+    sys.path.insert(0, REPO_DIR)
+    from fake_google import FakeGoogleBackend
+
+    quota = {'sheets': args.sheets_quota} if args.sheets_quota else None
+    backend = FakeGoogleBackend(latency=args.latency, error_rate=args.error_rate, quota_per_minute=quota,
+                                media_chunk_limit=args.chunk_size, retain_values=False)
+    source_folder = backend.add_folder('Source')
+    output_folder = backend.add_folder('Output')
+    populate_source_folder(backend, source_folder, args.single)
+    os.environ['SOURCE_FOLDER_ID'] = source_folder
+    os.environ['OUTPUT_FOLDER_ID'] = output_folder
+
+    # config reads the environment on import, so the script is only imported once it is set
+    import create_image_dataset
+    import services
+    services.use_http(backend.http)
+
+    start = time.perf_counter()
+    if args.engine == 'async':
+        import asyncio
+        import async_pipeline
+        url = asyncio.run(async_pipeline.main_async())
+    else:
+        url = create_image_dataset.main()
+    elapsed = time.perf_counter() - start
+    if url is None:
+        sys.exit('main() failed')
+
+    print(json.dumps({
+        'files': args.single,
+        'seconds': elapsed,
+        'files_per_second': args.single / elapsed,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'api_calls': dict(backend.calls),
+        'errors': {str(status): count for status, count in backend.errors.items()},
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100,1000,10000', help='comma-separated file counts')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fake request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='chance of an injected 503 per request')
+    parser.add_argument('--sheets-quota', type=int, default=0, help='Sheets requests allowed per minute')
+    parser.add_argument('--chunk-size', type=int, default=None, help='max bytes per media response')
+    parser.add_argument('--engine', choices=['sync', 'async'], default='sync',
+                        help='run main() or the asyncio engine')
+    parser.add_argument('--env', action='append', default=[], help='KEY=VALUE setting passed to the script')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_single(args)
+        return
+
+    for size in (int(size) for size in args.sizes.split(',')):
+        command = [sys.executable, __file__, '--single', str(size), '--latency', str(args.latency),
+                   '--error-rate', str(args.error_rate), '--sheets-quota', str(args.sheets_quota),
+                   '--engine', args.engine]
+        if args.chunk_size:
+            command += ['--chunk-size', str(args.chunk_size)]
+        for item in args.env:
+            command += ['--env', item]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        calls = ', '.join(f"{method}={count}" for method, count in sorted(result['api_calls'].items()))
+        print(f"{size:>7} files: {result['seconds']:8.2f} s, {result['files_per_second']:8.1f} files/s, "
+              f"peak RSS {result['peak_rss_mb']:7.1f} MB")
+        print(f"         calls: {calls}")
+        if result['errors']:
+            print(f"         errors: {result['errors']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark time to first API call with the legacy service setup and the shared service factory.
+
+Each sample runs in a fresh interpreter and also builds one Drive service per pool worker,
+as the concurrent download paths do. Samples use a throwaway OAuth token and a mocked HTTP
+response for the first files.list call, so no Google account or network access is needed.
+
+Usage:
+    python bench_startup.py [--runs 5] [--workers 8]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Mirrors the per-service setup that services.py used before the shared factory
+LEGACY_SETUP = '''
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+def load(scopes):
+    return Credentials.from_authorized_user_info(json.loads(open(TOKEN_FILE).read()), scopes)
+
+def build_drive_service():
+    return build('drive', 'v3', credentials=load(
+        ['https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/spreadsheets']))
+
+drive_service = build_drive_service()
+sheets_service = build('sheets', 'v4', credentials=load(['https://www.googleapis.com/auth/spreadsheets']))
+'''
+
+FACTORY_SETUP = '''
+import services
+services.TOKEN_FILE = TOKEN_FILE
+services.SERVICE_ACCOUNT_FILE = None
+build_drive_service = services.get_drive_service
+drive_service = build_drive_service()
+sheets_service = services.get_sheets_service()
+'''
+
+SAMPLE_TEMPLATE = '''
+import time
+start = time.perf_counter()
+import json, sys
+sys.path.insert(0, {repo_dir!r})
+from googleapiclient.http import HttpMockSequence
+TOKEN_FILE = {token_file!r}
+imported = time.perf_counter()
+{setup}
+drive_service.files().list(q="'root' in parents", fields='files(id)').execute(
+    http=HttpMockSequence([({{'status': '200'}}, '{{"files": []}}')]))
+done = time.perf_counter()
+for _ in range({workers}):
+    build_drive_service()
+workers_done = time.perf_counter()
+print(json.dumps({{'total': done - start, 'after_imports': done - imported, 'workers': workers_done - done}}))
+'''
+
+def write_token(directory):
+    path = os.path.join(directory, 'token.json')
+    expiry = (datetime.now(timezone.utc) + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    with open(path, 'w') as f:
+        json.dump({
+            'token': 'benchmark-token',
+            'refresh_token': 'benchmark-refresh-token',
+            'client_id': 'benchmark-client-id',
+            'client_secret': 'benchmark-client-secret',
+            'token_uri': 'https://oauth2.googleapis.com/token',
+            'expiry': expiry,
+        }, f)
+    return path
+
+def run_sample(setup, token_file, workers):
+    code = SAMPLE_TEMPLATE.format(repo_dir=REPO_DIR, token_file=token_file, setup=setup, workers=workers)
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per variant')
+    parser.add_argument('--workers', type=int, default=8, help='extra Drive services built, as for a worker pool')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        token_file = write_token(directory)
+        for label, setup in (('legacy', LEGACY_SETUP), ('factory', FACTORY_SETUP)):
+            samples = [run_sample(setup, token_file, args.workers) for _ in range(args.runs)]
+            total = statistics.median(sample['total'] for sample in samples) * 1000
+            after_imports = statistics.median(sample['after_imports'] for sample in samples) * 1000
+            workers = statistics.median(sample['workers'] for sample in samples) * 1000
+            print(f"{label:>8}: {total:8.1f} ms to first API call ({after_imports:.1f} ms after imports), "
+                  f"{workers:.1f} ms for {args.workers} worker Drive services")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Check that listings served from the Changes-API index match live listings, against the in-process fake.
+
+A source folder is listed live and through list_files_incremental, once from a full listing
+and again after Drive changes (an added, a renamed and a trashed file) are replayed from
+the index. Every file must come back with the same fields and values either way. Each
+USE_DRIVE_THUMBNAILS setting runs in a fresh interpreter, since the listing fields are
+fixed when the settings are loaded. The script exits non-zero on any difference, so it
+can run as a regression check.
+
+Usage:
+    python check_drive_index.py
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def compare(label, live, indexed):
+    """Return a description of every difference between two listings, matched by file id."""
+    live_by_id = {file['id']: file for file in live}
+    indexed_by_id = {file['id']: file for file in indexed}
+    problems = []
+    if live_by_id.keys() != indexed_by_id.keys():
+        problems.append(f"{label}: live listing has {sorted(live_by_id)}, index has {sorted(indexed_by_id)}")
+    for file_id in sorted(live_by_id.keys() & indexed_by_id.keys()):
+        live_file, indexed_file = live_by_id[file_id], indexed_by_id[file_id]
+        if live_file.keys() != indexed_file.keys():
+            problems.append(f"{label}: {file_id} has fields {sorted(live_file)} live "
+                            f"but {sorted(indexed_file)} from the index")
+        elif live_file != indexed_file:
+            problems.append(f"{label}: {file_id} is {live_file} live but {indexed_file} from the index")
+    return problems
+
+def run_single(drive_thumbnails):
+    """Compare live and index-backed listings in this interpreter and print any differences."""
+    from fake_google import FakeGoogleBackend
+
+    backend = FakeGoogleBackend()
+    source = backend.add_folder('source')
+    files = [backend.add_file(f"IMG{index:03d}_front.jpg", source, content=b'image %d' % index)
+             for index in range(5)]
+    backend.add_file('notes.txt', source, content=b'notes', mime_type='text/plain')
+
+    directory = tempfile.TemporaryDirectory(prefix='check-drive-index-')
+    os.environ.update({
+        'SOURCE_FOLDER_ID': source,
+        'USE_DRIVE_THUMBNAILS': str(drive_thumbnails),
+        'USE_CHANGES_INDEX': 'True',
+        'DRIVE_INDEX_FILE': os.path.join(directory.name, 'index.sqlite3'),
+        'USE_THUMBNAIL_CACHE': 'False',
+        'API_QUOTA_BUDGETS': 'drive=10000,sheets=10000',
+    })
+    import create_image_dataset
+    import services
+
+    services.use_http(backend.http)
+    drive_service = services.get_drive_service()
+
+    def check(label):
+        indexed = create_image_dataset.list_files_incremental(drive_service, source)
+        live = create_image_dataset.list_files_in_folder(drive_service, source)
+        return compare(label, live, indexed)
+
+    problems = check('full listing')
+    backend.add_file('IMG100_front.jpg', source, content=b'added image')
+    backend._files_update({}, {'name': 'IMG101_front.jpg'}, {}, files[0]['id'])
+    backend.trash_file(files[1]['id'])
+    problems += check('replayed changes')
+
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--single', choices=['True', 'False'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.single:
+        run_single(args.single == 'True')
+
+    failed = False
+    for drive_thumbnails in (False, True):
+        result = subprocess.run([sys.executable, __file__, '--single', str(drive_thumbnails)],
+                                capture_output=True, text=True, cwd=REPO_DIR)
+        failed = failed or result.returncode != 0
+        status = 'ok' if result.returncode == 0 else 'FAIL'
+        print(f"{status:>4} USE_DRIVE_THUMBNAILS={drive_thumbnails}")
+        for line in result.stdout.splitlines():
+            print(f"     {line}")
+        if result.returncode not in (0, 1):
+            print(result.stderr)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Check that INCREMENTAL_SYNC leaves the sheet showing the right images, against the in-process fake.
+
+The dataset is built, the source folder changes, and the dataset is built again with
+INCREMENTAL_SYNC on. Every image cell, following cell references as Sheets would, must then
+show the contents of its own file. Each scenario runs in a fresh interpreter, since the
+settings are fixed when they are loaded. The script exits non-zero on any problem, so it
+can run as a regression check.
+
+Scenarios:
+    reference-shift  A row is inserted above an image that a duplicate refers to, with
+                     DEDUPLICATE_IMAGES=references.
+    many-rows        600 rows, more than developer metadata could fingerprint, then one
+                     row added and one removed; only those two rows may be written.
+
+Usage:
+    python check_sheet_sync.py
+"""
+import argparse
+import contextlib
+import hashlib
+import os
+import re
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CELL_REFERENCE = re.compile(r'=\$?([A-Z]+)\$?(\d+)$')
+IMAGE_FILE_ID = re.compile(r'[?&]id=([^&"]+)')
+
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+def shown_file_id(rows, row_index, column):
+    """Return the id of the file whose image a cell shows, following references, or None."""
+    seen = set()
+    while (row_index, column) not in seen:
+        seen.add((row_index, column))
+        row = rows[row_index] if row_index < len(rows) else []
+        value = row[column] if column < len(row) else ''
+        reference = CELL_REFERENCE.match(value)
+        if reference:
+            row_index, column = int(reference.group(2)) - 1, column_index(reference.group(1))
+            continue
+        image = IMAGE_FILE_ID.search(value)
+        return image.group(1) if image and value.startswith('=IMAGE(') else None
+    return None
+
+def check_images(backend, spreadsheet_id, expected):
+    """Return a description of every image cell that does not show the contents expected for its prefix.
+
+    expected maps each prefix to the bytes its Front image must show.
+    """
+    rows = backend.sheet_values(spreadsheet_id)
+    problems = []
+    prefixes = [row[0] if row else '' for row in rows[1:]]
+    if prefixes != sorted(expected):
+        problems.append(f"sheet has prefixes {sorted(set(prefixes) - set(expected))} that should not be there "
+                        f"and lacks {sorted(set(expected) - set(prefixes))}, or has them out of order")
+    for row_index, row in enumerate(rows[1:], 1):
+        if not row or row[0] not in expected:
+            continue
+        file_id = shown_file_id(rows, row_index, 1)
+        shown = backend.content_of(file_id) if file_id in backend.files else None
+        if shown != expected[row[0]]:
+            problems.append(f"{row[0]}: cell {row[1]!r} shows "
+                            f"{hashlib.md5(shown).hexdigest() if shown else 'no image'}, "
+                            f"expected {hashlib.md5(expected[row[0]]).hexdigest()}")
+    return problems
+
+def run_single(scenario):
+    """Run one scenario in this interpreter and print any problems."""
+    from fake_google import FakeGoogleBackend
+
+    backend = FakeGoogleBackend()
+    source = backend.add_folder('source')
+    output = backend.add_folder('output')
+    os.environ.update({
+        'SOURCE_FOLDER_ID': source,
+        'OUTPUT_FOLDER_ID': output,
+        'OUTPUT_SPREADSHEET_NAME': 'Sync check',
+        'IMAGE_PREFIX_PATTERN': r'IMG\d+',
+        'COLUMN1_IDENTIFIER': 'front',
+        'COLUMN2_IDENTIFIER': 'back',
+        'COLUMN3_IDENTIFIER': 'side',
+        'ADDITIONAL_IDENTIFIERS': '',
+        'MAX_THUMBNAILS': '10000',
+        'USE_BASE64_THUMBNAILS': 'False',
+        'INCREMENTAL_SYNC': 'True',
+        'DEDUPLICATE_IMAGES': 'references',
+        'API_QUOTA_BUDGETS': 'drive=10000,sheets=10000',
+    })
+    import create_image_dataset
+    import services
+
+    services.use_http(backend.http)
+
+    expected = {}
+
+    summaries = []
+
+    def record_sync(sheets_service, spreadsheet_id, data):
+        summaries.append(sync_spreadsheet(sheets_service, spreadsheet_id, data))
+        return summaries[-1]
+
+    sync_spreadsheet = create_image_dataset.sync_spreadsheet
+    create_image_dataset.sync_spreadsheet = record_sync
+
+    def add_image(prefix, content):
+        expected[prefix] = content
+        return backend.add_file(f"{prefix}_front.jpg", source, content=content)['id']
+
+    def remove_image(prefix, file_id):
+        del expected[prefix]
+        backend.trash_file(file_id)
+
+    def build(label):
+        # Progress output goes to stderr, so stdout only carries problems
+        with contextlib.redirect_stdout(sys.stderr):
+            if not create_image_dataset.main():
+                problems.append(f"{label} failed")
+
+    problems = []
+    if scenario == 'reference-shift':
+        add_image('IMG002', b'shared image')
+        add_image('IMG003', b'shared image')
+        add_image('IMG004', b'other image')
+        build('first build')
+        add_image('IMG001', b'new image')
+        build('second build')
+    elif scenario == 'many-rows':
+        file_ids = {index: add_image(f"IMG{index * 10:05d}", b'image %d' % index) for index in range(600)}
+        build('first build')
+        add_image('IMG03005', b'new image')
+        remove_image('IMG01000', file_ids[100])
+        build('second build')
+        if summaries and summaries[-1] != {'inserted': 1, 'updated': 0, 'deleted': 1, 'unchanged': 600}:
+            problems.append(f"second sync changed more than the two rows: {summaries[-1]}")
+
+    problems += check_images(backend, next(iter(backend.spreadsheets)), expected)
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+SCENARIOS = ['reference-shift', 'many-rows']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--single', choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.single:
+        run_single(args.single)
+
+    failed = False
+    for scenario in SCENARIOS:
+        result = subprocess.run([sys.executable, __file__, '--single', scenario],
+                                capture_output=True, text=True, cwd=REPO_DIR)
+        failed = failed or result.returncode != 0
+        status = 'ok' if result.returncode == 0 else 'FAIL'
+        print(f"{status:>4} {scenario}")
+        for line in result.stdout.splitlines():
+            print(f"     {line}")
+        if result.returncode not in (0, 1):
+            print(result.stderr)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
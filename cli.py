@@ -0,0 +1,209 @@
+"""Command-line entry point for building and inspecting image datasets.
+
+Only argparse is imported up front. Settings are loaded, and the Google client libraries
+imported, by the commands that need them, so `--help` and argument errors return
+immediately; bench_importtime.py guards this.
+
+Usage:
+    python cli.py [--env-file PATH] build [--resume | --shard INDEX/COUNT | --merge [SHARD_FILE ...]] [--engine async]
+    python cli.py list [--limit N]
+    python cli.py plan [--shards N]
+    python cli.py share [--yes]
+    python cli.py cache-stats
+    python cli.py check-config
+"""
+import argparse
+import os
+import sys
+
+def load_settings():
+    """Read the .env file, or the one named by --env-file, and return the config module.
+
+    Called before the pipeline modules are imported, since they copy the settings on import.
+    """
+    import config
+
+    config.load_settings()
+    return config
+
+def command_build(args):
+    config = load_settings()
+    if args.merge is not None and not args.merge:
+        import glob
+
+        args.merge = sorted(glob.glob(os.path.join(config.SHARD_DIR, 'shard-*.jsonl')))
+        if not args.merge:
+            print(f"No shard files found in {config.SHARD_DIR}", file=sys.stderr)
+            return 1
+
+    if args.engine == 'async':
+        if args.resume or args.shard or args.merge is not None:
+            print("--engine async does not support --resume, --shard or --merge", file=sys.stderr)
+            return 2
+        import asyncio
+
+        from async_pipeline import main_async
+
+        result = asyncio.run(main_async())
+    else:
+        from create_image_dataset import main
+
+        result = main(resume=args.resume, shard=args.shard, merge_paths=args.merge)
+    return 0 if result else 1
+
+def command_list(args):
+    load_settings()
+    from itertools import islice
+
+    from create_image_dataset import iter_source_pages
+    from services import get_drive_service
+
+    files = (file for page in iter_source_pages(get_drive_service()) for file in page)
+    count = 0
+    for file in islice(files, args.limit):
+        print(f"{file['name']}\t{file['id']}\t{file.get('size', '')}\t{file.get('modifiedTime', '')}")
+        count += 1
+    print(f"{count} files", file=sys.stderr)
+    return 0
+
+def command_plan(args):
+    """List and group the source folder and report what a build would write, without downloading images."""
+    config = load_settings()
+    from collections import Counter
+
+    from create_image_dataset import get_column_identifiers, group_files_by_prefix, list_source_files, select_groups
+    from dedup import count_checksums
+    from services import get_drive_service
+    from sharding import shard_for_prefix
+
+    files = list_source_files(get_drive_service())
+    grouped_files = group_files_by_prefix(files)
+    selected = select_groups(grouped_files)
+    identifiers = get_column_identifiers()
+    images = sum(len(files_dict) for _, files_dict in selected)
+    checksums = count_checksums(selected)
+
+    print(f"Files listed:        {len(files)}")
+    print(f"Image sets found:    {len(grouped_files)}")
+    print(f"Rows to write:       {len(selected)} (MAX_THUMBNAILS={config.MAX_THUMBNAILS})")
+    print(f"Image columns:       {len(identifiers)} ({', '.join(identifiers)})")
+    print(f"Images:              {images}, {images - len(checksums)} of them repeats "
+          f"(DEDUPLICATE_IMAGES={config.DEDUPLICATE_IMAGES})")
+    print(f"Empty cells:         {len(selected) * len(identifiers) - images}")
+
+    if config.OUTPUT_BACKEND != 'sheets':
+        print(f"Output:              {config.OUTPUT_BACKEND} file")
+    elif config.PARTITION_MAX_ROWS:
+        partition_count = -(-len(selected) // config.PARTITION_MAX_ROWS)
+        print(f"Output:              at least {partition_count} partitions of up to "
+              f"{config.PARTITION_MAX_ROWS} rows ({config.PARTITION_MODE})")
+    else:
+        print(f"Output:              one sheet of {len(selected) + 1} rows x {len(identifiers) + 1} columns")
+
+    if args.shards:
+        sizes = Counter(shard_for_prefix(prefix, args.shards) for prefix, _ in selected)
+        print(f"Rows per shard:      {', '.join(str(sizes[index]) for index in range(args.shards))}")
+    return 0
+
+def command_share(args):
+    """Let anyone with the link view the images a build links to, as SHARE_LINKED_IMAGES would.
+
+    Only grouped images within MAX_THUMBNAILS are shared, never unmatched files, and only
+    after the count has been confirmed with --yes.
+    """
+    load_settings()
+    from create_image_dataset import (cell_references_supported, deduplicate_groups, group_files_by_prefix,
+                                      linked_image_files, list_source_files, select_groups, share_files)
+    from services import get_drive_service
+
+    drive_service = get_drive_service()
+    selected = select_groups(group_files_by_prefix(list_source_files(drive_service)))
+    files = linked_image_files(list(deduplicate_groups(selected, references=cell_references_supported())))
+    print(f"{len(files)} images in {len(selected)} rows would become viewable by anyone with the link")
+    if not args.yes:
+        print("Nothing was shared; run again with --yes to share them", file=sys.stderr)
+        return 1
+    shared = share_files(drive_service, files)
+    print(f"Shared {shared} of {len(files)} images")
+    return 0 if shared == len(files) else 1
+
+def command_cache_stats(args):
+    config = load_settings()
+    from thumbnail_cache import get_thumbnail_cache
+
+    cache = get_thumbnail_cache()
+    if cache is None:
+        print("The thumbnail cache is disabled (USE_THUMBNAIL_CACHE=False)")
+        return 0
+    entries, size = cache.disk_usage()
+    print(f"Directory:   {os.path.abspath(config.THUMBNAIL_CACHE_DIR)}")
+    print(f"Thumbnails:  {entries}")
+    print(f"Size:        {size} of {config.THUMBNAIL_CACHE_MAX_BYTES} bytes "
+          f"({size / config.THUMBNAIL_CACHE_MAX_BYTES:.1%})")
+    return 0
+
+def command_check_config(args):
+    config = load_settings()
+    problems = config.find_problems()
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    if problems:
+        return 1
+    print("Settings look usable")
+    return 0
+
+def parse_shard_argument(spec):
+    from sharding import parse_shard
+
+    try:
+        return parse_shard(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Build and inspect spreadsheets of image thumbnails from a Drive folder.")
+    parser.add_argument('--env-file', help="read settings from this file instead of the nearest .env")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="build the output spreadsheet or contact sheet")
+    mode = build.add_mutually_exclusive_group()
+    mode.add_argument('--resume', action='store_true',
+                      help="continue an interrupted checkpointed build recorded in CHECKPOINT_FILE")
+    mode.add_argument('--shard', type=parse_shard_argument, metavar='INDEX/COUNT',
+                      help="only build the rows of shard INDEX (zero-based) of COUNT, into a file in SHARD_DIR")
+    mode.add_argument('--merge', nargs='*', metavar='SHARD_FILE',
+                      help="write the rows of the given shard files, or of every shard file in SHARD_DIR")
+    build.add_argument('--engine', choices=['sync', 'async'], default='sync',
+                       help="run the synchronous pipeline or the asyncio engine")
+    build.set_defaults(handler=command_build)
+
+    listing = subparsers.add_parser('list', help="list the files in the source folder")
+    listing.add_argument('--limit', type=int, default=None, help="stop after this many files")
+    listing.set_defaults(handler=command_list)
+
+    plan = subparsers.add_parser('plan', help="show what a build would write, without downloading images")
+    plan.add_argument('--shards', type=int, default=0, help="also show how rows would split over this many shards")
+    plan.set_defaults(handler=command_plan)
+
+    share = subparsers.add_parser('share', help="let anyone with the link view the images a build links to")
+    share.add_argument('--yes', action='store_true', help="share them; without it, only report how many there are")
+    share.set_defaults(handler=command_share)
+
+    cache_stats = subparsers.add_parser('cache-stats', help="show the size of the local thumbnail cache")
+    cache_stats.set_defaults(handler=command_cache_stats)
+
+    check_config = subparsers.add_parser('check-config', help="report missing or invalid settings")
+    check_config.set_defaults(handler=command_check_config)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.env_file:
+        if not os.path.isfile(args.env_file):
+            parser.error(f"settings file not found: {args.env_file}")
+        os.environ['ENV_FILE'] = args.env_file
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
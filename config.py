@@ -1,14 +1,24 @@
 import os
 
-from dotenv import load_dotenv
+def load_settings(env_file=None):
+    """Load the .env file, or env_file, or the file named by ENV_FILE, and re-read every setting.
 
-# Load environment variables from .env file
-load_dotenv(override=True)
+    Importing this module only reads the process environment. Entry points call this before
+    importing the modules that copy the settings with `from config import *`.
+    """
+    import importlib
+    import sys
+
+    from dotenv import load_dotenv
+
+    load_dotenv(env_file or os.getenv('ENV_FILE'), override=True)
+    importlib.reload(sys.modules[__name__])
 
 # Google API settings
 CREDENTIALS_FILE = os.getenv('CREDENTIALS_FILE')
 SERVICE_ACCOUNT_FILE = os.getenv('SERVICE_ACCOUNT_FILE')
 TOKEN_FILE = os.getenv('TOKEN_FILE')
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 60))
 
 # Image naming patterns
 IMAGE_PREFIX_PATTERN = os.getenv('IMAGE_PREFIX_PATTERN')
@@ -17,15 +27,133 @@ COLUMN2_IDENTIFIER = os.getenv('COLUMN2_IDENTIFIER')
 COLUMN3_IDENTIFIER = os.getenv('COLUMN3_IDENTIFIER')
 ADDITIONAL_IDENTIFIERS = os.getenv('ADDITIONAL_IDENTIFIERS', '').split(',')
 
+# Filename grouping engine: 'regex' (per-file matching) or 'pandas' (vectorized). Neither is
+# reliably faster, so compare them with bench_grouping.py before switching
+GROUPING_ENGINE = os.getenv('GROUPING_ENGINE', 'regex').lower()
+
 # Display settings
 THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', 100))
 USE_BASE64_THUMBNAILS = os.getenv('USE_BASE64_THUMBNAILS', 'True').lower() == 'true'
+# Use Drive's server-side thumbnails (thumbnailLink) instead of the original files where available
+USE_DRIVE_THUMBNAILS = os.getenv('USE_DRIVE_THUMBNAILS', 'False').lower() == 'true'
 MAX_THUMBNAILS = int(os.getenv('MAX_THUMBNAILS', 100))
+# Without USE_BASE64_THUMBNAILS, cells link to the Drive files; let anyone with the link view them so they render
+SHARE_LINKED_IMAGES = os.getenv('SHARE_LINKED_IMAGES', 'False').lower() == 'true'
+
+# Thumbnail encoding settings
+RESIZE_THUMBNAILS = os.getenv('RESIZE_THUMBNAILS', 'True').lower() == 'true'
+THUMBNAIL_FORMAT = os.getenv('THUMBNAIL_FORMAT', 'JPEG').upper()
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 80))
+
+# Identical images (same md5Checksum): 'memo' fetches and encodes each image once but writes it
+# into every cell, 'references' instead points repeats at the first cell showing the image
+# (=B2-style cells) and falls back to 'memo' for partitioned, non-Sheets or INCREMENTAL_SYNC
+# output, 'off' builds every cell on its own
+DEDUPLICATE_IMAGES = os.getenv('DEDUPLICATE_IMAGES', 'memo').lower()
+
+# Thumbnail cache settings
+USE_THUMBNAIL_CACHE = os.getenv('USE_THUMBNAIL_CACHE', 'True').lower() == 'true'
+THUMBNAIL_CACHE_DIR = os.getenv('THUMBNAIL_CACHE_DIR', '.thumbnail_cache')
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Concurrency settings
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', 8))
+ENCODE_WORKERS = int(os.getenv('ENCODE_WORKERS', os.cpu_count() or 1))
+CRAWL_WORKERS = int(os.getenv('CRAWL_WORKERS', 4))
+DRIVE_QUERY_MAX_LENGTH = int(os.getenv('DRIVE_QUERY_MAX_LENGTH', 1500))
+
+# API retry and rate limiting settings
+API_MAX_RETRIES = int(os.getenv('API_MAX_RETRIES', 6))
+API_INITIAL_BACKOFF = float(os.getenv('API_INITIAL_BACKOFF', 1.0))
+API_MAX_BACKOFF = float(os.getenv('API_MAX_BACKOFF', 64.0))
+# Requests per second per endpoint, most specific method id prefix wins (e.g. drive.files.get=30)
+API_QUOTA_BUDGETS = os.getenv('API_QUOTA_BUDGETS', 'drive=20,sheets=1')
+API_MAX_IN_FLIGHT = int(os.getenv('API_MAX_IN_FLIGHT', 16))
+# Independent Drive calls (permissions, folder moves, metadata) are sent in HTTP batches of this many, at most 100
+API_BATCH_SIZE = int(os.getenv('API_BATCH_SIZE', 100))
+
+# Streaming pipeline settings
+STREAM_PIPELINE = os.getenv('STREAM_PIPELINE', 'False').lower() == 'true'
+STREAM_FLUSH_ROWS = int(os.getenv('STREAM_FLUSH_ROWS', 200))
+STREAM_FLUSH_BYTES = int(os.getenv('STREAM_FLUSH_BYTES', 5 * 1024 * 1024))
 
 # Google Drive folder IDs
 SOURCE_FOLDER_ID = os.getenv('SOURCE_FOLDER_ID')
+RECURSIVE_LISTING = os.getenv('RECURSIVE_LISTING', 'False').lower() == 'true'
+INCLUDE_FOLDER_PATHS = os.getenv('INCLUDE_FOLDER_PATHS', 'False').lower() == 'true'
 OUTPUT_FOLDER_ID = os.getenv('OUTPUT_FOLDER_ID')
 OUTPUT_SPREADSHEET_NAME = os.getenv('OUTPUT_SPREADSHEET_NAME')
 
+# Output backend: 'sheets' writes through the Sheets API; 'xlsx' and 'html' write a local contact
+# sheet to OUTPUT_FILE instead, uploaded to OUTPUT_FOLDER_ID when UPLOAD_OUTPUT_FILE is set
+OUTPUT_BACKEND = os.getenv('OUTPUT_BACKEND', 'sheets').lower()
+OUTPUT_FILE = os.getenv('OUTPUT_FILE')
+UPLOAD_OUTPUT_FILE = os.getenv('UPLOAD_OUTPUT_FILE', 'False').lower() == 'true'
+
+# Split the output across tabs once a tab would pass PARTITION_MAX_ROWS rows or
+# PARTITION_MAX_BYTES characters (0 disables a limit), with an index tab linking the parts.
+# PARTITION_MODE 'tabs' packs tabs into as few spreadsheets as SPREADSHEET_MAX_CELLS allows,
+# 'spreadsheets' gives every partition its own spreadsheet
+PARTITION_MAX_ROWS = int(os.getenv('PARTITION_MAX_ROWS', 0))
+PARTITION_MAX_BYTES = int(os.getenv('PARTITION_MAX_BYTES', 0))
+PARTITION_MODE = os.getenv('PARTITION_MODE', 'tabs').lower()
+SPREADSHEET_MAX_CELLS = int(os.getenv('SPREADSHEET_MAX_CELLS', 10_000_000))
+PARTITION_WRITE_WORKERS = int(os.getenv('PARTITION_WRITE_WORKERS', 4))
+
+# Directory for the row files of sharded builds (--shard INDEX/COUNT) until they are merged (--merge)
+SHARD_DIR = os.getenv('SHARD_DIR', '.shards')
+
+# Keep a local metadata index of the source folder and only fetch Drive changes. Only the
+# source folder itself is indexed, so this cannot be combined with RECURSIVE_LISTING
+USE_CHANGES_INDEX = os.getenv('USE_CHANGES_INDEX', 'False').lower() == 'true'
+DRIVE_INDEX_FILE = os.getenv('DRIVE_INDEX_FILE', '.drive_index.sqlite3')
+
+# Only rewrite the rows that changed instead of clearing the whole sheet; a hash of each row
+# is kept on a hidden '_row_fingerprints' sheet
+INCREMENTAL_SYNC = os.getenv('INCREMENTAL_SYNC', 'False').lower() == 'true'
+
+# Write rows in flushed chunks and journal progress so an interrupted build can be resumed
+CHECKPOINTING = os.getenv('CHECKPOINTING', 'False').lower() == 'true'
+CHECKPOINT_FILE = os.getenv('CHECKPOINT_FILE', '.build_checkpoint.sqlite3')
+
+# Run metrics: a JSON report and a Prometheus textfile-collector file, each written when set
+METRICS_REPORT_FILE = os.getenv('METRICS_REPORT_FILE')
+METRICS_PROMETHEUS_FILE = os.getenv('METRICS_PROMETHEUS_FILE')
+
 # Debug mode
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
+
+def find_problems():
+    """Return a description of every missing or invalid setting; an empty list means the settings look usable."""
+    import re
+
+    problems = []
+    for name in ('SOURCE_FOLDER_ID', 'IMAGE_PREFIX_PATTERN', 'COLUMN1_IDENTIFIER'):
+        if not globals()[name]:
+            problems.append(f"{name} is not set")
+    if OUTPUT_BACKEND == 'sheets' or UPLOAD_OUTPUT_FILE:
+        for name in ('OUTPUT_FOLDER_ID', 'OUTPUT_SPREADSHEET_NAME'):
+            if not globals()[name]:
+                problems.append(f"{name} is not set")
+    if IMAGE_PREFIX_PATTERN:
+        try:
+            re.compile(IMAGE_PREFIX_PATTERN)
+        except re.error as e:
+            problems.append(f"IMAGE_PREFIX_PATTERN is not a valid regular expression: {e}")
+
+    if RECURSIVE_LISTING and USE_CHANGES_INDEX:
+        problems.append("USE_CHANGES_INDEX only covers a single folder and cannot be combined with RECURSIVE_LISTING")
+
+    choices = {
+        'GROUPING_ENGINE': ('regex', 'pandas'),
+        'DEDUPLICATE_IMAGES': ('references', 'memo', 'off'),
+        'OUTPUT_BACKEND': ('sheets', 'xlsx', 'html'),
+        'PARTITION_MODE': ('tabs', 'spreadsheets'),
+    }
+    for name, allowed in choices.items():
+        if globals()[name] not in allowed:
+            problems.append(f"{name} is {globals()[name]!r}, expected one of: {', '.join(allowed)}")
+
+    if not any(path and os.path.exists(path) for path in (SERVICE_ACCOUNT_FILE, TOKEN_FILE, CREDENTIALS_FILE)):
+        problems.append("None of SERVICE_ACCOUNT_FILE, TOKEN_FILE or CREDENTIALS_FILE points to an existing file")
+    return problems
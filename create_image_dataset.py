@@ -1,129 +1,445 @@
+import glob
 import os
 import re
-import base64
 import io
 import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from functools import partial
+from itertools import chain, compress, islice
 
-from dotenv import load_dotenv
-from googleapiclient.http import MediaIoBaseDownload
-import pandas as pd
-
+if __name__ == "__main__":
+    # Run as a script: load the .env settings before the imports below copy them
+    import config
+    config.load_settings()
 
+from api_requests import call_with_retry, execute, execute_batch
+from base64_writer import Base64Writer, EncodedSizeExceeded
+from dedup import count_checksums, dedup_stats, image_memo, plan_duplicate_references
 from config import *
-from services import get_drive_service, get_sheets_service
+from drive_index import DriveIndex, fetch_changes
+from metrics import metrics
+from output_backends import write_contact_sheet
+from partitioned_output import (assign_partitions, full_range, index_rows, layout_requests,
+                                 partition_rows, partition_title, INDEX_SHEET_TITLE)
+from run_journal import RunJournal
+from sharding import check_shards, merge_shard_rows, parse_shard, shard_for_prefix, shard_path, write_shard_file
+from sheet_sync import column_letter, find_fingerprint_sheet, sync_spreadsheet
+from services import (get_authorized_http, get_drive_service, get_sheets_service, get_thread_drive_service,
+                      get_thread_sheets_service)
+from thumbnail_cache import get_thumbnail_cache
+from thumbnails import make_thumbnail, thumbnail_stats
 
 
 logging.basicConfig(level=logging.DEBUG if DEBUG else logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def list_files_in_folder(drive_service, folder_id):
-    """List all files in the specified Google Drive folder."""
-    results = []
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+FILE_FIELDS = 'id, name, mimeType, md5Checksum, modifiedTime, size' + (', thumbnailLink' if USE_DRIVE_THUMBNAILS else '')
+LISTING_FIELDS = f'nextPageToken, files({FILE_FIELDS})'
+
+# Google Sheets rejects any cell holding more than this many characters
+SHEETS_CELL_CHAR_LIMIT = 50000
+
+# Larger uploads go through a resumable session instead of a single multipart request
+SIMPLE_UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+
+def iter_query_pages(drive_service, query, fields=LISTING_FIELDS):
+    """Yield the files matching a Drive search query one listing page at a time, in name order.
+
+    Each page request is timed as the list_files_page stage, which stays comparable when
+    the pages are consumed lazily and the consumer's own work runs in between.
+    """
     page_token = None
     
     while True:
-        response = drive_service.files().list(
-            q=f"'{folder_id}' in parents and trashed=false",
-            spaces='drive',
-            fields='nextPageToken, files(id, name, mimeType)',
-            pageToken=page_token
-        ).execute()
+        with metrics.stage('list_files_page'):
+            response = execute(drive_service.files().list(
+                q=query,
+                spaces='drive',
+                fields=fields,
+                orderBy='name',
+                pageToken=page_token
+            ))
         
-        results.extend(response.get('files', []))
+        yield response.get('files', [])
         page_token = response.get('nextPageToken')
         
         if not page_token:
             break
+
+def iter_file_pages(drive_service, folder_id):
+    """Yield the files in the specified Google Drive folder one listing page at a time.
+
+    Files are listed in name order, so all files sharing a prefix arrive contiguously.
+    """
+    return iter_query_pages(drive_service, f"'{folder_id}' in parents and trashed=false")
+
+@metrics.timed()
+def list_files_in_folder(drive_service, folder_id):
+    """List all files in the specified Google Drive folder."""
+    results = []
+    for page in iter_file_pages(drive_service, folder_id):
+        results.extend(page)
     
     if DEBUG:
         print(f"Found {len(results)} files in folder {folder_id}")
         
     return results
 
-def download_file_as_base64(drive_service, file_id):
-    """Download a file from Drive and convert it to base64."""
+def _parents_query(folder_ids):
+    parents = ' or '.join(f"'{folder_id}' in parents" for folder_id in folder_ids)
+    return f"({parents}) and trashed=false"
+
+def batch_folder_ids(folder_ids, max_query_length=None):
+    """Split folder ids into batches whose combined parents query fits the query length limit."""
+    max_query_length = max_query_length or DRIVE_QUERY_MAX_LENGTH
+    base_length = len(_parents_query([]))
+    batches = []
+    batch, length = [], base_length
+    
+    for folder_id in folder_ids:
+        term_length = len(f"'{folder_id}' in parents or ")
+        if batch and length + term_length > max_query_length:
+            batches.append(batch)
+            batch, length = [], base_length
+        batch.append(folder_id)
+        length += term_length
+    
+    if batch:
+        batches.append(batch)
+    return batches
+
+def list_children(drive_service, folder_ids):
+    """List the direct children of several folders with one combined parents query."""
+    results = []
+    for page in iter_query_pages(drive_service, _parents_query(folder_ids),
+                                 fields=f'nextPageToken, files({FILE_FIELDS}, parents)'):
+        results.extend(page)
+    return results
+
+def _list_children_in_worker(folder_ids):
+    """List folder children using the calling worker thread's own Drive service."""
+    return list_children(get_thread_drive_service(), folder_ids)
+
+@metrics.timed()
+def crawl_folder_tree(drive_service, root_folder_id, include_paths=False):
+    """List every file below a folder, descending into subfolders one level at a time.
+
+    Each level's folders are batched into combined parents queries that are listed on up
+    to CRAWL_WORKERS threads. The merged listing has the same shape as list_files_in_folder;
+    with include_paths each file also gets a 'folderPath' relative to the root folder.
+    """
+    folder_paths = {root_folder_id: ''}
+    seen_file_ids = set()
+    results = []
+    level = [root_folder_id]
+    
+    with ThreadPoolExecutor(max_workers=max(CRAWL_WORKERS, 1)) as executor:
+        while level:
+            batches = batch_folder_ids(level)
+            if CRAWL_WORKERS > 1 and len(batches) > 1:
+                listings = executor.map(_list_children_in_worker, batches)
+            else:
+                listings = (list_children(drive_service, batch) for batch in batches)
+            
+            next_level = []
+            for batch, files in zip(batches, listings):
+                batch_ids = set(batch)
+                for file in files:
+                    parent = next((parent for parent in file.get('parents', []) if parent in batch_ids), root_folder_id)
+                    path = folder_paths[parent]
+                    
+                    if file['mimeType'] == FOLDER_MIME_TYPE:
+                        # A folder reachable through several parents is only crawled once
+                        if file['id'] not in folder_paths:
+                            folder_paths[file['id']] = f"{path}/{file['name']}" if path else file['name']
+                            next_level.append(file['id'])
+                        continue
+                    
+                    if file['id'] in seen_file_ids:
+                        continue
+                    seen_file_ids.add(file['id'])
+                    
+                    file.pop('parents', None)
+                    if include_paths:
+                        file['folderPath'] = path
+                    results.append(file)
+            
+            level = next_level
+    
+    if DEBUG:
+        print(f"Found {len(results)} files in {len(folder_paths)} folders under {root_folder_id}")
+    
+    return results
+
+def iter_source_pages(drive_service):
+    """Yield listing pages for SOURCE_FOLDER_ID according to the configured listing mode."""
+    if RECURSIVE_LISTING:
+        if USE_CHANGES_INDEX:
+            logger.warning("USE_CHANGES_INDEX is ignored when RECURSIVE_LISTING is enabled")
+        # Sort the merged listing so prefixes stay contiguous across subfolders
+        files = crawl_folder_tree(drive_service, SOURCE_FOLDER_ID, include_paths=INCLUDE_FOLDER_PATHS)
+        yield sorted(files, key=lambda file: file['name'])
+    elif USE_CHANGES_INDEX:
+        yield list_files_incremental(drive_service, SOURCE_FOLDER_ID)
+    else:
+        yield from iter_file_pages(drive_service, SOURCE_FOLDER_ID)
+
+def list_source_files(drive_service):
+    """List SOURCE_FOLDER_ID according to the configured listing mode."""
+    return [file for page in iter_source_pages(drive_service) for file in page]
+
+@metrics.timed()
+def list_files_incremental(drive_service, folder_id, index_path=None):
+    """List a folder from the local metadata index, fetching only Drive changes since the last run.
+
+    Falls back to a full listing when the folder has no stored start page token or Drive
+    rejects it as expired.
+    """
+    from googleapiclient.errors import HttpError
+    
+    index = DriveIndex(index_path or DRIVE_INDEX_FILE)
+    try:
+        start_page_token = index.get_start_page_token(folder_id)
+        if start_page_token:
+            try:
+                changes, new_start_page_token = fetch_changes(drive_service, start_page_token, FILE_FIELDS)
+                index.apply_changes(folder_id, changes, new_start_page_token)
+                if DEBUG:
+                    print(f"Applied {len(changes)} Drive changes to the index of folder {folder_id}")
+                return index.list_files(folder_id)
+            except HttpError as e:
+                if e.resp.status not in (400, 404, 410):
+                    raise
+                logger.warning(f"Stored start page token for folder {folder_id} was rejected, "
+                               f"falling back to a full listing: {e}")
+        
+        # Take the token before listing so changes made during the listing are replayed next run
+        start_page_token = execute(drive_service.changes().getStartPageToken())['startPageToken']
+        files = list_files_in_folder(drive_service, folder_id)
+        index.replace_folder(folder_id, files, start_page_token)
+        return index.list_files(folder_id)
+    finally:
+        index.close()
+
+@metrics.timed()
+def download_to(drive_service, file_id, fd, chunk_size=None):
+    """Download a file from Drive into a writable file object, one chunk_size range at a time."""
+    from googleapiclient.http import DEFAULT_CHUNK_SIZE, MediaIoBaseDownload
+    
     request = drive_service.files().get_media(fileId=file_id)
-    file_content = io.BytesIO()
-    downloader = MediaIoBaseDownload(file_content, request)
+    downloader = MediaIoBaseDownload(fd, request, chunksize=chunk_size or DEFAULT_CHUNK_SIZE)
     
+    start = fd.tell()
     done = False
-    while done is False:
-        status, done = downloader.next_chunk()
-    
-    file_content.seek(0)
-    return base64.b64encode(file_content.read()).decode('utf-8')
-
-def create_or_get_spreadsheet(drive_service, sheets_service, name, folder_id):
-    """Create a new Google Sheet or get an existing one with the given name."""
-    # Check if spreadsheet already exists in the folder
-    response = drive_service.files().list(
-        q=f"name='{name}' and '{folder_id}' in parents and mimeType='application/vnd.google-apps.spreadsheet' and trashed=false",
-        spaces='drive',
-        fields='files(id, name)'
-    ).execute()
-    
-    files = response.get('files', [])
-    
-    if files:
-        # Use existing spreadsheet
-        spreadsheet_id = files[0]['id']
-        if DEBUG:
-            print(f"Using existing spreadsheet: {spreadsheet_id}")
-        
-        # Clear existing content
-        sheet_metadata = sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-        sheets = sheet_metadata.get('sheets', '')
-        if sheets:
-            sheet_id = sheets[0]['properties']['sheetId']
-            sheets_service.spreadsheets().batchUpdate(
-                spreadsheetId=spreadsheet_id,
-                body={
-                    "requests": [
-                        {
-                            "updateCells": {
-                                "range": {
-                                    "sheetId": sheet_id,
-                                    "startRowIndex": 0,
-                                    "startColumnIndex": 0
-                                },
-                                "fields": "userEnteredValue"
-                            }
+    try:
+        while done is False:
+            status, done = call_with_retry(downloader.next_chunk, request.methodId)
+    finally:
+        metrics.add_bytes_downloaded(fd.tell() - start)
+
+def download_file(drive_service, file_id):
+    """Download a file from Drive and return its content as bytes."""
+    file_content = io.BytesIO()
+    download_to(drive_service, file_id, file_content)
+    return file_content.getvalue()
+
+def encoded_length(size):
+    """Return the base64 length of size bytes."""
+    return 4 * math.ceil(size / 3)
+
+def stream_file_as_base64(drive_service, file_id, max_length=None, keep_data=False):
+    """Download a file from Drive into a Base64Writer, encoding each chunk as it arrives.
+
+    With max_length, chunks are sized so that a file too large to fit is abandoned after
+    its first chunk, raising EncodedSizeExceeded.
+    """
+    writer = Base64Writer(max_length, keep_data=keep_data)
+    chunk_size = (max_length // 4 + 1) * 3 if max_length else None
+    download_to(drive_service, file_id, writer, chunk_size)
+    return writer
+
+@metrics.timed()
+def encode_thumbnail(data, encode_pool=None):
+    """Downscale downloaded image bytes to THUMBNAIL_SIZE, in encode_pool when given.
+
+    Returns a (bytes, mime_type) tuple.
+    """
+    args = (data, THUMBNAIL_SIZE, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY)
+    if encode_pool is not None:
+        thumbnail, mime_type = encode_pool.submit(make_thumbnail, *args).result()
+    else:
+        thumbnail, mime_type = make_thumbnail(*args)
+    
+    thumbnail_stats.record(len(data), len(thumbnail))
+    return thumbnail, mime_type
+
+def create_or_get_spreadsheet(drive_service, sheets_service, name, folder_id, clear=True):
+    """Create a new Google Sheet or get an existing one with the given name.
+
+    An existing spreadsheet has its first sheet cleared unless clear is False.
+    """
+    return create_or_get_spreadsheets(drive_service, sheets_service, [name], folder_id, clear)[0]
+
+def create_or_get_spreadsheets(drive_service, sheets_service, names, folder_id, clear=True):
+    """Create or get a Google Sheet for each of names, returning their ids in the same order.
+
+    The lookups, and the moves of new spreadsheets into folder_id, go out as batched Drive calls.
+    """
+    # Check if the spreadsheets already exist in the folder
+    lookups = execute_batch(drive_service, [
+        drive_service.files().list(
+            q=f"name='{name}' and '{folder_id}' in parents and mimeType='application/vnd.google-apps.spreadsheet' and trashed=false",
+            spaces='drive',
+            fields='files(id, name)'
+        )
+        for name in names
+    ])
+    
+    spreadsheet_ids = []
+    created_ids = []
+    for name, (response, error) in zip(names, lookups):
+        if error is not None:
+            raise error
+        files = response.get('files', [])
+        
+        if files:
+            # Use existing spreadsheet
+            spreadsheet_id = files[0]['id']
+            if DEBUG:
+                print(f"Using existing spreadsheet: {spreadsheet_id}")
+            
+            # Clear existing content
+            sheet_metadata = execute(sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id))
+            sheets = sheet_metadata.get('sheets', '')
+            if sheets and clear:
+                sheet_id = sheets[0]['properties']['sheetId']
+                requests = [
+                    {
+                        "updateCells": {
+                            "range": {
+                                "sheetId": sheet_id,
+                                "startRowIndex": 0,
+                                "startColumnIndex": 0
+                            },
+                            "fields": "userEnteredValue"
                         }
-                    ]
+                    }
+                ]
+                fingerprint_sheet = find_fingerprint_sheet([sheet['properties'] for sheet in sheets])
+                if fingerprint_sheet:
+                    # Rows rewritten from scratch no longer match the incremental sync's fingerprints
+                    requests.append({"deleteSheet": {"sheetId": fingerprint_sheet['sheetId']}})
+                execute(sheets_service.spreadsheets().batchUpdate(
+                    spreadsheetId=spreadsheet_id,
+                    body={"requests": requests}
+                ))
+        else:
+            # Create new spreadsheet
+            spreadsheet = {
+                'properties': {
+                    'title': name
                 }
-            ).execute()
-    else:
-        # Create new spreadsheet
-        spreadsheet = {
-            'properties': {
-                'title': name
             }
-        }
-        spreadsheet = sheets_service.spreadsheets().create(body=spreadsheet).execute()
-        spreadsheet_id = spreadsheet['spreadsheetId']
-        
-        # Move to correct folder
-        file = drive_service.files().get(
-            fileId=spreadsheet_id, 
-            fields='parents'
-        ).execute()
-        
-        previous_parents = ",".join(file.get('parents', []))
-        drive_service.files().update(
-            fileId=spreadsheet_id,
-            addParents=folder_id,
-            removeParents=previous_parents,
-            fields='id, parents'
-        ).execute()
+            spreadsheet = execute(sheets_service.spreadsheets().create(body=spreadsheet))
+            spreadsheet_id = spreadsheet['spreadsheetId']
+            created_ids.append(spreadsheet_id)
+            
+            if DEBUG:
+                print(f"Created new spreadsheet: {spreadsheet_id}")
         
-        if DEBUG:
-            print(f"Created new spreadsheet: {spreadsheet_id}")
+        spreadsheet_ids.append(spreadsheet_id)
+    
+    # Move new spreadsheets to the correct folder
+    move_files_to_folder(drive_service, created_ids, folder_id)
     
-    return spreadsheet_id
+    return spreadsheet_ids
 
-def group_files_by_prefix(files):
-    """Group files based on their prefix from the filename pattern."""
+def move_files_to_folder(drive_service, file_ids, folder_id):
+    """Move files into folder_id, out of their current parents, with batched Drive calls."""
+    lookups = execute_batch(drive_service, [
+        drive_service.files().get(fileId=file_id, fields='parents') for file_id in file_ids
+    ])
+    updates = []
+    for file_id, (file, error) in zip(file_ids, lookups):
+        if error is not None:
+            raise error
+        updates.append(drive_service.files().update(
+            fileId=file_id,
+            addParents=folder_id,
+            removeParents=",".join(file.get('parents', [])),
+            fields='id, parents'
+        ))
+    for _, error in execute_batch(drive_service, updates):
+        if error is not None:
+            raise error
+
+def share_files(drive_service, files):
+    """Let anyone with the link view files, with batched permission calls. Returns how many were shared.
+
+    A file that cannot be shared is logged and skipped; its cell just shows no image.
+    """
+    requests = [
+        drive_service.permissions().create(
+            fileId=file_info['id'],
+            body={'type': 'anyone', 'role': 'reader'},
+            fields='id'
+        )
+        for file_info in files
+    ]
+    shared = 0
+    for file_info, (_, error) in zip(files, execute_batch(drive_service, requests)):
+        if error is not None:
+            logger.warning(f"Could not set public permission for file {file_info['name']}: {error}")
+        else:
+            shared += 1
+    metrics.count('files_shared', shared)
+    return shared
+
+def linked_image_files(groups):
+    """Return the files that (prefix, files_dict) groups show as images, in sheet order.
+
+    Repeated images refer to the cell showing the first copy, so they are left out.
+    """
+    return [file_info for _, files_dict in groups for file_info in files_dict.values()
+            if not file_info.get('duplicateOf')]
+
+def share_linked_images(drive_service, groups):
+    """Yield (prefix, files_dict) groups, first sharing the images their cells link to when SHARE_LINKED_IMAGES is set.
+
+    Linked =IMAGE formulas only render files anyone with the link can view. Groups are
+    shared API_BATCH_SIZE at a time, so groups may be a stream.
+    """
+    if not SHARE_LINKED_IMAGES or USE_BASE64_THUMBNAILS:
+        yield from groups
+        return
+    groups = iter(groups)
+    while True:
+        chunk = list(islice(groups, API_BATCH_SIZE))
+        if not chunk:
+            return
+        share_files(drive_service, linked_image_files(chunk))
+        yield from chunk
+
+def get_file_info(file):
+    """Return the listing fields kept for a grouped file."""
+    return {
+        'id': file['id'],
+        'name': file['name'],
+        'mimeType': file.get('mimeType'),
+        'md5Checksum': file.get('md5Checksum'),
+        'modifiedTime': file.get('modifiedTime'),
+        'size': file.get('size'),
+        'thumbnailLink': file.get('thumbnailLink'),
+        'folderPath': file.get('folderPath')
+    }
+
+def compile_file_matcher():
+    """Return a function mapping a listed file to (prefix, identifier, file_info), or None."""
     # Create regex pattern for matching filenames
     base_identifiers = [COLUMN1_IDENTIFIER, COLUMN2_IDENTIFIER, COLUMN3_IDENTIFIER]
     all_identifiers = base_identifiers + ADDITIONAL_IDENTIFIERS
@@ -135,51 +451,313 @@ def group_files_by_prefix(files):
     pattern = f"^({IMAGE_PREFIX_PATTERN})_.*({identifiers_pattern}).*\\.(jpe?g|png|gif|bmp|tiff?)$"
     regex = re.compile(pattern, re.IGNORECASE)
     
-    grouped_files = {}
-    for file in files:
+    def match_file(file):
         filename = file['name']
         match = regex.match(filename)
         
-        if match:
-            prefix = match.group(1)
-            identifier = None
-            
-            # Determine which identifier is in the filename
-            for id_type in all_identifiers:
-                if re.search(f"_{id_type}", filename.lower()):
-                    identifier = id_type
-                    break
-            
-            if not identifier:
-                if DEBUG:
-                    print(f"Warning: Matched prefix but couldn't determine identifier type for {filename}")
-                continue
-                
-            if prefix not in grouped_files:
-                grouped_files[prefix] = {}
+        if not match:
+            return None
+        
+        prefix = match.group(1)
+        identifier = None
+        
+        # Determine which identifier is in the filename
+        for id_type in all_identifiers:
+            if re.search(f"_{id_type}", filename.lower()):
+                identifier = id_type
+                break
+        
+        if not identifier:
+            if DEBUG:
+                print(f"Warning: Matched prefix but couldn't determine identifier type for {filename}")
+            return None
+        
+        # Store file info with its identifier type
+        return prefix, identifier, get_file_info(file)
+    
+    return match_file
+
+def _extract_prefix_and_identifier(names, pattern):
+    """Run str.extract over names, on Arrow strings (vectorized RE2) when pyarrow is installed."""
+    import pandas as pd
+    
+    try:
+        import pyarrow
+        arrow_names = pd.Series(names, dtype=pd.ArrowDtype(pyarrow.string()))
+        return arrow_names.str.extract(pattern)
+    except (ImportError, ValueError, NotImplementedError):
+        # RE2 rejects some patterns (e.g. lookarounds), so fall back to Python's re
+        return pd.Series(names, dtype=object).str.extract(pattern)
+
+def build_grouping_frame(files):
+    """Pivot a listing into a prefix x identifier DataFrame of listing positions.
+
+    Prefix and identifier come out of a single vectorized str.extract. As in the regex
+    engine, a name holding several "_<identifier>" tokens belongs to the first configured
+    identifier among them: the pattern has one alternative per identifier, in column order,
+    and the first alternative that matches wins. Prefixes keep their order of first
+    appearance and, as in the regex engine, a later file wins when a prefix repeats an
+    identifier.
+    """
+    # pandas is only needed by this engine and is slow to import, so it is loaded on first use
+    import numpy as np
+    import pandas as pd
+    
+    identifiers = get_column_identifiers()
+    identifier_lookup = {identifier.lower(): identifier for identifier in identifiers}
+    # The optional group is lazy so each alternative finds its earliest token
+    identifiers_pattern = '|'.join(f"_(?:.*?_)??(?P<identifier{index}>{identifier})"
+                                   for index, identifier in enumerate(identifiers))
+    pattern = (f"(?i)^(?P<prefix>{IMAGE_PREFIX_PATTERN})(?:{identifiers_pattern})"
+               f".*\\.(?:jpe?g|png|gif|bmp|tiff?)$")
+    
+    extracted = _extract_prefix_and_identifier([file['name'] for file in files], pattern)
+    # Only the matching alternative's group is set, and RE2 leaves the others empty rather
+    # than missing, so joining the groups gives each name's identifier
+    identifier = extracted['identifier0'].fillna('')
+    for index in range(1, len(identifiers)):
+        identifier = identifier + extracted[f"identifier{index}"].fillna('')
+    identifier_codes, identifier_values = pd.factorize(identifier.where(identifier != '').str.lower())
+    prefix_codes, prefix_values = pd.factorize(extracted['prefix'])
+    
+    # factorize numbers prefixes by first appearance, so rows come out in listing order;
+    # taking the maximum position per cell lets a later file win, as in the regex engine
+    matched = (prefix_codes >= 0) & (identifier_codes >= 0)
+    positions = np.full((len(prefix_values), len(identifier_values)), -1)
+    np.maximum.at(positions, (prefix_codes[matched], identifier_codes[matched]), np.flatnonzero(matched))
+    
+    return pd.DataFrame(
+        np.where(positions >= 0, positions, np.nan),
+        index=pd.Index(list(prefix_values), name='prefix', dtype=object),
+        columns=[identifier_lookup[identifier] for identifier in identifier_values]
+    )
+
+def group_files_by_prefix_vectorized(files):
+    """Group files by prefix using the pandas engine, in the same shape as group_files_by_prefix."""
+    grid = build_grouping_frame(files)
+    prefixes = grid.index.tolist()
+    
+    grouped_files = {prefix: {} for prefix in prefixes}
+    for identifier in grid.columns:
+        column = grid[identifier]
+        present = column.notna().to_numpy()
+        positions = column[present].astype(int).tolist()
+        for prefix, position in zip(compress(prefixes, present), positions):
+            grouped_files[prefix][identifier] = get_file_info(files[position])
+    return grouped_files
+
+@metrics.timed()
+def group_files_by_prefix(files):
+    """Group files based on their prefix from the filename pattern."""
+    if GROUPING_ENGINE == 'pandas':
+        grouped_files = group_files_by_prefix_vectorized(files)
+    else:
+        match_file = compile_file_matcher()
+        
+        grouped_files = {}
+        for file in files:
+            matched = match_file(file)
             
-            # Store file info with its identifier type
-            grouped_files[prefix][identifier] = {
-                'id': file['id'],
-                'name': file['name']
-            }
+            if matched:
+                prefix, identifier, file_info = matched
+                grouped_files.setdefault(prefix, {})[identifier] = file_info
     
     if DEBUG:
         print(f"Grouped files into {len(grouped_files)} sets")
         
     return grouped_files
 
-def create_image_cell_value(drive_service, file_info):
+def iter_groups_by_prefix(pages):
+    """Group streamed listing pages by prefix, yielding (prefix, files_dict) once each group is complete.
+
+    Pages must come in name order so that a prefix's files are contiguous. A group stays
+    open across page boundaries and is only yielded once a file with another prefix arrives.
+    """
+    match_file = compile_file_matcher()
+    emitted_prefixes = set()
+    current_prefix, current_files = None, {}
+    
+    for page in pages:
+        for file in page:
+            matched = match_file(file)
+            if not matched:
+                continue
+            
+            prefix, identifier, file_info = matched
+            if prefix != current_prefix:
+                if current_prefix is not None:
+                    emitted_prefixes.add(current_prefix)
+                    yield current_prefix, current_files
+                if prefix in emitted_prefixes:
+                    logger.warning(f"Files for prefix {prefix} were not listed contiguously; "
+                                   f"it will appear in more than one row")
+                current_prefix, current_files = prefix, {}
+            
+            current_files[identifier] = file_info
+    
+    if current_prefix is not None:
+        yield current_prefix, current_files
+
+def _thumbnail_variant():
+    """Describe the encoding settings so that changing them invalidates cached thumbnails."""
+    if not RESIZE_THUMBNAILS:
+        return 'original'
+    return f"{THUMBNAIL_SIZE}:{THUMBNAIL_FORMAT}:{THUMBNAIL_QUALITY}"
+
+def _image_formula_parts(mime_type):
+    """Return the text around the base64 data of an embedded =IMAGE formula."""
+    return f'=IMAGE("data:{mime_type};base64,', '", 1)'
+
+def _base64_budget(mime_type):
+    """Return how many base64 characters fit in one cell next to the formula text.
+
+    Local output files have no cell size limit, so their budget is None.
+    """
+    if OUTPUT_BACKEND != 'sheets':
+        return None
+    prefix, suffix = _image_formula_parts(mime_type)
+    return SHEETS_CELL_CHAR_LIMIT - len(prefix) - len(suffix)
+
+def _encode_bytes(data, mime_type):
+    writer = Base64Writer(_base64_budget(mime_type))
+    writer.write(data)
+    return writer
+
+def sized_thumbnail_link(link, size):
+    """Rewrite a thumbnailLink to ask Drive for a thumbnail whose longest side is size pixels."""
+    base = re.sub(r'=s\d+$', '', link)
+    return f"{base}=s{size}"
+
+def fetch_drive_thumbnail(file_info):
+    """Fetch Drive's server-side thumbnail of a file at THUMBNAIL_SIZE.
+
+    Returns (bytes, mime_type), or None when the thumbnail cannot be fetched.
+    """
+    from googleapiclient.errors import HttpError
+    
+    url = sized_thumbnail_link(file_info['thumbnailLink'], THUMBNAIL_SIZE)
+    http = get_authorized_http()
+    
+    def fetch():
+        response, content = http.request(url)
+        if response.status >= 400:
+            raise HttpError(response, content, uri=url)
+        return response, content
+    
+    try:
+        response, content = call_with_retry(fetch, 'drive.thumbnails.get')
+    except HttpError as e:
+        logger.warning(f"Could not fetch Drive thumbnail for {file_info['name']}: {e}")
+        return None
+    
+    metrics.add_bytes_downloaded(len(content))
+    return content, response.get('content-type', 'image/jpeg').split(';')[0]
+
+def _encode_drive_thumbnail(file_info):
+    """Return (Base64Writer, mime_type) for a file's Drive thumbnail, or None if it has none."""
+    cache = get_thumbnail_cache()
+    cache_key = cache.key_for(file_info, f"drive:{THUMBNAIL_SIZE}") if cache else None
+    if cache_key:
+        cached = cache.get(cache_key)
+        if cached:
+            logger.debug(f"Using cached Drive thumbnail for {file_info['name']} (ID: {file_info['id']})")
+            data, mime_type = cached
+            return _encode_bytes(data, mime_type), mime_type
+    
+    logger.info(f"Fetching Drive thumbnail of {file_info['name']} (ID: {file_info['id']})")
+    thumbnail = fetch_drive_thumbnail(file_info)
+    if thumbnail is None:
+        return None
+    
+    data, mime_type = thumbnail
+    if cache_key:
+        cache.put(cache_key, data, mime_type)
+    return _encode_bytes(data, mime_type), mime_type
+
+def encode_embedded_image(drive_service, file_info, encode_pool=None):
+    """Return (Base64Writer, mime_type) for the image to embed, consulting the thumbnail cache first.
+
+    Raises EncodedSizeExceeded when the image cannot fit in a Sheets cell. Originals are
+    encoded while they download, so one that is too large costs at most one chunk, or no
+    download at all when its listed size already rules it out. With USE_DRIVE_THUMBNAILS,
+    Drive's own thumbnail is used for files that have one.
+    """
+    file_id = file_info['id']
+    file_name = file_info['name']
+    mime_type = file_info.get('mimeType') or 'image/jpeg'
+    
+    if USE_DRIVE_THUMBNAILS and file_info.get('thumbnailLink'):
+        encoded = _encode_drive_thumbnail(file_info)
+        if encoded:
+            return encoded
+    
+    cache = get_thumbnail_cache()
+    cache_key = cache.key_for(file_info, _thumbnail_variant()) if cache else None
+    if cache_key:
+        cached = cache.get(cache_key)
+        if cached:
+            logger.debug(f"Using cached thumbnail for {file_name} (ID: {file_id})")
+            data, mime_type = cached
+            return _encode_bytes(data, mime_type), mime_type
+    
+    logger.info(f"Downloading and encoding {file_name} (ID: {file_id}) as base64")
+    if not RESIZE_THUMBNAILS:
+        budget = _base64_budget(mime_type)
+        size = file_info.get('size')
+        if budget is not None and size is not None and encoded_length(int(size)) > budget:
+            raise EncodedSizeExceeded(f"{size} byte file needs {encoded_length(int(size))} of {budget} characters")
+        writer = stream_file_as_base64(drive_service, file_id, budget, keep_data=cache_key is not None)
+        if cache_key:
+            cache.put(cache_key, writer.data, mime_type)
+        return writer, mime_type
+    
+    data = download_file(drive_service, file_id)
+    try:
+        data, mime_type = encode_thumbnail(data, encode_pool)
+    except Exception as e:
+        logger.warning(f"Could not create thumbnail for {file_name}, embedding original: {e}")
+    
+    if cache_key:
+        cache.put(cache_key, data, mime_type)
+    
+    return _encode_bytes(data, mime_type), mime_type
+
+def create_image_cell_value(drive_service, file_info, encode_pool=None):
+    """Return the cell for a file: a reference to an identical image already in the sheet, or an =IMAGE formula."""
+    dedup_stats.record_image(file_info.get('md5Checksum'))
+    if file_info.get('duplicateOf'):
+        dedup_stats.record_reference()
+        return f"={file_info['duplicateOf']}"
+    if DEDUPLICATE_IMAGES in ('references', 'memo') and USE_BASE64_THUMBNAILS:
+        return image_memo.get_or_build(file_info.get('md5Checksum'),
+                                       partial(create_image_formula, drive_service, file_info, encode_pool))
+    return create_image_formula(drive_service, file_info, encode_pool)
+
+def create_image_formula(drive_service, file_info, encode_pool=None):
+    """Return the =IMAGE formula for a file, linking to Drive when it cannot be embedded."""
     file_id = file_info['id']
     file_name = file_info['name']
     
     if USE_BASE64_THUMBNAILS:
-        logger.info(f"Downloading and encoding {file_name} (ID: {file_id}) as base64")
-        base64_data = download_file_as_base64(drive_service, file_id)
-        return f'=IMAGE("data:image/jpeg;base64,{base64_data}", 1)'
+        start = time.perf_counter()
+        try:
+            writer, mime_type = encode_embedded_image(drive_service, file_info, encode_pool)
+            formula = writer.wrap(*_image_formula_parts(mime_type))
+        except EncodedSizeExceeded as e:
+            logger.warning(f"{file_name} (ID: {file_id}) is too large to embed in a cell, linking instead: {e}")
+            metrics.count('images_too_large_to_embed')
+            formula = None
+        metrics.record_file_latency(time.perf_counter() - start)
+        if formula is not None:
+            metrics.add_bytes_encoded(len(formula))
+            return formula
+    elif USE_DRIVE_THUMBNAILS and file_info.get('thumbnailLink'):
+        # thumbnailLink itself expires after a few hours, so link the stable thumbnail endpoint
+        logger.info(f"Using Drive thumbnail URL for {file_name} (ID: {file_id})")
+        return f'=IMAGE("https://drive.google.com/thumbnail?id={file_id}&sz=s{THUMBNAIL_SIZE}", 1)'
     else:
         logger.info(f"Using Drive URL for {file_name} (ID: {file_id})")
-        return f'=IMAGE("https://drive.google.com/uc?id={file_id}", 1)'
+    return f'=IMAGE("https://drive.google.com/uc?id={file_id}", 1)'
 
 # def create_image_and_link_cells(drive_service, file_info):
 #     """Return a tuple: (thumbnail image cell, hyperlink cell)."""
@@ -264,49 +842,173 @@ def create_image_cell_value(drive_service, file_info):
     
 #     return data
 
-def prepare_spreadsheet_data(drive_service, grouped_files):
-    """Prepare data for the spreadsheet with image formulas."""
-    # Define the columns based on configuration
-    base_columns = ['Prefix', COLUMN1_IDENTIFIER.capitalize(), COLUMN2_IDENTIFIER.capitalize(), COLUMN3_IDENTIFIER.capitalize()]
-    additional_columns = [identifier.capitalize() for identifier in ADDITIONAL_IDENTIFIERS if identifier]
-    all_columns = base_columns + additional_columns
-    
-    # Prepare header row
-    data = [all_columns]
-    
-    # Prepare data rows
-    count = 0
-    for prefix, files_dict in grouped_files.items():
-        row = [prefix]
-        
-        # Add main columns (front, back, detail)
-        for identifier in [COLUMN1_IDENTIFIER, COLUMN2_IDENTIFIER, COLUMN3_IDENTIFIER]:
-            if identifier in files_dict:
-                file_info = files_dict[identifier]
-                image_formula = create_image_cell_value(drive_service, file_info)
-                row.append(image_formula)
-            else:
-                row.append("")
-        
-        # Add additional columns if any
-        for identifier in ADDITIONAL_IDENTIFIERS:
-            if identifier and identifier in files_dict:
-                file_info = files_dict[identifier]
-                image_formula = create_image_cell_value(drive_service, file_info)
-                row.append(image_formula)
-            else:
-                row.append("")
-        
-        data.append(row)
-        count += 1
-        
-        if count >= MAX_THUMBNAILS:
-            if DEBUG:
-                print(f"Reached maximum thumbnail limit of {MAX_THUMBNAILS}")
-            break
+def get_column_identifiers():
+    """Return the identifiers that get an image column, in column order."""
+    base_identifiers = [COLUMN1_IDENTIFIER, COLUMN2_IDENTIFIER, COLUMN3_IDENTIFIER]
+    return base_identifiers + [identifier for identifier in ADDITIONAL_IDENTIFIERS if identifier]
+
+def build_row(drive_service, prefix, files_dict, encode_pool=None):
+    """Build one spreadsheet row: the prefix followed by one image cell per identifier."""
+    row = [prefix]
+    for identifier in get_column_identifiers():
+        if identifier in files_dict:
+            row.append(create_image_cell_value(drive_service, files_dict[identifier], encode_pool))
+        else:
+            row.append("")
+    return row
+
+def _build_row_in_worker(item, encode_pool=None):
+    """Build a row using the calling worker thread's own Drive service."""
+    prefix, files_dict = item
+    return build_row(get_thread_drive_service(), prefix, files_dict, encode_pool)
+
+def create_encode_pool():
+    """Create the process pool for thumbnail encoding, or None to encode in-thread."""
+    if not (USE_BASE64_THUMBNAILS and RESIZE_THUMBNAILS) or ENCODE_WORKERS <= 1:
+        return None
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    
+    # Spawned workers avoid forking while download threads hold locks
+    return ProcessPoolExecutor(max_workers=ENCODE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+
+def get_header_row():
+    """Return the spreadsheet header row for the configured identifiers."""
+    return ['Prefix'] + [identifier.capitalize() for identifier in get_column_identifiers()]
+
+def log_encoding_stats():
+    """Log the thumbnailing savings, deduplication and thumbnail cache statistics of this run."""
+    if thumbnail_stats.images:
+        logger.info(f"Thumbnailing saved {thumbnail_stats.bytes_saved} bytes "
+                    f"({thumbnail_stats.original_bytes} -> {thumbnail_stats.encoded_bytes}) "
+                    f"across {thumbnail_stats.images} images")
+    
+    dedup = dedup_stats.as_dict()
+    if dedup['references'] or dedup['memo_hits']:
+        logger.info(f"Deduplication reused {dedup['references'] + dedup['memo_hits']} of {dedup['images']} images "
+                    f"({dedup['unique_checksums']} unique checksums)")
+    
+    cache = get_thumbnail_cache()
+    if cache and USE_BASE64_THUMBNAILS:
+        cache_stats = cache.stats()
+        logger.info(f"Thumbnail cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                    f"{cache_stats['evictions']} evictions, {cache_stats['size_bytes']} bytes on disk")
+
+def partitioning_enabled():
+    return bool(OUTPUT_BACKEND == 'sheets' and (PARTITION_MAX_ROWS or PARTITION_MAX_BYTES))
+
+def cell_references_supported():
+    """Whether every row ends up in one sheet, so a cell can show another cell's image by reference.
+
+    Incremental sync inserts and deletes rows after writing values, which moves the rows
+    that references written in the same batch point at, so it needs the memo instead.
+    """
+    return OUTPUT_BACKEND == 'sheets' and not partitioning_enabled() and not INCREMENTAL_SYNC
+
+def deduplicate_groups(groups, references=True):
+    """Set up DEDUPLICATE_IMAGES for (prefix, files_dict) groups written in order below the header.
+
+    Returns the groups to build rows from. References are planned lazily, so groups may be
+    a stream; the memo can only drop images after their last use when groups is a list.
+    Without references, 'references' falls back to the memo, for output where cells cannot
+    refer to each other.
+    """
+    if DEDUPLICATE_IMAGES == 'references' and references:
+        dedup_stats.reset()
+        # An empty count table leaves nothing to memoize
+        image_memo.reset({})
+        return plan_duplicate_references(groups, get_column_identifiers())
+    reset_image_memo(groups)
+    return groups
+
+def reset_image_memo(groups):
+    """Reset the deduplication stats and set up the image memo for building the images of groups.
+
+    Unlike deduplicate_groups, no references are planned, so this suits groups whose
+    references were planned earlier. The memo can only drop images after their last use
+    when groups is a list.
+    """
+    dedup_stats.reset()
+    if DEDUPLICATE_IMAGES in ('references', 'memo'):
+        image_memo.reset(count_checksums(groups) if isinstance(groups, list) else None)
+
+def select_groups(grouped_files):
+    """Return the (prefix, files_dict) groups within MAX_THUMBNAILS, in sheet order."""
+    # Only rows within the limit are built, so nothing beyond it is downloaded
+    selected = list(islice(grouped_files.items(), MAX_THUMBNAILS))
+    if DEBUG and len(grouped_files) > len(selected):
+        print(f"Reached maximum thumbnail limit of {MAX_THUMBNAILS}")
+    return selected
+
+def build_rows(drive_service, groups):
+    """Build one row per (prefix, files_dict) group, concurrently when downloading, in group order."""
+    thumbnail_stats.reset()
+    groups = list(share_linked_images(drive_service, groups))
+    encode_pool = create_encode_pool()
+    try:
+        if USE_BASE64_THUMBNAILS and DOWNLOAD_WORKERS > 1 and len(groups) > 1:
+            # executor.map yields results in submission order, so rows keep their prefix order
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+                return list(executor.map(partial(_build_row_in_worker, encode_pool=encode_pool), groups))
+        return [build_row(drive_service, prefix, files_dict, encode_pool) for prefix, files_dict in groups]
+    finally:
+        if encode_pool is not None:
+            encode_pool.shutdown()
+
+@metrics.timed()
+def prepare_spreadsheet_data(drive_service, grouped_files, shard=None):
+    """Prepare data for the spreadsheet with image formulas.
+
+    With shard=(index, count), only the rows of prefixes in that shard are built and
+    [(position, row), ...] is returned instead, position being the row's place below the
+    header in an unsharded run.
+    """
+    selected = list(deduplicate_groups(select_groups(grouped_files), references=cell_references_supported()))
+    
+    if shard is not None:
+        index, count = shard
+        positions = [position for position, (prefix, _) in enumerate(selected)
+                     if shard_for_prefix(prefix, count) == index]
+        # Duplicate references were planned over every shard; the memo only needs this one's images
+        groups = list(deduplicate_groups([selected[position] for position in positions], references=False))
+        rows = build_rows(drive_service, groups)
+        log_encoding_stats()
+        return list(zip(positions, rows))
+    
+    data = [get_header_row()] + build_rows(drive_service, selected)
+    
+    log_encoding_stats()
     
     return data
 
+def iter_spreadsheet_rows(drive_service, groups):
+    """Build spreadsheet rows lazily from an iterable of (prefix, files_dict) groups.
+
+    At most twice DOWNLOAD_WORKERS rows are in flight at once, so memory stays bounded
+    no matter how many groups are streamed through. Rows are yielded in group order.
+    """
+    # islice stops pulling groups, and so listing pages, once the limit is reached
+    groups = share_linked_images(drive_service, islice(groups, MAX_THUMBNAILS))
+    
+    encode_pool = create_encode_pool()
+    try:
+        if not USE_BASE64_THUMBNAILS or DOWNLOAD_WORKERS <= 1:
+            for prefix, files_dict in groups:
+                yield build_row(drive_service, prefix, files_dict, encode_pool)
+            return
+        
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            pending = deque()
+            for group in groups:
+                pending.append(executor.submit(_build_row_in_worker, group, encode_pool))
+                if len(pending) >= DOWNLOAD_WORKERS * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    finally:
+        if encode_pool is not None:
+            encode_pool.shutdown()
+
 # def prepare_spreadsheet_data(drive_service, grouped_files):
 #     """Prepare data for the spreadsheet with thumbnails and clickable links."""
 #     # Combine identifiers
@@ -349,23 +1051,34 @@ def prepare_spreadsheet_data(drive_service, grouped_files):
 #     return data
 
 
+@metrics.timed()
 def update_spreadsheet(sheets_service, spreadsheet_id, data):
     """Update the spreadsheet with the prepared data."""
-    sheet_range = f"A1:{chr(65 + len(data[0]) - 1)}{len(data)}"
+    sheet_range = f"A1:{column_letter(len(data[0]) - 1)}{len(data)}"
     
     body = {
         'values': data
     }
     
-    result = sheets_service.spreadsheets().values().update(
+    result = execute(sheets_service.spreadsheets().values().update(
         spreadsheetId=spreadsheet_id,
         range=sheet_range,
         valueInputOption='USER_ENTERED',  # Important for formulas to work
         body=body
-    ).execute()
+    ))
+    
+    resize_image_cells(sheets_service, spreadsheet_id, len(data), len(data[0]))
     
+    if DEBUG:
+        print(f"Updated {result.get('updatedCells')} cells in spreadsheet")
+    
+    return result
+
+@metrics.timed()
+def resize_image_cells(sheets_service, spreadsheet_id, row_count, column_count):
+    """Resize the image rows and columns of the first sheet to fit THUMBNAIL_SIZE."""
     # Adjust row heights to accommodate images
-    sheet_metadata = sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+    sheet_metadata = execute(sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id))
     sheet_id = sheet_metadata['sheets'][0]['properties']['sheetId']
     
     requests = [
@@ -375,7 +1088,7 @@ def update_spreadsheet(sheets_service, spreadsheet_id, data):
                     'sheetId': sheet_id,
                     'dimension': 'ROWS',
                     'startIndex': 1,  # Skip header row
-                    'endIndex': len(data)
+                    'endIndex': row_count
                 },
                 'properties': {
                     'pixelSize': THUMBNAIL_SIZE + 20  # Add some padding
@@ -389,7 +1102,7 @@ def update_spreadsheet(sheets_service, spreadsheet_id, data):
                     'sheetId': sheet_id,
                     'dimension': 'COLUMNS',
                     'startIndex': 1,  # Skip prefix column
-                    'endIndex': len(data[0])
+                    'endIndex': column_count
                 },
                 'properties': {
                     'pixelSize': THUMBNAIL_SIZE + 20  # Add some padding
@@ -399,18 +1112,359 @@ def update_spreadsheet(sheets_service, spreadsheet_id, data):
         }
     ]
     
-    sheets_service.spreadsheets().batchUpdate(
+    execute(sheets_service.spreadsheets().batchUpdate(
         spreadsheetId=spreadsheet_id,
         body={'requests': requests}
-    ).execute()
+    ))
+
+def _write_values_in_worker(spreadsheet_id, sheet_range, values):
+    """Write values to a range using the calling worker thread's own Sheets service."""
+    return execute(get_thread_sheets_service().spreadsheets().values().update(
+        spreadsheetId=spreadsheet_id,
+        range=sheet_range,
+        valueInputOption='USER_ENTERED',  # Important for formulas to work
+        body={'values': values}
+    ))
+
+@metrics.timed()
+def write_partitioned_output(drive_service, sheets_service, spreadsheet_id, data):
+    """Write the prepared data split into partitions of PARTITION_MAX_ROWS rows or PARTITION_MAX_BYTES characters.
+
+    Each partition gets a "Part N" tab with its own header row. The tabs go into spreadsheet_id
+    and, once it would pass SPREADSHEET_MAX_CELLS or with PARTITION_MODE 'spreadsheets', into
+    further spreadsheets named after OUTPUT_SPREADSHEET_NAME. The first tab of every spreadsheet
+    becomes an index linking all partitions, and all tabs are written concurrently.
+    Returns the ids of the spreadsheets written.
+    """
+    header, rows = data[0], data[1:]
+    width = len(header)
+    partitions = partition_rows(rows, PARTITION_MAX_ROWS, PARTITION_MAX_BYTES)
+    assignments = assign_partitions(partitions, width, PARTITION_MODE == 'spreadsheets', SPREADSHEET_MAX_CELLS) or [[]]
+    
+    names = [OUTPUT_SPREADSHEET_NAME] + [f"{OUTPUT_SPREADSHEET_NAME} ({number})" for number in range(2, len(assignments) + 1)]
+    target_ids = [spreadsheet_id] + create_or_get_spreadsheets(drive_service, sheets_service, names[1:], OUTPUT_FOLDER_ID)
+    spreadsheets = list(zip(target_ids, names, assignments))
+    
+    locations = {}
+    for target_id, name, partition_indices in spreadsheets:
+        sheet_metadata = execute(sheets_service.spreadsheets().get(
+            spreadsheetId=target_id,
+            fields='sheets(properties(sheetId,title,gridProperties))'
+        ))
+        requests, sheet_ids = layout_requests(
+            sheet_metadata['sheets'], partitions, partition_indices, width,
+            row_pixels=THUMBNAIL_SIZE + 20, column_pixels=THUMBNAIL_SIZE + 20  # Add some padding
+        )
+        execute(sheets_service.spreadsheets().batchUpdate(spreadsheetId=target_id, body={'requests': requests}))
+        locations.update((index, (target_id, name, sheet_id)) for index, sheet_id in sheet_ids.items())
+    
+    index = index_rows(partitions, locations)
+    writes = [(target_id, full_range(INDEX_SHEET_TITLE, index), index) for target_id, _, _ in spreadsheets]
+    for position, partition in enumerate(partitions):
+        values = [header] + partition
+        writes.append((locations[position][0], full_range(partition_title(position), values), values))
+    
+    with ThreadPoolExecutor(max_workers=max(1, PARTITION_WRITE_WORKERS)) as executor:
+        results = list(executor.map(lambda write: _write_values_in_worker(*write), writes))
     
     if DEBUG:
-        print(f"Updated {result.get('updatedCells')} cells in spreadsheet")
+        print(f"Wrote {len(partitions)} partitions to {len(spreadsheets)} spreadsheets, "
+              f"{sum(result.get('updatedCells', 0) for result in results)} cells")
     
-    return result
+    return [target_id for target_id, _, _ in spreadsheets]
+
+def append_rows_in_batches(sheets_service, spreadsheet_id, rows):
+    """Write rows to the cleared first sheet, flushing every STREAM_FLUSH_ROWS rows or STREAM_FLUSH_BYTES bytes.
+
+    Each batch is written at its own row offset rather than appended, so a flush can be
+    retried without duplicating rows. rows is usually a lazy pipeline, so only the flushes
+    are timed, as write_rows_at. Returns (row_count, column_count) of everything written.
+    """
+    batch = []
+    batch_bytes = 0
+    row_count = 0
+    column_count = 0
+    
+    def flush():
+        write_rows_at(sheets_service, spreadsheet_id, row_count - len(batch), batch)
+    
+    for row in rows:
+        batch.append(row)
+        batch_bytes += sum(len(str(value)) for value in row)
+        row_count += 1
+        column_count = max(column_count, len(row))
+        
+        if len(batch) >= STREAM_FLUSH_ROWS or batch_bytes >= STREAM_FLUSH_BYTES:
+            flush()
+            batch = []
+            batch_bytes = 0
+    
+    if batch:
+        flush()
+    
+    return row_count, column_count
 
-def main():
-    """Main function to orchestrate the process."""
+@metrics.timed()
+def write_rows_at(sheets_service, spreadsheet_id, start_index, rows):
+    """Write rows into the first sheet starting at the zero-based row start_index."""
+    execute(sheets_service.spreadsheets().values().update(
+        spreadsheetId=spreadsheet_id,
+        range=f"A{start_index + 1}",
+        valueInputOption='USER_ENTERED',  # Important for formulas to work
+        body={'values': rows}
+    ))
+    if DEBUG:
+        print(f"Flushed rows {start_index + 1}-{start_index + len(rows)} to spreadsheet")
+
+def checkpoint_settings():
+    """Describe the settings that shape the sheet, so a checkpoint only resumes a matching build."""
+    return {
+        'source_folder_id': SOURCE_FOLDER_ID,
+        'recursive_listing': RECURSIVE_LISTING,
+        'output_folder_id': OUTPUT_FOLDER_ID,
+        'spreadsheet_name': OUTPUT_SPREADSHEET_NAME,
+        'prefix_pattern': IMAGE_PREFIX_PATTERN,
+        'header': get_header_row(),
+        'max_thumbnails': MAX_THUMBNAILS,
+        'base64_thumbnails': USE_BASE64_THUMBNAILS,
+        'drive_thumbnails': USE_DRIVE_THUMBNAILS,
+        'thumbnail_variant': _thumbnail_variant(),
+        'deduplicate_images': DEDUPLICATE_IMAGES,
+    }
+
+def _iter_pending_rows(drive_service, journal, pending):
+    """Yield (position, row) for pending journal rows, building the ones not encoded yet."""
+    built = iter_spreadsheet_rows(
+        drive_service,
+        ((prefix, files_dict) for _, prefix, files_dict, row in pending if row is None)
+    )
+    for position, _, _, row in pending:
+        if row is None:
+            row = next(built)
+            journal.record_encoded(position, row)
+        yield position, row
+
+def run_checkpointed_build(drive_service, sheets_service, resume=False):
+    """Build the sheet in flushed chunks at fixed row positions, journaling progress in CHECKPOINT_FILE.
+
+    A new build lists and groups the source folder once, clears the spreadsheet and journals
+    every row it will write. With resume, a journaled build with the same settings continues
+    from its first unwritten row instead, so the finished sheet matches an uninterrupted build.
+    Returns (spreadsheet_id, image_set_count).
+    """
+    settings = checkpoint_settings()
+    journal = RunJournal(CHECKPOINT_FILE)
+    try:
+        run = journal.get_run() if resume else None
+        if run and run['settings'] != settings:
+            logger.warning("Checkpoint was written with different settings, starting a new build")
+            run = None
+        elif resume and run is None:
+            logger.info("No checkpoint to resume, starting a new build")
+        
+        if run is None:
+            grouped_files = group_files_by_prefix(list_source_files(drive_service))
+            spreadsheet_id = create_or_get_spreadsheet(
+                drive_service,
+                sheets_service,
+                OUTPUT_SPREADSHEET_NAME,
+                OUTPUT_FOLDER_ID
+            )
+            groups = deduplicate_groups(list(islice(grouped_files.items(), MAX_THUMBNAILS)))
+            journal.start(settings, spreadsheet_id, get_header_row(), groups)
+        else:
+            spreadsheet_id = run['spreadsheet_id']
+            written, total = journal.progress()
+            logger.info(f"Resuming build of {spreadsheet_id}: {written} of {total} rows already written")
+        
+        pending = journal.pending_rows()
+        if run is not None:
+            # Duplicate references were planned and journaled when the build started
+            reset_image_memo([(prefix, files_dict) for _, prefix, files_dict, row in pending if row is None])
+        
+        thumbnail_stats.reset()
+        batch = []
+        batch_bytes = 0
+        
+        def flush():
+            write_rows_at(sheets_service, spreadsheet_id, batch[0][0], [row for _, row in batch])
+            journal.mark_written([position for position, _ in batch])
+        
+        for position, row in _iter_pending_rows(drive_service, journal, pending):
+            if batch and position != batch[-1][0] + 1:
+                flush()
+                batch, batch_bytes = [], 0
+            batch.append((position, row))
+            batch_bytes += sum(len(str(value)) for value in row)
+            if len(batch) >= STREAM_FLUSH_ROWS or batch_bytes >= STREAM_FLUSH_BYTES:
+                flush()
+                batch, batch_bytes = [], 0
+        if batch:
+            flush()
+        
+        _, row_count = journal.progress()
+        resize_image_cells(sheets_service, spreadsheet_id, row_count, len(settings['header']))
+        journal.complete()
+        log_encoding_stats()
+        
+        return spreadsheet_id, row_count - 1
+    finally:
+        journal.close()
+
+def run_streaming_pipeline(drive_service, sheets_service, spreadsheet_id):
+    """Stream listing pages through grouping and row building into batched sheet appends.
+
+    Only a bounded window of rows is held in memory. Returns the number of image sets written.
+    """
+    thumbnail_stats.reset()
+    groups = deduplicate_groups(iter_groups_by_prefix(iter_source_pages(drive_service)))
+    rows = chain([get_header_row()], iter_spreadsheet_rows(drive_service, groups))
+    row_count, column_count = append_rows_in_batches(sheets_service, spreadsheet_id, rows)
+    
+    resize_image_cells(sheets_service, spreadsheet_id, row_count, column_count)
+    log_encoding_stats()
+    
+    return row_count - 1
+
+def output_file_path():
+    """Return where the xlsx and html output backends write, OUTPUT_FILE unless it is unset."""
+    return OUTPUT_FILE or f"{OUTPUT_SPREADSHEET_NAME or 'contact_sheet'}.{OUTPUT_BACKEND}"
+
+@metrics.timed()
+def upload_output_file(drive_service, path, mime_type):
+    """Upload a local output file into OUTPUT_FOLDER_ID with a single files.create call.
+
+    Every upload creates a new Drive file. Returns the file's webViewLink.
+    """
+    from googleapiclient.http import MediaFileUpload
+    
+    media = MediaFileUpload(path, mimetype=mime_type, resumable=os.path.getsize(path) > SIMPLE_UPLOAD_MAX_BYTES)
+    file = execute(drive_service.files().create(
+        body={'name': os.path.basename(path), 'parents': [OUTPUT_FOLDER_ID]},
+        media_body=media,
+        fields='id, webViewLink'
+    ))
+    if DEBUG:
+        print(f"Uploaded {path} to Drive file {file['id']}")
+    return file.get('webViewLink') or f"https://drive.google.com/file/d/{file['id']}/view"
+
+@metrics.timed()
+def export_contact_sheet(drive_service, rows):
+    """Write rows, header first, to a local contact sheet with OUTPUT_BACKEND instead of the Sheets API.
+
+    rows may be a stream; each row is written as it arrives. With UPLOAD_OUTPUT_FILE the file
+    is uploaded to OUTPUT_FOLDER_ID afterwards. Returns (location, image_set_count), location
+    being the Drive link of the upload or the local path.
+    """
+    path = output_file_path()
+    row_count = 0
+    
+    def counted(rows):
+        nonlocal row_count
+        for row in rows:
+            row_count += 1
+            yield row
+    
+    mime_type = write_contact_sheet(OUTPUT_BACKEND, path, OUTPUT_SPREADSHEET_NAME or 'Contact sheet',
+                                    THUMBNAIL_SIZE, counted(rows))
+    logger.info(f"Wrote {OUTPUT_BACKEND} contact sheet to {path}")
+    if UPLOAD_OUTPUT_FILE:
+        return upload_output_file(drive_service, path, mime_type), row_count - 1
+    return os.path.abspath(path), row_count - 1
+
+def shard_metadata(index, count, row_count):
+    """Describe a shard file, so a merge can check that all shards come from one matching run."""
+    return {
+        'shard': index,
+        'shards': count,
+        'rows': row_count,
+        'settings': checkpoint_settings(),
+        'duplicate_references': DEDUPLICATE_IMAGES == 'references' and cell_references_supported(),
+    }
+
+def run_shard(drive_service, index, count):
+    """Build the rows of one shard of prefixes and write them to its file in SHARD_DIR.
+
+    Every worker lists and groups the whole source folder, so all of them agree on each
+    row's position, and then only downloads and encodes its own prefixes. Returns the path
+    of the shard file.
+    """
+    files = list_source_files(drive_service)
+    grouped_files = group_files_by_prefix(files)
+    positioned_rows = prepare_spreadsheet_data(drive_service, grouped_files, shard=(index, count))
+    
+    path = shard_path(SHARD_DIR, index, count)
+    write_shard_file(path, shard_metadata(index, count, min(len(grouped_files), MAX_THUMBNAILS)), positioned_rows)
+    logger.info(f"Shard {index}/{count}: wrote {len(positioned_rows)} of {len(grouped_files)} image sets to {path}")
+    return path
+
+@metrics.timed()
+def merge_shards(drive_service, sheets_service, paths):
+    """Write the rows of every shard file to the output in single-run order.
+
+    Returns (output URL or path, image_set_count).
+    """
+    run = check_shards(paths)
+    if run['settings'] != checkpoint_settings():
+        raise ValueError("Shard files were built with different settings than this merge")
+    if run['duplicate_references'] and not cell_references_supported():
+        raise ValueError("Shard files hold duplicate references, which only work in a single sheet written "
+                         "without INCREMENTAL_SYNC or partitioning; rebuild them with this merge's settings "
+                         "or DEDUPLICATE_IMAGES=memo")
+    
+    if OUTPUT_BACKEND != 'sheets':
+        return export_contact_sheet(drive_service, chain([get_header_row()], merge_shard_rows(paths, run['rows'])))
+    
+    spreadsheet_id = create_or_get_spreadsheet(
+        drive_service,
+        sheets_service,
+        OUTPUT_SPREADSHEET_NAME,
+        OUTPUT_FOLDER_ID,
+        clear=not INCREMENTAL_SYNC or partitioning_enabled()
+    )
+    data = [get_header_row()]
+    data.extend(merge_shard_rows(paths, run['rows']))
+    
+    if partitioning_enabled():
+        write_partitioned_output(drive_service, sheets_service, spreadsheet_id, data)
+    elif INCREMENTAL_SYNC:
+        sync_spreadsheet(sheets_service, spreadsheet_id, data)
+    else:
+        update_spreadsheet(sheets_service, spreadsheet_id, data)
+    
+    return f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}", len(data) - 1
+
+def write_run_reports(success):
+    """Write the run's metrics to METRICS_REPORT_FILE and METRICS_PROMETHEUS_FILE when configured."""
+    try:
+        if METRICS_REPORT_FILE:
+            cache = get_thumbnail_cache()
+            metrics.write_json_report(
+                METRICS_REPORT_FILE,
+                success=success,
+                thumbnails={
+                    'images': thumbnail_stats.images,
+                    'original_bytes': thumbnail_stats.original_bytes,
+                    'encoded_bytes': thumbnail_stats.encoded_bytes,
+                    'bytes_saved': thumbnail_stats.bytes_saved,
+                },
+                thumbnail_cache=cache.stats() if cache else None,
+                deduplication=dedup_stats.as_dict()
+            )
+        if METRICS_PROMETHEUS_FILE:
+            metrics.write_prometheus_textfile(METRICS_PROMETHEUS_FILE, success=success)
+    except OSError as e:
+        logger.warning(f"Could not write run metrics: {e}")
+
+def main(resume=False, shard=None, merge_paths=None):
+    """Main function to orchestrate the process.
+
+    With resume, a checkpointed build interrupted earlier continues where it stopped.
+    With shard=(index, count), only that shard's rows are built, into a file in SHARD_DIR;
+    merge_paths lists the shard files to write to the spreadsheet instead of building rows.
+    """
+    metrics.reset()
+    success = False
     try:
         print("Starting Google Drive to Sheets image transfer...")
         
@@ -418,8 +1472,67 @@ def main():
         drive_service = get_drive_service()
         sheets_service = get_sheets_service()
         
+        if shard is not None:
+            path = run_shard(drive_service, *shard)
+            success = True
+            return path
+        
+        if merge_paths is not None:
+            output_url, image_set_count = merge_shards(drive_service, sheets_service, merge_paths)
+            logger.info(f"Successfully merged {image_set_count} image sets from {len(merge_paths)} shards.")
+            logger.info(f"Output available at: {output_url}")
+            success = True
+            return output_url
+        
+        if OUTPUT_BACKEND != 'sheets':
+            if CHECKPOINTING or resume or INCREMENTAL_SYNC:
+                logger.warning("CHECKPOINTING and INCREMENTAL_SYNC are ignored for the xlsx and html output backends")
+            if STREAM_PIPELINE:
+                thumbnail_stats.reset()
+                groups = deduplicate_groups(iter_groups_by_prefix(iter_source_pages(drive_service)), references=False)
+                rows = chain([get_header_row()], iter_spreadsheet_rows(drive_service, groups))
+            else:
+                grouped_files = group_files_by_prefix(list_source_files(drive_service))
+                rows = prepare_spreadsheet_data(drive_service, grouped_files)
+            location, image_set_count = export_contact_sheet(drive_service, rows)
+            if STREAM_PIPELINE:
+                log_encoding_stats()
+            logger.info(f"Successfully processed {image_set_count} image sets.")
+            logger.info(f"Contact sheet available at: {location}")
+            success = True
+            return location
+        
+        if (CHECKPOINTING or resume or STREAM_PIPELINE) and partitioning_enabled():
+            logger.warning("Partitioning only applies to batch builds; this build writes a single sheet")
+        
+        if CHECKPOINTING or resume:
+            if STREAM_PIPELINE or INCREMENTAL_SYNC:
+                logger.warning("STREAM_PIPELINE and INCREMENTAL_SYNC are ignored for checkpointed builds")
+            spreadsheet_id, image_set_count = run_checkpointed_build(drive_service, sheets_service, resume)
+            spreadsheet_url = f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}"
+            logger.info(f"Successfully processed {image_set_count} image sets.")
+            logger.info(f"Spreadsheet available at: {spreadsheet_url}")
+            success = True
+            return spreadsheet_url
+        
+        if STREAM_PIPELINE:
+            if INCREMENTAL_SYNC:
+                logger.warning("INCREMENTAL_SYNC is ignored when STREAM_PIPELINE is enabled")
+            spreadsheet_id = create_or_get_spreadsheet(
+                drive_service, 
+                sheets_service, 
+                OUTPUT_SPREADSHEET_NAME, 
+                OUTPUT_FOLDER_ID
+            )
+            image_set_count = run_streaming_pipeline(drive_service, sheets_service, spreadsheet_id)
+            spreadsheet_url = f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}"
+            logger.info(f"Successfully processed {image_set_count} image sets.")
+            logger.info(f"Spreadsheet available at: {spreadsheet_url}")
+            success = True
+            return spreadsheet_url
+        
         # List files in source folder
-        files = list_files_in_folder(drive_service, SOURCE_FOLDER_ID)
+        files = list_source_files(drive_service)
         
         # Group files by prefix and identifier
         grouped_files = group_files_by_prefix(files)
@@ -429,7 +1542,8 @@ def main():
             drive_service, 
             sheets_service, 
             OUTPUT_SPREADSHEET_NAME, 
-            OUTPUT_FOLDER_ID
+            OUTPUT_FOLDER_ID,
+            clear=not INCREMENTAL_SYNC or partitioning_enabled()
         )
         
         # Prepare data for spreadsheet
@@ -439,7 +1553,15 @@ def main():
         
         # Update spreadsheet with image formulas
         logger.debug("Updating spreadsheet with image data...")
-        update_spreadsheet(sheets_service, spreadsheet_id, data)
+        if partitioning_enabled():
+            if INCREMENTAL_SYNC:
+                logger.warning("INCREMENTAL_SYNC is ignored when the output is partitioned")
+            spreadsheet_ids = write_partitioned_output(drive_service, sheets_service, spreadsheet_id, data)
+            logger.info(f"Output partitioned across {len(spreadsheet_ids)} spreadsheets.")
+        elif INCREMENTAL_SYNC:
+            sync_spreadsheet(sheets_service, spreadsheet_id, data)
+        else:
+            update_spreadsheet(sheets_service, spreadsheet_id, data)
         logger.debug("Spreadsheet updated successfully.")
         
         # Get the spreadsheet URL to return to user
@@ -448,6 +1570,7 @@ def main():
         logger.info(f"Successfully processed {len(grouped_files)} image sets.")
         logger.info(f"Spreadsheet available at: {spreadsheet_url}")
 
+        success = True
         return spreadsheet_url
         
     except Exception as e:
@@ -455,7 +1578,24 @@ def main():
         import traceback
         traceback.print_exc()
         return None
+    finally:
+        write_run_reports(success)
 
 if __name__ == "__main__":
+    import argparse
     import json  # Needed for credentials handling
-    main()
\ No newline at end of file
+    
+    parser = argparse.ArgumentParser(description="Build a spreadsheet of image thumbnails from a Drive folder.")
+    parser.add_argument('--resume', action='store_true',
+                        help=f"continue an interrupted checkpointed build recorded in {CHECKPOINT_FILE}")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--shard', type=parse_shard, metavar='INDEX/COUNT',
+                      help=f"only build the rows of shard INDEX (zero-based) of COUNT, into a file in {SHARD_DIR}")
+    mode.add_argument('--merge', nargs='*', metavar='SHARD_FILE',
+                      help=f"write the rows of the given shard files, or of every shard file in {SHARD_DIR}, "
+                           "to the spreadsheet")
+    args = parser.parse_args()
+    merge_paths = args.merge
+    if merge_paths == []:
+        merge_paths = sorted(glob.glob(os.path.join(SHARD_DIR, 'shard-*.jsonl')))
+    main(resume=args.resume, shard=args.shard, merge_paths=merge_paths)
\ No newline at end of file
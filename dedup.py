@@ -0,0 +1,142 @@
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
+from sheet_sync import column_letter
+
+class DedupStats:
+    """Counts of image cells and how many of them reused an identical image."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.images = 0
+            self.references = 0
+            self.memo_hits = 0
+            self._checksums = set()
+
+    def record_image(self, checksum):
+        with self._lock:
+            self.images += 1
+            if checksum:
+                self._checksums.add(checksum)
+
+    def record_reference(self):
+        with self._lock:
+            self.references += 1
+
+    def record_memo_hit(self):
+        with self._lock:
+            self.memo_hits += 1
+
+    def as_dict(self):
+        with self._lock:
+            reused = self.references + self.memo_hits
+            return {
+                'images': self.images,
+                'unique_checksums': len(self._checksums),
+                'references': self.references,
+                'memo_hits': self.memo_hits,
+                'hit_ratio': reused / self.images if self.images else 0.0,
+            }
+
+dedup_stats = DedupStats()
+
+def plan_duplicate_references(groups, identifiers, first_row=2):
+    """Point every repeated image at the first cell that shows the same file contents.
+
+    groups are (prefix, files_dict) pairs in sheet order, the first one on sheet row
+    first_row. Groups are yielded unchanged except that each file whose md5Checksum was
+    already seen is replaced by a copy whose 'duplicateOf' names the A1 cell of the first
+    occurrence. Planning is lazy, so groups may be a stream.
+    """
+    first_cells = {}
+    for row_number, (prefix, files_dict) in enumerate(groups, first_row):
+        planned = {}
+        for column, identifier in enumerate(identifiers, 1):
+            if identifier not in files_dict:
+                continue
+            file_info = files_dict[identifier]
+            checksum = file_info.get('md5Checksum')
+            if checksum and checksum in first_cells:
+                file_info = dict(file_info, duplicateOf=first_cells[checksum])
+            elif checksum:
+                first_cells[checksum] = f"{column_letter(column)}{row_number}"
+            planned[identifier] = file_info
+        yield prefix, planned
+
+def count_checksums(groups):
+    """Return how many image cells in groups show each md5Checksum."""
+    return Counter(
+        file_info['md5Checksum']
+        for _, files_dict in groups
+        for file_info in files_dict.values()
+        if file_info.get('md5Checksum')
+    )
+
+class ImageMemo:
+    """Per-run memo of built image cells keyed by md5Checksum.
+
+    Concurrent requests for the same checksum wait for the first one instead of fetching
+    again. With counts from count_checksums, only repeated checksums are kept and each is
+    dropped after its last use; without them, the most recent max_entries are kept.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, counts=None):
+        with self._lock:
+            self._remaining = {checksum: count for checksum, count in (counts or {}).items() if count > 1}
+            self._bounded = counts is None
+            self._entries = OrderedDict()
+
+    def _release(self, checksum):
+        with self._lock:
+            if self._bounded:
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._remaining[checksum] -= 1
+                if not self._remaining[checksum]:
+                    del self._remaining[checksum]
+                    self._entries.pop(checksum, None)
+
+    def get_or_build(self, checksum, build, stats=dedup_stats):
+        """Return the memoized cell for checksum, calling build() only for its first request."""
+        with self._lock:
+            if not checksum or not (self._bounded or checksum in self._remaining):
+                entry = None
+                owner = None
+            elif checksum in self._entries:
+                entry = self._entries[checksum]
+                self._entries.move_to_end(checksum)
+                owner = False
+            else:
+                entry = self._entries[checksum] = Future()
+                owner = True
+
+        if entry is None:
+            return build()
+        try:
+            if not owner:
+                stats.record_memo_hit()
+                return entry.result()
+            try:
+                value = build()
+            except BaseException as e:
+                entry.set_exception(e)
+                with self._lock:
+                    self._entries.pop(checksum, None)
+                raise
+            entry.set_result(value)
+            return value
+        finally:
+            self._release(checksum)
+
+image_memo = ImageMemo()
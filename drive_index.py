@@ -0,0 +1,121 @@
+import logging
+import sqlite3
+
+from api_requests import execute
+
+logger = logging.getLogger(__name__)
+
+# Filled in with the file fields of the folder's full listing, so both kinds of row hold the same fields
+CHANGE_FIELDS = 'nextPageToken, newStartPageToken, changes(fileId, removed, file({file_fields}, parents, trashed))'
+
+# files columns and the files.list fields they hold, in SELECT order
+FILE_COLUMNS = [('id', 'id'), ('name', 'name'), ('mime_type', 'mimeType'), ('md5', 'md5Checksum'),
+                ('modified_time', 'modifiedTime'), ('size', 'size'), ('thumbnail_link', 'thumbnailLink')]
+
+class DriveIndex:
+    """Local SQLite index of Drive file metadata, kept current with the Changes API.
+
+    Files are indexed per tracked folder together with the startPageToken that the
+    folder's snapshot is valid for, so later runs only need to replay changes.list.
+    A stored thumbnailLink may have expired by the time it is used; fetching it then fails
+    and the original file is downloaded instead.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS folders (folder_id TEXT PRIMARY KEY, start_page_token TEXT NOT NULL)'
+            )
+            columns = {row[1] for row in self.connection.execute('PRAGMA table_info(files)')}
+            if columns and not {column for column, _ in FILE_COLUMNS} <= columns:
+                # An index written before a column was added is rebuilt from a full listing
+                self.connection.execute('DROP TABLE files')
+                self.connection.execute('DELETE FROM folders')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'id TEXT NOT NULL, parent TEXT NOT NULL, name TEXT NOT NULL, mime_type TEXT, '
+                'md5 TEXT, modified_time TEXT, size TEXT, thumbnail_link TEXT, PRIMARY KEY (id, parent))'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS files_parent ON files (parent, name)')
+
+    def close(self):
+        self.connection.close()
+
+    def get_start_page_token(self, folder_id):
+        """Return the token the folder's snapshot is valid for, or None if it was never listed."""
+        row = self.connection.execute(
+            'SELECT start_page_token FROM folders WHERE folder_id = ?', (folder_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _upsert(self, folder_id, file):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO files (id, parent, name, mime_type, md5, modified_time, size, thumbnail_link) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (file['id'], folder_id, file['name'], file.get('mimeType'), file.get('md5Checksum'),
+             file.get('modifiedTime'), file.get('size'), file.get('thumbnailLink'))
+        )
+
+    def _save_token(self, folder_id, start_page_token):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO folders (folder_id, start_page_token) VALUES (?, ?)',
+            (folder_id, start_page_token)
+        )
+
+    def replace_folder(self, folder_id, files, start_page_token):
+        """Replace the folder's snapshot with a full listing taken at start_page_token."""
+        with self.connection:
+            self.connection.execute('DELETE FROM files WHERE parent = ?', (folder_id,))
+            for file in files:
+                self._upsert(folder_id, file)
+            self._save_token(folder_id, start_page_token)
+
+    def apply_changes(self, folder_id, changes, start_page_token):
+        """Apply changes.list entries to the folder's snapshot and advance its token."""
+        with self.connection:
+            for change in changes:
+                file = change.get('file') or {}
+                in_folder = folder_id in file.get('parents', [])
+                if change.get('removed') or file.get('trashed') or not in_folder:
+                    self.connection.execute(
+                        'DELETE FROM files WHERE id = ? AND parent = ?', (change['fileId'], folder_id)
+                    )
+                else:
+                    self._upsert(folder_id, file)
+            self._save_token(folder_id, start_page_token)
+
+    def list_files(self, folder_id):
+        """Return the folder's indexed files in the same shape as a files.list response.
+
+        As in a response, fields a file does not have are left out rather than set to None.
+        """
+        rows = self.connection.execute(
+            f"SELECT {', '.join(column for column, _ in FILE_COLUMNS)} FROM files WHERE parent = ? ORDER BY name, id",
+            (folder_id,)
+        )
+        return [
+            {field: value for (_, field), value in zip(FILE_COLUMNS, row) if value is not None}
+            for row in rows
+        ]
+
+def fetch_changes(drive_service, start_page_token, file_fields):
+    """Page through changes.list from start_page_token, asking for file_fields of each changed file.
+
+    Returns (changes, new_start_page_token).
+    """
+    changes = []
+    page_token = start_page_token
+
+    while True:
+        response = execute(drive_service.changes().list(
+            pageToken=page_token,
+            spaces='drive',
+            includeRemoved=True,
+            fields=CHANGE_FIELDS.format(file_fields=file_fields)
+        ))
+
+        changes.extend(response.get('changes', []))
+        if 'newStartPageToken' in response:
+            return changes, response['newStartPageToken']
+        page_token = response['nextPageToken']
@@ -0,0 +1,753 @@
+"""In-process stand-in for the parts of the Drive v3 and Sheets v4 APIs this repo uses.
+
+FakeGoogleBackend keeps folders, files and spreadsheets in memory and answers requests
+through FakeHttp, an httplib2.Http look-alike. Services built by services.py after
+services.use_http(backend.http) talk to the fake through the real discovery documents, so
+request objects, MediaIoBaseDownload and the retry layer all run unchanged.
+
+Supported: files list/get/get_media/update/create (metadata only or a multipart upload), thumbnailLink fetches,
+permissions.create, Drive batch requests of up to 100 of those calls, changes
+getStartPageToken/list, spreadsheets create/get/batchUpdate and values
+update/append/clear/batchUpdate. Anything else answers 400, so a benchmark cannot silently
+measure an unsupported path. As in Sheets, inserting or deleting rows moves the A1 cell
+references in formulas on the same sheet along with the rows they point at.
+"""
+import email.parser
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, unquote, urlparse
+
+import httplib2
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+SPREADSHEET_MIME_TYPE = 'application/vnd.google-apps.spreadsheet'
+
+# Real API limits that the fake enforces
+SHEETS_MAX_CELL_CHARS = 50000
+SHEETS_MAX_METADATA_CHARS = 30000
+DRIVE_MAX_PAGE_SIZE = 1000
+DRIVE_DEFAULT_PAGE_SIZE = 100
+DRIVE_MAX_BATCH_CALLS = 100
+BATCH_BOUNDARY = 'fake_batch_response'
+
+# A1 cell references outside string literals, e.g. B2 or $B$2 but not IMAGE( or LOG10(
+_STRING_LITERAL = re.compile(r'("[^"]*")')
+_CELL_REFERENCE = re.compile(r'(?<![A-Za-z0-9_$])(\$?[A-Z]{1,3}\$?)(\d+)(?![A-Za-z0-9_(])')
+
+class FakeApiError(Exception):
+    """An error response, raised inside handlers and turned into a JSON error body."""
+
+    def __init__(self, status, message, reason=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason or {400: 'badRequest', 404: 'notFound', 429: 'rateLimitExceeded'}.get(status, 'backendError')
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def _parse_fields(fields):
+    """Parse a field mask like 'nextPageToken, files(id, name)' into {'nextPageToken': None, 'files': {...}}."""
+    selection = {}
+    depth = 0
+    start = 0
+    for index, char in enumerate(fields + ','):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            item = fields[start:index].strip()
+            start = index + 1
+            if not item:
+                continue
+            if '(' in item:
+                name, inner = item.split('(', 1)
+                selection[name.strip()] = _parse_fields(inner[:-1])
+            else:
+                # 'a/b' is shorthand for 'a(b)'
+                name, _, rest = item.partition('/')
+                selection[name] = _parse_fields(rest) if rest else None
+    return selection
+
+def _select(value, selection):
+    if selection is None:
+        return value
+    if isinstance(value, list):
+        return [_select(item, selection) for item in value]
+    if isinstance(value, dict):
+        return {key: _select(value[key], sub) for key, sub in selection.items() if key in value}
+    return value
+
+def column_index(letters):
+    """Convert column letters to a zero-based index ('A' -> 0, 'AA' -> 26)."""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+def parse_a1_range(a1_range):
+    """Split an A1 range into (sheet title or None, start_row, start_column, end_row, end_column).
+
+    Indices are zero-based and the ends exclusive; open ends are None.
+    """
+    title = None
+    if '!' in a1_range:
+        title, a1_range = a1_range.rsplit('!', 1)
+        if title.startswith("'") and title.endswith("'"):
+            title = title[1:-1].replace("''", "'")
+    cells = []
+    for part in a1_range.split(':'):
+        match = re.fullmatch(r'([A-Za-z]*)(\d*)', part.strip())
+        if not match:
+            raise FakeApiError(400, f"Unable to parse range: {a1_range}")
+        letters, digits = match.groups()
+        cells.append((int(digits) - 1 if digits else None, column_index(letters) if letters else None))
+    (start_row, start_column), (end_row, end_column) = cells[0], cells[-1]
+    return (title, start_row or 0, start_column or 0,
+            end_row + 1 if end_row is not None else None,
+            end_column + 1 if end_column is not None else None)
+
+def _parse_multipart(body, headers):
+    """Split a multipart upload into its JSON metadata plus '_content' and '_content_type' keys."""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    content_type = headers.get('content-type') or headers.get('Content-Type', '')
+    if not content_type.startswith('multipart/related'):
+        raise FakeApiError(400, f"Unsupported upload: {content_type or 'no content type'}, only multipart uploads are faked")
+    message = email.parser.BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    metadata, media = message.get_payload()
+    payload = json.loads(metadata.get_payload(decode=True) or b'{}')
+    payload['_content'] = media.get_payload(decode=True)
+    payload['_content_type'] = media.get_content_type()
+    return payload
+
+def _move_row_references(formula, move):
+    """Rewrite the row of every cell reference in formula with move(row index), '#REF!' when it returns None."""
+    def replace(match):
+        row = move(int(match.group(2)) - 1)
+        return '#REF!' if row is None else f"{match.group(1)}{row + 1}"
+
+    return ''.join(part if part.startswith('"') else _CELL_REFERENCE.sub(replace, part)
+                   for part in _STRING_LITERAL.split(formula))
+
+def _cell_value(cell_data):
+    value = cell_data.get('userEnteredValue', {})
+    for key in ('formulaValue', 'stringValue', 'numberValue', 'boolValue'):
+        if key in value:
+            return value[key]
+    return ''
+
+class FakeHttp:
+    """httplib2.Http stand-in that routes every request to a FakeGoogleBackend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.timeout = None
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=None, connection_type=None):
+        return self.backend.handle(uri, method, body, headers or {})
+
+    def close(self):
+        pass
+
+class FakeGoogleBackend:
+    """In-memory Drive and Sheets state plus the knobs used to simulate a real backend.
+
+    latency is added to every HTTP round-trip, once for a whole batch, and media is slowed
+    to bandwidth bytes per second when set. error_rate is the chance that any request, or
+    call within a batch, fails with a 503. quota_per_minute
+    maps 'drive' or 'sheets' to the requests allowed in any sliding 60 second window, past
+    which requests fail with 429 rateLimitExceeded. media_chunk_limit caps the bytes
+    returned per get_media response, forcing MediaIoBaseDownload to page. Files may be
+    added without content, in which case content_factory(file) produces their bytes on
+    demand. Image files get a thumbnailLink, served by thumbnail_factory(file, size) or,
+    without one, with the file's own content. With retain_values False only the first
+    column of each sheet is kept, which keeps the fake's own memory out of large benchmarks.
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, error_rate=0.0, quota_per_minute=None,
+                 media_chunk_limit=None, content_factory=None, thumbnail_factory=None, retain_values=True,
+                 seed=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute or {}
+        self.media_chunk_limit = media_chunk_limit
+        self.content_factory = content_factory
+        self.thumbnail_factory = thumbnail_factory
+        self.retain_values = retain_values
+        self.http = FakeHttp(self)
+        self.calls = Counter()
+        self.errors = Counter()
+        self.files = {}
+        self.spreadsheets = {}
+        self.permissions = {}
+        self.changes = []
+        self._contents = {}
+        self._pending_errors = deque()
+        self._quota_windows = {}
+        self._ids = 0
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+
+    # State setup
+
+    def _new_id(self, kind):
+        self._ids += 1
+        return f"fake-{kind}-{self._ids:08d}"
+
+    def _record_change(self, file_id):
+        self.changes.append(file_id)
+
+    def add_folder(self, name, parent=None):
+        """Create a folder and return its id."""
+        return self.add_file(name, parent, mime_type=FOLDER_MIME_TYPE)['id']
+
+    def add_file(self, name, parent=None, content=None, mime_type='image/jpeg', md5=None, size=None):
+        """Create a file under parent and return its metadata."""
+        with self._lock:
+            file_id = self._new_id('folder' if mime_type == FOLDER_MIME_TYPE else 'file')
+            file = {
+                'id': file_id,
+                'name': name,
+                'mimeType': mime_type,
+                'parents': [parent] if parent else [],
+                'modifiedTime': _now(),
+                'trashed': False,
+            }
+            if content is not None:
+                self._contents[file_id] = content
+                md5 = md5 or hashlib.md5(content).hexdigest()
+                size = len(content) if size is None else size
+            if mime_type != FOLDER_MIME_TYPE and md5:
+                file['md5Checksum'] = md5
+            if size is not None:
+                file['size'] = str(size)
+            if mime_type.startswith('image/'):
+                file['thumbnailLink'] = f"https://lh3.googleusercontent.com/drive-storage/{file_id}=s220"
+            self.files[file_id] = file
+            self._record_change(file_id)
+            return file
+
+    def trash_file(self, file_id):
+        with self._lock:
+            self.files[file_id]['trashed'] = True
+            self._record_change(file_id)
+
+    def content_of(self, file_id):
+        content = self._contents.get(file_id)
+        if content is None and self.content_factory:
+            content = self.content_factory(self.files[file_id])
+        return content or b''
+
+    def fail_next(self, count=1, status=503):
+        """Make the next count requests fail with status."""
+        with self._lock:
+            self._pending_errors.extend([status] * count)
+
+    def sheet_values(self, spreadsheet_id, sheet_index=0):
+        """Return the stored rows of a sheet with trailing blank rows removed."""
+        rows = [list(row) for row in self.spreadsheets[spreadsheet_id]['sheets'][sheet_index]['rows']]
+        while rows and not any(value != '' for value in rows[-1]):
+            rows.pop()
+        return rows
+
+    # Request handling
+
+    def handle(self, uri, method, body, headers):
+        if self.latency:
+            time.sleep(self.latency)
+        if method == 'POST' and urlparse(uri).path == '/batch/drive/v3':
+            return self._batch(body, headers)
+        return self._respond(uri, method, body, headers)
+
+    def _respond(self, uri, method, body, headers):
+        parsed = urlparse(uri)
+        # ranges may repeat; every other parameter is single-valued
+        query = {key: values if key == 'ranges' else values[-1] for key, values in parse_qs(parsed.query).items()}
+        path = unquote(parsed.path)
+        api = {'sheets.googleapis.com': 'sheets', 'lh3.googleusercontent.com': 'thumbnails'}.get(parsed.netloc, 'drive')
+
+        try:
+            handler, method_id, args = self._route(api, method, path, query)
+            with self._lock:
+                self.calls[method_id] += 1
+                self._check_faults(api)
+                payload = _parse_multipart(body, headers) if path.startswith('/upload/') else json.loads(body) if body else {}
+                result = handler(query, payload, headers, *args)
+        except FakeApiError as e:
+            with self._lock:
+                self.errors[e.status] += 1
+            error = {'error': {'code': e.status, 'message': str(e), 'errors': [{'reason': e.reason, 'message': str(e)}]}}
+            return httplib2.Response({'status': str(e.status), 'content-type': 'application/json'}), json.dumps(error).encode()
+
+        if isinstance(result, tuple):
+            # Media responses are (status, headers, bytes)
+            status, response_headers, content = result
+            if self.bandwidth:
+                time.sleep(len(content) / self.bandwidth)
+            return httplib2.Response(dict(response_headers, status=str(status))), content
+
+        if 'fields' in query:
+            result = _select(result, _parse_fields(query['fields']))
+        return httplib2.Response({'status': '200', 'content-type': 'application/json'}), json.dumps(result).encode()
+
+    def _batch(self, body, headers):
+        """Answer a Drive batch request, each part counted, faulted and rate limited as its own call."""
+        with self._lock:
+            self.calls['drive.batch'] += 1
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        content_type = headers.get('content-type') or headers.get('Content-Type', '')
+        message = email.parser.BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        parts = message.get_payload() if message.is_multipart() else []
+        if not parts or len(parts) > DRIVE_MAX_BATCH_CALLS:
+            error = {'error': {'code': 400, 'message': f"A batch must hold 1 to {DRIVE_MAX_BATCH_CALLS} calls, got {len(parts)}"}}
+            return httplib2.Response({'status': '400', 'content-type': 'application/json'}), json.dumps(error).encode()
+
+        responses = []
+        for part in parts:
+            # Each part is an application/http request: a request line, headers, then the body
+            request_line, request = part.get_payload().split('\n', 1)
+            method, target, _ = request_line.split(' ', 2)
+            inner = email.parser.Parser().parsestr(request)
+            inner_headers = {key.lower(): value for key, value in inner.items()}
+            response, content = self._respond(target, method, inner.get_payload() or None, inner_headers)
+            responses.append(
+                f"--{BATCH_BOUNDARY}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:]}\r\n\r\n"
+                f"HTTP/1.1 {response.status} {'OK' if response.status < 300 else 'Error'}\r\n"
+                f"Content-Type: {response.get('content-type', 'application/json')}\r\n\r\n"
+                f"{content.decode('utf-8')}\r\n"
+            )
+        content = ''.join(responses) + f"--{BATCH_BOUNDARY}--\r\n"
+        return (httplib2.Response({'status': '200', 'content-type': f'multipart/mixed; boundary={BATCH_BOUNDARY}'}),
+                content.encode('utf-8'))
+
+    def _check_faults(self, api):
+        if self._pending_errors:
+            raise FakeApiError(self._pending_errors.popleft(), 'Injected failure')
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise FakeApiError(503, 'Injected backend error')
+        limit = self.quota_per_minute.get(api)
+        if limit:
+            window = self._quota_windows.setdefault(api, deque())
+            now = time.monotonic()
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if len(window) >= limit:
+                raise FakeApiError(429, f"Quota exceeded for {api} requests per minute", 'rateLimitExceeded')
+            window.append(now)
+
+    def _route(self, api, method, path, query):
+        if api == 'thumbnails':
+            routes = [('GET', r'/drive-storage/([^=/]+)=s(\d+)', self._thumbnail_get, 'drive.thumbnails.get')]
+        elif api == 'drive':
+            routes = [
+                ('GET', r'/drive/v3/files', self._files_list, 'drive.files.list'),
+                ('POST', r'/drive/v3/files', self._files_create, 'drive.files.create'),
+                ('POST', r'/upload/drive/v3/files', self._files_create, 'drive.files.create'),
+                ('GET', r'/drive/v3/files/([^/]+)', self._files_get, 'drive.files.get'),
+                ('PATCH', r'/drive/v3/files/([^/]+)', self._files_update, 'drive.files.update'),
+                ('POST', r'/drive/v3/files/([^/]+)/permissions', self._permissions_create, 'drive.permissions.create'),
+                ('GET', r'/drive/v3/changes/startPageToken', self._changes_start_token, 'drive.changes.getStartPageToken'),
+                ('GET', r'/drive/v3/changes', self._changes_list, 'drive.changes.list'),
+            ]
+        else:
+            routes = [
+                ('POST', r'/v4/spreadsheets', self._spreadsheets_create, 'sheets.spreadsheets.create'),
+                ('GET', r'/v4/spreadsheets/([^/:]+)', self._spreadsheets_get, 'sheets.spreadsheets.get'),
+                ('POST', r'/v4/spreadsheets/([^/:]+):batchUpdate', self._spreadsheets_batch_update,
+                 'sheets.spreadsheets.batchUpdate'),
+                ('PUT', r'/v4/spreadsheets/([^/:]+)/values/(.+)', self._values_update,
+                 'sheets.spreadsheets.values.update'),
+                ('POST', r'/v4/spreadsheets/([^/:]+)/values/(.+):append', self._values_append,
+                 'sheets.spreadsheets.values.append'),
+                ('POST', r'/v4/spreadsheets/([^/:]+)/values/(.+):clear', self._values_clear,
+                 'sheets.spreadsheets.values.clear'),
+                ('POST', r'/v4/spreadsheets/([^/:]+)/values:batchUpdate', self._values_batch_update,
+                 'sheets.spreadsheets.values.batchUpdate'),
+            ]
+        for route_method, pattern, handler, method_id in routes:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                return handler, method_id, match.groups()
+        raise FakeApiError(400, f"Unsupported request: {method} {path}")
+
+    # Drive
+
+    def _get_file(self, file_id):
+        file = self.files.get(file_id)
+        if file is None:
+            raise FakeApiError(404, f"File not found: {file_id}")
+        return file
+
+    def _matches_query(self, file, query):
+        parents = re.findall(r"'([^']+)' in parents", query)
+        if parents and not set(parents) & set(file['parents']):
+            return False
+        if re.search(r'trashed\s*=\s*false', query) and file['trashed']:
+            return False
+        name = re.search(r"name\s*=\s*'((?:[^'\\]|\\.)*)'", query)
+        if name and file['name'] != name.group(1).replace("\\'", "'"):
+            return False
+        for operator, mime_type in re.findall(r"mimeType\s*(!?=)\s*'([^']+)'", query):
+            if (file['mimeType'] == mime_type) != (operator == '='):
+                return False
+        return True
+
+    def _files_list(self, query, payload, headers):
+        matches = [file for file in self.files.values() if self._matches_query(file, query.get('q', ''))]
+        if 'name' in query.get('orderBy', ''):
+            matches.sort(key=lambda file: file['name'])
+        page_size = min(int(query.get('pageSize', DRIVE_DEFAULT_PAGE_SIZE)), DRIVE_MAX_PAGE_SIZE)
+        offset = int(query.get('pageToken') or 0)
+        response = {'files': matches[offset:offset + page_size]}
+        if offset + page_size < len(matches):
+            response['nextPageToken'] = str(offset + page_size)
+        return response
+
+    def _files_get(self, query, payload, headers, file_id):
+        file = self._get_file(file_id)
+        if query.get('alt') != 'media':
+            return file
+
+        content = self.content_of(file_id)
+        start, end = 0, len(content) - 1
+        byte_range = headers.get('range') or headers.get('Range')
+        if byte_range:
+            first, last = byte_range.split('=', 1)[1].split('-')
+            start, end = int(first), min(int(last), len(content) - 1)
+        if self.media_chunk_limit:
+            end = min(end, start + self.media_chunk_limit - 1)
+        if start >= len(content):
+            return 416, {'content-range': f"bytes */{len(content)}"}, b''
+        return 206, {'content-range': f"bytes {start}-{end}/{len(content)}"}, content[start:end + 1]
+
+    def _thumbnail_get(self, query, payload, headers, file_id, size):
+        file = self._get_file(file_id)
+        if 'thumbnailLink' not in file:
+            raise FakeApiError(404, f"No thumbnail for {file_id}")
+        if self.thumbnail_factory:
+            content = self.thumbnail_factory(file, int(size))
+        else:
+            content = self.content_of(file_id)
+        return 200, {'content-type': file['mimeType'], 'content-length': str(len(content))}, content
+
+    def _files_create(self, query, payload, headers):
+        parents = payload.get('parents') or []
+        file = self.add_file(payload.get('name', 'Untitled'), parents[0] if parents else None,
+                             content=payload.get('_content'),
+                             mime_type=payload.get('mimeType') or payload.get('_content_type', 'application/octet-stream'))
+        return dict(file, webViewLink=f"https://drive.google.com/file/d/{file['id']}/view")
+
+    def _files_update(self, query, payload, headers, file_id):
+        file = self._get_file(file_id)
+        removed = set(filter(None, query.get('removeParents', '').split(',')))
+        added = [parent for parent in query.get('addParents', '').split(',') if parent]
+        file['parents'] = [parent for parent in file['parents'] if parent not in removed] + added
+        file.update({key: value for key, value in payload.items() if key in ('name', 'trashed', 'description')})
+        file['modifiedTime'] = _now()
+        self._record_change(file_id)
+        return file
+
+    def _permissions_create(self, query, payload, headers, file_id):
+        self._get_file(file_id)
+        permission = dict(payload, id=self._new_id('permission'))
+        self.permissions.setdefault(file_id, []).append(permission)
+        return permission
+
+    def _changes_start_token(self, query, payload, headers):
+        return {'startPageToken': str(len(self.changes) + 1)}
+
+    def _changes_list(self, query, payload, headers):
+        start = int(query['pageToken']) - 1
+        changes = []
+        for file_id in self.changes[start:]:
+            file = self.files[file_id]
+            changes.append({'fileId': file_id, 'removed': False, 'file': file})
+        return {'changes': changes, 'newStartPageToken': str(len(self.changes) + 1)}
+
+    # Sheets
+
+    def _new_sheet(self, sheet_id, title, row_count=1000, column_count=26):
+        return {
+            'properties': {
+                'sheetId': sheet_id,
+                'title': title,
+                'index': 0,
+                'gridProperties': {'rowCount': row_count, 'columnCount': column_count},
+            },
+            'rows': [[] for _ in range(row_count)],
+            'row_metadata': [{} for _ in range(row_count)],
+        }
+
+    def _spreadsheets_create(self, query, payload, headers):
+        spreadsheet_id = self.add_file(payload.get('properties', {}).get('title', 'Untitled spreadsheet'),
+                                       mime_type=SPREADSHEET_MIME_TYPE)['id']
+        sheets = [self._new_sheet(0, 'Sheet1')]
+        self.spreadsheets[spreadsheet_id] = {'properties': dict(payload.get('properties', {})), 'sheets': sheets}
+        return self._spreadsheet_resource(spreadsheet_id)
+
+    def _get_spreadsheet(self, spreadsheet_id):
+        spreadsheet = self.spreadsheets.get(spreadsheet_id)
+        if spreadsheet is None:
+            raise FakeApiError(404, f"Requested entity was not found: {spreadsheet_id}")
+        return spreadsheet
+
+    def _find_sheet(self, spreadsheet, title=None, sheet_id=None):
+        for sheet in spreadsheet['sheets']:
+            properties = sheet['properties']
+            if (title is None and sheet_id is None) or properties['title'] == title or properties['sheetId'] == sheet_id:
+                return sheet
+        raise FakeApiError(400, f"Unable to find sheet {title if title is not None else sheet_id}")
+
+    def _spreadsheet_resource(self, spreadsheet_id):
+        spreadsheet = self._get_spreadsheet(spreadsheet_id)
+        return {
+            'spreadsheetId': spreadsheet_id,
+            'properties': spreadsheet['properties'],
+            'sheets': [{'properties': sheet['properties']} for sheet in spreadsheet['sheets']],
+        }
+
+    def _spreadsheets_get(self, query, payload, headers, spreadsheet_id):
+        resource = self._spreadsheet_resource(spreadsheet_id)
+        if query.get('includeGridData') != 'true' or 'ranges' not in query:
+            return resource
+
+        spreadsheet = self._get_spreadsheet(spreadsheet_id)
+        grid_data = {}
+        for a1_range in query['ranges']:
+            title, start_row, start_column, end_row, end_column = parse_a1_range(a1_range)
+            sheet = self._find_sheet(spreadsheet, title)
+            rows = sheet['rows'][start_row:end_row]
+            row_data = [
+                {'values': [{'formattedValue': str(value)} if value != '' else {}
+                            for value in row[start_column:end_column]]}
+                for row in rows
+            ]
+            row_metadata = [
+                {'developerMetadata': [{'metadataKey': key, 'metadataValue': value}
+                                       for key, value in metadata.items()]}
+                for metadata in sheet['row_metadata'][start_row:start_row + len(rows)]
+            ]
+            grid_data.setdefault(sheet['properties']['sheetId'], []).append(
+                {'rowData': row_data, 'rowMetadata': row_metadata})
+        resource['sheets'] = [{'properties': sheet['properties'], 'data': grid_data[sheet['properties']['sheetId']]}
+                              for sheet in spreadsheet['sheets'] if sheet['properties']['sheetId'] in grid_data]
+        return resource
+
+    def _resize(self, sheet, rows=None, columns=None):
+        grid = sheet['properties']['gridProperties']
+        if rows is not None and rows > grid['rowCount']:
+            extra = rows - grid['rowCount']
+            sheet['rows'].extend([] for _ in range(extra))
+            sheet['row_metadata'].extend({} for _ in range(extra))
+            grid['rowCount'] = rows
+        if columns is not None and columns > grid['columnCount']:
+            grid['columnCount'] = columns
+
+    def _write_values(self, sheet, start_row, start_column, values, check_grid=False):
+        grid = sheet['properties']['gridProperties']
+        width = max((len(row) for row in values), default=0)
+        if check_grid and (start_row + len(values) > grid['rowCount'] or start_column + width > grid['columnCount']):
+            raise FakeApiError(400, f"Range ({start_row + len(values)} rows, {start_column + width} columns) "
+                                    f"exceeds grid limits")
+        self._resize(sheet, start_row + len(values), start_column + width)
+        for offset, values_row in enumerate(values):
+            row = sheet['rows'][start_row + offset]
+            for column, value in enumerate(values_row, start_column):
+                if isinstance(value, str) and len(value) > SHEETS_MAX_CELL_CHARS:
+                    raise FakeApiError(400, f"Your input contains more than the maximum of "
+                                            f"{SHEETS_MAX_CELL_CHARS} characters in a single cell.")
+                if column > 0 and not self.retain_values:
+                    continue
+                if len(row) <= column:
+                    row.extend([''] * (column + 1 - len(row)))
+                row[column] = value
+
+    def _values_update(self, query, payload, headers, spreadsheet_id, a1_range):
+        spreadsheet = self._get_spreadsheet(spreadsheet_id)
+        title, start_row, start_column, end_row, end_column = parse_a1_range(a1_range)
+        values = payload.get('values', [])
+        width = max((len(row) for row in values), default=0)
+        if end_row is not None and ':' in a1_range and start_row + len(values) > end_row:
+            raise FakeApiError(400, f"Requested writing within range [{a1_range}], but tried writing to row "
+                                    f"[{start_row + len(values)}]")
+        if end_column is not None and ':' in a1_range and start_column + width > end_column:
+            raise FakeApiError(400, f"Requested writing within range [{a1_range}], but tried writing to column "
+                                    f"[{start_column + width}]")
+        self._write_values(self._find_sheet(spreadsheet, title), start_row, start_column, values)
+        return {'spreadsheetId': spreadsheet_id, 'updatedRange': a1_range, 'updatedRows': len(values),
+                'updatedColumns': width, 'updatedCells': sum(len(row) for row in values)}
+
+    def _values_append(self, query, payload, headers, spreadsheet_id, a1_range):
+        spreadsheet = self._get_spreadsheet(spreadsheet_id)
+        title, _, start_column, _, _ = parse_a1_range(a1_range)
+        sheet = self._find_sheet(spreadsheet, title)
+        last_row = len(sheet['rows'])
+        while last_row and not any(value != '' for value in sheet['rows'][last_row - 1]):
+            last_row -= 1
+        values = payload.get('values', [])
+        if query.get('insertDataOption') == 'INSERT_ROWS':
+            sheet['rows'][last_row:last_row] = [[] for _ in values]
+            sheet['row_metadata'][last_row:last_row] = [{} for _ in values]
+            sheet['properties']['gridProperties']['rowCount'] += len(values)
+        self._write_values(sheet, last_row, start_column, values)
+        return {'spreadsheetId': spreadsheet_id, 'tableRange': a1_range,
+                'updates': {'updatedRows': len(values), 'updatedCells': sum(len(row) for row in values)}}
+
+    def _values_clear(self, query, payload, headers, spreadsheet_id, a1_range):
+        spreadsheet = self._get_spreadsheet(spreadsheet_id)
+        title, start_row, start_column, end_row, end_column = parse_a1_range(a1_range)
+        sheet = self._find_sheet(spreadsheet, title)
+        for row in sheet['rows'][start_row:end_row]:
+            for column in range(start_column, min(len(row), end_column or len(row))):
+                row[column] = ''
+        return {'spreadsheetId': spreadsheet_id, 'clearedRange': a1_range}
+
+    def _values_batch_update(self, query, payload, headers, spreadsheet_id):
+        responses = [self._values_update(query, {'values': data.get('values', [])}, headers, spreadsheet_id, data['range'])
+                     for data in payload.get('data', [])]
+        return {'spreadsheetId': spreadsheet_id, 'responses': responses,
+                'totalUpdatedCells': sum(response['updatedCells'] for response in responses)}
+
+    def _spreadsheets_batch_update(self, query, payload, headers, spreadsheet_id):
+        spreadsheet = self._get_spreadsheet(spreadsheet_id)
+        replies = []
+        for request in payload.get('requests', []):
+            (kind, body), = request.items()
+            handler = getattr(self, f"_request_{kind}", None)
+            if handler is None:
+                raise FakeApiError(400, f"Unsupported batchUpdate request: {kind}")
+            replies.append(handler(spreadsheet, body) or {})
+        return {'spreadsheetId': spreadsheet_id, 'replies': replies}
+
+    def _dimension_sheet(self, spreadsheet, dimension_range):
+        sheet = self._find_sheet(spreadsheet, sheet_id=dimension_range['sheetId'])
+        grid = sheet['properties']['gridProperties']
+        limit = grid['rowCount'] if dimension_range['dimension'] == 'ROWS' else grid['columnCount']
+        if dimension_range['endIndex'] > limit:
+            raise FakeApiError(400, f"Invalid requests: range ends at {dimension_range['endIndex']}, "
+                                    f"past the grid's {limit} {dimension_range['dimension'].lower()}")
+        return sheet
+
+    def _move_references(self, sheet, move):
+        for row in sheet['rows']:
+            for column, value in enumerate(row):
+                if isinstance(value, str) and value.startswith('='):
+                    row[column] = _move_row_references(value, move)
+
+    def _request_updateCells(self, spreadsheet, body):
+        if 'rows' in body:
+            start = body['start']
+            sheet = self._find_sheet(spreadsheet, sheet_id=start['sheetId'])
+            values = [[_cell_value(cell) for cell in row.get('values', [])] for row in body['rows']]
+            self._write_values(sheet, start.get('rowIndex', 0), start.get('columnIndex', 0), values, check_grid=True)
+            return
+        grid_range = body['range']
+        sheet = self._find_sheet(spreadsheet, sheet_id=grid_range['sheetId'])
+        start_column = grid_range.get('startColumnIndex', 0)
+        end_column = grid_range.get('endColumnIndex')
+        for row in sheet['rows'][grid_range.get('startRowIndex', 0):grid_range.get('endRowIndex')]:
+            del row[start_column:end_column]
+
+    def _request_insertDimension(self, spreadsheet, body):
+        dimension_range = body['range']
+        sheet = self._find_sheet(spreadsheet, sheet_id=dimension_range['sheetId'])
+        start, end = dimension_range['startIndex'], dimension_range['endIndex']
+        grid = sheet['properties']['gridProperties']
+        if dimension_range['dimension'] == 'ROWS':
+            self._move_references(sheet, lambda row: row + end - start if row >= start else row)
+            sheet['rows'][start:start] = [[] for _ in range(end - start)]
+            sheet['row_metadata'][start:start] = [{} for _ in range(end - start)]
+            grid['rowCount'] += end - start
+        else:
+            for row in sheet['rows']:
+                if len(row) > start:
+                    row[start:start] = [''] * (end - start)
+            grid['columnCount'] += end - start
+
+    def _request_deleteDimension(self, spreadsheet, body):
+        dimension_range = body['range']
+        sheet = self._dimension_sheet(spreadsheet, dimension_range)
+        start, end = dimension_range['startIndex'], dimension_range['endIndex']
+        grid = sheet['properties']['gridProperties']
+        if dimension_range['dimension'] == 'ROWS':
+            self._move_references(sheet, lambda row: row if row < start else None if row < end else row - (end - start))
+            del sheet['rows'][start:end]
+            del sheet['row_metadata'][start:end]
+            grid['rowCount'] -= end - start
+        else:
+            for row in sheet['rows']:
+                del row[start:end]
+            grid['columnCount'] -= end - start
+
+    def _request_appendDimension(self, spreadsheet, body):
+        sheet = self._find_sheet(spreadsheet, sheet_id=body['sheetId'])
+        grid = sheet['properties']['gridProperties']
+        if body['dimension'] == 'ROWS':
+            self._resize(sheet, rows=grid['rowCount'] + body['length'])
+        else:
+            self._resize(sheet, columns=grid['columnCount'] + body['length'])
+
+    def _request_updateDimensionProperties(self, spreadsheet, body):
+        self._dimension_sheet(spreadsheet, body['range'])
+
+    def _request_createDeveloperMetadata(self, spreadsheet, body):
+        metadata = body['developerMetadata']
+        dimension_range = metadata['location']['dimensionRange']
+        sheet = self._dimension_sheet(spreadsheet, dimension_range)
+        for index in range(dimension_range['startIndex'], dimension_range['endIndex']):
+            sheet['row_metadata'][index][metadata['metadataKey']] = metadata.get('metadataValue')
+        stored = sum(len(key) + len(value or '') for row in sheet['row_metadata'] for key, value in row.items())
+        if stored > SHEETS_MAX_METADATA_CHARS:
+            raise FakeApiError(400, f"Developer metadata on sheet {sheet['properties']['sheetId']} would use "
+                                    f"{stored} characters, over the limit of {SHEETS_MAX_METADATA_CHARS}")
+        return {'createDeveloperMetadata': {'developerMetadata': metadata}}
+
+    def _request_deleteDeveloperMetadata(self, spreadsheet, body):
+        lookup = body['dataFilter']['developerMetadataLookup']
+        dimension_range = lookup['metadataLocation']['dimensionRange']
+        sheet = self._dimension_sheet(spreadsheet, dimension_range)
+        for index in range(dimension_range['startIndex'], dimension_range['endIndex']):
+            sheet['row_metadata'][index].pop(lookup['metadataKey'], None)
+
+    def _request_addSheet(self, spreadsheet, body):
+        properties = body.get('properties', {})
+        title = properties.get('title') or f"Sheet{len(spreadsheet['sheets']) + 1}"
+        if any(sheet['properties']['title'] == title for sheet in spreadsheet['sheets']):
+            raise FakeApiError(400, f'A sheet with the name "{title}" already exists.')
+        sheet_id = properties.get('sheetId', max(sheet['properties']['sheetId'] for sheet in spreadsheet['sheets']) + 1)
+        if any(sheet['properties']['sheetId'] == sheet_id for sheet in spreadsheet['sheets']):
+            raise FakeApiError(400, f"A sheet with the id {sheet_id} already exists.")
+        grid = properties.get('gridProperties', {})
+        sheet = self._new_sheet(sheet_id, title, grid.get('rowCount', 1000), grid.get('columnCount', 26))
+        sheet['properties']['gridProperties'].update(grid)
+        if 'hidden' in properties:
+            sheet['properties']['hidden'] = properties['hidden']
+        sheet['properties']['index'] = len(spreadsheet['sheets'])
+        spreadsheet['sheets'].append(sheet)
+        return {'addSheet': {'properties': sheet['properties']}}
+
+    def _request_deleteSheet(self, spreadsheet, body):
+        sheet = self._find_sheet(spreadsheet, sheet_id=body['sheetId'])
+        if len(spreadsheet['sheets']) == 1:
+            raise FakeApiError(400, "You can't remove all the sheets in a document.")
+        spreadsheet['sheets'].remove(sheet)
+        for index, remaining in enumerate(spreadsheet['sheets']):
+            remaining['properties']['index'] = index
+
+    def _request_updateSheetProperties(self, spreadsheet, body):
+        properties = body['properties']
+        sheet = self._find_sheet(spreadsheet, sheet_id=properties.get('sheetId', 0))
+        for field in body['fields'].split(','):
+            field = field.strip()
+            if field in properties:
+                sheet['properties'][field] = properties[field]
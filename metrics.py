@@ -0,0 +1,172 @@
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+METRIC_PREFIX = 'koshinko_dataset'
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of values, or None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _write_atomically(path, content):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        # mkstemp creates the file readable by its owner only; collectors such as
+        # node_exporter usually run as another user
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+class RunMetrics:
+    """Thread-safe counters and timers for one run of the dataset build.
+
+    Stage seconds are summed over every call, so stages that run on worker threads can
+    add up to more than the run's wall time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._started = time.perf_counter()
+            self.stage_seconds = defaultdict(float)
+            self.stage_calls = Counter()
+            self.api_calls = Counter()
+            self.retries = Counter()
+            self.bytes_downloaded = 0
+            self.bytes_encoded = 0
+            self.counters = Counter()
+            self.file_latencies = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stage_seconds[name] += elapsed
+                self.stage_calls[name] += 1
+
+    def timed(self, name=None):
+        """Decorator that records a function's calls and wall time as a stage."""
+        def decorator(function):
+            stage_name = name or function.__name__
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_api_call(self, endpoint):
+        with self._lock:
+            self.api_calls[endpoint or 'unknown'] += 1
+
+    def record_retry(self, endpoint):
+        with self._lock:
+            self.retries[endpoint or 'unknown'] += 1
+
+    def add_bytes_downloaded(self, count):
+        with self._lock:
+            self.bytes_downloaded += count
+
+    def add_bytes_encoded(self, count):
+        with self._lock:
+            self.bytes_encoded += count
+
+    def count(self, name, amount=1):
+        """Add to a named event counter, e.g. images too large to embed."""
+        with self._lock:
+            self.counters[name] += amount
+
+    def record_file_latency(self, seconds):
+        with self._lock:
+            self.file_latencies.append(seconds)
+
+    def snapshot(self, **extra):
+        """Return the run's metrics as a JSON-serializable dict, merged with extra sections."""
+        with self._lock:
+            report = {
+                'started_at': self.started_at,
+                'duration_seconds': time.perf_counter() - self._started,
+                'stages': {
+                    name: {'calls': self.stage_calls[name], 'seconds': seconds}
+                    for name, seconds in self.stage_seconds.items()
+                },
+                'api_calls': dict(self.api_calls),
+                'retries': dict(self.retries),
+                'bytes_downloaded': self.bytes_downloaded,
+                'bytes_encoded': self.bytes_encoded,
+                'counters': dict(self.counters),
+                'files': len(self.file_latencies),
+                'file_latency_seconds': {
+                    'p50': percentile(self.file_latencies, 0.5),
+                    'p95': percentile(self.file_latencies, 0.95),
+                },
+            }
+        report.update(extra)
+        return report
+
+    def write_json_report(self, path, **extra):
+        _write_atomically(path, json.dumps(self.snapshot(**extra), indent=2, sort_keys=True) + '\n')
+
+    def write_prometheus_textfile(self, path, success=True):
+        """Write the run's metrics in the node_exporter textfile-collector format."""
+        report = self.snapshot()
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape_label(label)}"' for key, label in labels.items())
+                lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {value}" if label_text
+                             else f"{METRIC_PREFIX}_{name} {value}")
+
+        metric('last_run_success', 'Whether the last run finished without error.', [({}, int(success))])
+        metric('last_run_timestamp_seconds', 'Unix time the last run started.', [({}, report['started_at'])])
+        metric('last_run_duration_seconds', 'Wall time of the last run.', [({}, report['duration_seconds'])])
+        metric('stage_seconds', 'Seconds spent in each stage, summed over threads.',
+               [({'stage': name}, stage['seconds']) for name, stage in sorted(report['stages'].items())])
+        metric('stage_calls', 'Calls made to each stage.',
+               [({'stage': name}, stage['calls']) for name, stage in sorted(report['stages'].items())])
+        metric('api_calls', 'API requests sent per endpoint, retries included.',
+               [({'endpoint': name}, count) for name, count in sorted(report['api_calls'].items())])
+        metric('api_retries', 'API requests retried per endpoint.',
+               [({'endpoint': name}, count) for name, count in sorted(report['retries'].items())])
+        metric('bytes_downloaded', 'Bytes of media downloaded.', [({}, report['bytes_downloaded'])])
+        metric('bytes_encoded', 'Bytes of base64 image data embedded.', [({}, report['bytes_encoded'])])
+        metric('events', 'Named run events, e.g. images too large to embed.',
+               [({'event': name}, count) for name, count in sorted(report['counters'].items())])
+        metric('files', 'Image cells built.', [({}, report['files'])])
+        metric('file_latency_seconds', 'Per-file download and encode latency.',
+               [({'quantile': quantile}, report['file_latency_seconds'][key])
+                for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'))
+                if report['file_latency_seconds'][key] is not None])
+
+        _write_atomically(path, '\n'.join(lines) + '\n')
+
+metrics = RunMetrics()
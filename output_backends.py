@@ -0,0 +1,165 @@
+import base64
+import html
+import os
+import re
+import tempfile
+
+from sheet_sync import column_letter
+
+XLSX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+HTML_MIME_TYPE = 'text/html'
+
+_IMAGE_FORMULA = re.compile(r'=IMAGE\("([^"]*)", 1\)', re.DOTALL)
+_DATA_URI = re.compile(r'data:([^;,]+);base64,(.*)', re.DOTALL)
+
+def parse_cell(value):
+    """Split a prepared sheet cell into what a local file needs to show it.
+
+    Returns ('data', mime_type, base64_text) for an embedded image, ('url', url) for a linked
+    image and ('text', value) for anything else.
+    """
+    match = _IMAGE_FORMULA.fullmatch(value) if isinstance(value, str) else None
+    if not match:
+        return 'text', value
+    data_uri = _DATA_URI.fullmatch(match.group(1))
+    if data_uri:
+        return 'data', data_uri.group(1), data_uri.group(2)
+    return 'url', match.group(1)
+
+class HtmlContactSheet:
+    """Static HTML page showing the prefix x identifier grid, written one row at a time.
+
+    Embedded images are inlined as data URIs, so the page is a single self-contained file
+    that can be uploaded on its own. Linked images are lazy-loaded, so browsers only fetch
+    the ones near the screen.
+    """
+
+    def __init__(self, path, title, thumbnail_size):
+        self.path = path
+        self.thumbnail_size = thumbnail_size
+        self._file = open(path, 'w', encoding='utf-8')
+        self._file.write(
+            '<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+            f'<title>{html.escape(title)}</title>\n<style>'
+            'table{border-collapse:collapse}th,td{border:1px solid #ccc;padding:4px;text-align:center}'
+            f'td{{width:{thumbnail_size}px;height:{thumbnail_size}px}}'
+            'img{max-width:100%;max-height:100%}thead th{position:sticky;top:0;background:#fff}'
+            '</style></head><body>\n<table>\n'
+        )
+        self._header_written = False
+
+    def write_row(self, row):
+        if not self._header_written:
+            cells = ''.join(f'<th>{html.escape(str(value))}</th>' for value in row)
+            self._file.write(f'<thead><tr>{cells}</tr></thead>\n<tbody>\n')
+            self._header_written = True
+            return
+
+        cells = [f'<th>{html.escape(str(row[0]))}</th>']
+        for value in row[1:]:
+            kind, *parts = parse_cell(value)
+            if kind == 'data':
+                # The bytes are already in the page, so there is nothing to load lazily
+                src, loading = f'data:{parts[0]};base64,{parts[1]}', ''
+            elif kind == 'url':
+                src, loading = parts[0], ' loading="lazy"'
+            else:
+                cells.append(f'<td>{html.escape(str(parts[0]))}</td>')
+                continue
+            cells.append(f'<td><img{loading} decoding="async" src="{html.escape(src)}" alt=""></td>')
+        self._file.write(f'<tr>{"".join(cells)}</tr>\n')
+
+    def close(self):
+        self._file.write('</tbody>\n</table>\n</body></html>\n')
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.path)
+
+class XlsxContactSheet:
+    """XLSX workbook showing the prefix x identifier grid with images embedded in their cells.
+
+    Rows go through openpyxl's write-only mode, so they are streamed to disk as they arrive.
+    Image bytes are spooled to a temporary directory and only read back while the workbook
+    is saved, so only a small anchor per image stays in memory. openpyxl does build the
+    sheet's whole drawing part while saving, which takes roughly 10 KB per image.
+    """
+
+    def __init__(self, path, title, thumbnail_size):
+        try:
+            from openpyxl import Workbook
+            from openpyxl.drawing.image import Image
+        except ImportError:
+            raise RuntimeError("The xlsx output backend needs openpyxl: pip install openpyxl")
+        self._image_class = Image
+        self.path = path
+        self.thumbnail_size = thumbnail_size
+        self._spool = tempfile.TemporaryDirectory(prefix='contact-sheet-')
+        self._image_count = 0
+        self._row_number = 0
+
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet(title[:31] or 'Sheet1')
+        # Row heights are in points and column widths in characters of roughly 7 pixels
+        self._sheet.sheet_format.defaultRowHeight = (thumbnail_size + 20) * 0.75
+        self._sheet.sheet_format.customHeight = True
+        self._sheet.freeze_panes = 'A2'
+
+    def _add_image(self, mime_type, encoded, anchor):
+        self._image_count += 1
+        extension = mime_type.split('/')[-1]
+        image_path = os.path.join(self._spool.name, f"{self._image_count}.{extension}")
+        with open(image_path, 'wb') as f:
+            f.write(base64.b64decode(encoded))
+        image = self._image_class(image_path)
+        scale = self.thumbnail_size / max(image.width, image.height, 1)
+        image.width, image.height = round(image.width * scale), round(image.height * scale)
+        self._sheet.add_image(image, anchor)
+
+    def write_row(self, row):
+        self._row_number += 1
+        if self._row_number == 1:
+            # Column widths must be set before the first row is streamed
+            for index in range(1, len(row)):
+                self._sheet.column_dimensions[column_letter(index)].width = (self.thumbnail_size + 20) / 7
+            self._sheet.append([str(value) for value in row])
+            return
+
+        values = [row[0]]
+        for index, value in enumerate(row[1:], 1):
+            kind, *parts = parse_cell(value)
+            if kind == 'data':
+                self._add_image(parts[0], parts[1], f"{column_letter(index)}{self._row_number}")
+                values.append(None)
+            elif kind == 'url':
+                values.append(f'=HYPERLINK("{parts[0]}", "Open image")')
+            else:
+                values.append(parts[0] if parts[0] != '' else None)
+        self._sheet.append(values)
+
+    def close(self):
+        try:
+            self._workbook.save(self.path)
+        finally:
+            self._spool.cleanup()
+
+    def abort(self):
+        self._spool.cleanup()
+
+BACKENDS = {'xlsx': (XlsxContactSheet, XLSX_MIME_TYPE), 'html': (HtmlContactSheet, HTML_MIME_TYPE)}
+
+def write_contact_sheet(backend, path, title, thumbnail_size, rows):
+    """Write rows, header first, to a local XLSX or HTML contact sheet and return its MIME type."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown output backend {backend!r}, expected one of: sheets, {', '.join(BACKENDS)}")
+    backend_class, mime_type = BACKENDS[backend]
+    sheet = backend_class(path, title, thumbnail_size)
+    try:
+        for row in rows:
+            sheet.write_row(row)
+    except BaseException:
+        sheet.abort()
+        raise
+    sheet.close()
+    return mime_type
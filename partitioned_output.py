@@ -0,0 +1,132 @@
+import re
+
+from sheet_sync import column_letter
+
+INDEX_SHEET_TITLE = 'Index'
+INDEX_HEADER = ['Part', 'Spreadsheet', 'First prefix', 'Last prefix', 'Rows']
+
+# Cells reserved for each spreadsheet's index tab when packing partitions into spreadsheets
+INDEX_SHEET_CELLS = 1000 * 26
+
+def row_size(row):
+    """Approximate the characters a row adds to a spreadsheet."""
+    return sum(len(str(value)) for value in row)
+
+def partition_rows(rows, max_rows=0, max_bytes=0):
+    """Split rows into consecutive partitions of at most max_rows rows and max_bytes characters.
+
+    A limit of 0 means no limit; a single row larger than max_bytes gets a partition of its own.
+    """
+    partitions = []
+    current = []
+    current_bytes = 0
+    for row in rows:
+        size = row_size(row)
+        if current and ((max_rows and len(current) >= max_rows) or (max_bytes and current_bytes + size > max_bytes)):
+            partitions.append(current)
+            current, current_bytes = [], 0
+        current.append(row)
+        current_bytes += size
+    if current:
+        partitions.append(current)
+    return partitions
+
+def assign_partitions(partitions, width, one_per_spreadsheet=False, max_cells=10_000_000):
+    """Group partition indices into spreadsheets without passing max_cells per spreadsheet.
+
+    Each partition is a tab holding its rows plus a header row. Returns a list of index lists,
+    one per spreadsheet, in order.
+    """
+    spreadsheets = []
+    cells = 0
+    for index, partition in enumerate(partitions):
+        partition_cells = (len(partition) + 1) * width
+        if not spreadsheets or one_per_spreadsheet or cells + partition_cells > max_cells:
+            spreadsheets.append([])
+            cells = INDEX_SHEET_CELLS
+        spreadsheets[-1].append(index)
+        cells += partition_cells
+    return spreadsheets
+
+def partition_title(index):
+    return f"Part {index + 1}"
+
+def is_output_tab(title):
+    """Whether a tab title is one this module creates: the index tab or a partition tab."""
+    return title == INDEX_SHEET_TITLE or re.fullmatch(r'Part \d+', title) is not None
+
+def sheet_range(title, start='A1'):
+    """Return an A1 range on the named tab, quoting the title as Sheets requires."""
+    return f"'{title.replace(chr(39), chr(39) * 2)}'!{start}"
+
+def layout_requests(existing_sheets, partitions, partition_indices, width, row_pixels, column_pixels):
+    """Build the batchUpdate that lays out one spreadsheet for its partitions.
+
+    The first existing tab becomes the index tab, grown to fit a row per partition if needed.
+    Index and partition tabs left from an earlier run are deleted; tabs with any other title
+    are left alone. Each partition gets a tab sized exactly to its rows, with a frozen header
+    row and image sized rows and columns. Returns (requests, {partition index: sheetId}).
+    """
+    first, *others = existing_sheets
+    requests = [{'deleteSheet': {'sheetId': sheet['properties']['sheetId']}}
+                for sheet in others if is_output_tab(sheet['properties']['title'])]
+    requests.append({
+        'updateSheetProperties': {
+            'properties': {'sheetId': first['properties']['sheetId'], 'title': INDEX_SHEET_TITLE},
+            'fields': 'title'
+        }
+    })
+    missing_rows = len(partitions) + 1 - first['properties'].get('gridProperties', {}).get('rowCount', 1000)
+    if missing_rows > 0:
+        requests.append({
+            'appendDimension': {'sheetId': first['properties']['sheetId'], 'dimension': 'ROWS', 'length': missing_rows}
+        })
+
+    next_sheet_id = max(sheet['properties']['sheetId'] for sheet in existing_sheets) + 1
+    sheet_ids = {}
+    for offset, index in enumerate(partition_indices):
+        sheet_id = next_sheet_id + offset
+        sheet_ids[index] = sheet_id
+        row_count = len(partitions[index]) + 1
+        requests.append({
+            'addSheet': {
+                'properties': {
+                    'sheetId': sheet_id,
+                    'title': partition_title(index),
+                    'gridProperties': {'rowCount': row_count, 'columnCount': width, 'frozenRowCount': 1}
+                }
+            }
+        })
+        for dimension, start, end, pixels in (('ROWS', 1, row_count, row_pixels), ('COLUMNS', 1, width, column_pixels)):
+            if start < end:
+                requests.append({
+                    'updateDimensionProperties': {
+                        'range': {'sheetId': sheet_id, 'dimension': dimension, 'startIndex': start, 'endIndex': end},
+                        'properties': {'pixelSize': pixels},
+                        'fields': 'pixelSize'
+                    }
+                })
+    return requests, sheet_ids
+
+def index_rows(partitions, locations):
+    """Build the index tab: one linked row per partition.
+
+    locations maps a partition index to (spreadsheet_id, spreadsheet_name, sheet_id).
+    """
+    rows = [INDEX_HEADER]
+    for index, partition in enumerate(partitions):
+        spreadsheet_id, spreadsheet_name, sheet_id = locations[index]
+        url = f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}/edit#gid={sheet_id}"
+        rows.append([
+            f'=HYPERLINK("{url}", "{partition_title(index)}")',
+            spreadsheet_name,
+            partition[0][0],
+            partition[-1][0],
+            len(partition),
+        ])
+    return rows
+
+def full_range(title, rows):
+    """Return the A1 range exactly covering rows written from the tab's top-left cell."""
+    width = max(len(row) for row in rows)
+    return sheet_range(title, f"A1:{column_letter(width - 1)}{len(rows)}")
@@ -0,0 +1,88 @@
+import json
+import sqlite3
+
+class RunJournal:
+    """SQLite journal of a dataset build, so an interrupted build can resume where it stopped.
+
+    A build records its settings, its spreadsheet and the full list of (prefix, files) groups
+    when it starts, one journal row per sheet row. Each row is then marked encoded, with its
+    cell values, once built and written once flushed to the sheet. Cell values are dropped
+    once written, so the journal only ever holds the rows still waiting for a flush.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS run ('
+                'id INTEGER PRIMARY KEY CHECK (id = 1), settings TEXT NOT NULL, '
+                'spreadsheet_id TEXT NOT NULL, completed INTEGER NOT NULL DEFAULT 0)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS rows ('
+                'position INTEGER PRIMARY KEY, prefix TEXT, files TEXT, '
+                'row_values TEXT, written INTEGER NOT NULL DEFAULT 0)'
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def get_run(self):
+        """Return the journaled run as a dict, or None if nothing was journaled."""
+        row = self.connection.execute('SELECT settings, spreadsheet_id, completed FROM run').fetchone()
+        if row is None:
+            return None
+        settings, spreadsheet_id, completed = row
+        return {'settings': json.loads(settings), 'spreadsheet_id': spreadsheet_id, 'completed': bool(completed)}
+
+    def start(self, settings, spreadsheet_id, header, groups):
+        """Replace any previous journal with a new run writing header and then one row per group."""
+        with self.connection:
+            self.connection.execute('DELETE FROM run')
+            self.connection.execute('DELETE FROM rows')
+            self.connection.execute(
+                'INSERT INTO run (id, settings, spreadsheet_id) VALUES (1, ?, ?)',
+                (json.dumps(settings, sort_keys=True), spreadsheet_id)
+            )
+            self.connection.execute(
+                'INSERT INTO rows (position, row_values) VALUES (0, ?)', (json.dumps(header),)
+            )
+            self.connection.executemany(
+                'INSERT INTO rows (position, prefix, files) VALUES (?, ?, ?)',
+                ((position, prefix, json.dumps(files_dict))
+                 for position, (prefix, files_dict) in enumerate(groups, 1))
+            )
+
+    def progress(self):
+        """Return (written_rows, total_rows), header included."""
+        return self.connection.execute('SELECT COALESCE(SUM(written), 0), COUNT(*) FROM rows').fetchone()
+
+    def pending_rows(self):
+        """Return [(position, prefix, files_dict, row_values or None), ...] for unwritten rows, in order."""
+        rows = self.connection.execute(
+            'SELECT position, prefix, files, row_values FROM rows WHERE written = 0 ORDER BY position'
+        )
+        return [
+            (position, prefix, json.loads(files) if files else None,
+             json.loads(row_values) if row_values is not None else None)
+            for position, prefix, files, row_values in rows
+        ]
+
+    def record_encoded(self, position, row):
+        with self.connection:
+            self.connection.execute(
+                'UPDATE rows SET row_values = ? WHERE position = ?', (json.dumps(row), position)
+            )
+
+    def mark_written(self, positions):
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE rows SET written = 1, row_values = NULL WHERE position = ?',
+                ((position,) for position in positions)
+            )
+
+    def complete(self):
+        with self.connection:
+            self.connection.execute('UPDATE run SET completed = 1')
@@ -1,47 +1,124 @@
 import json
 import logging
 import os
+import threading
 
+from config import SERVICE_ACCOUNT_FILE, CREDENTIALS_FILE, TOKEN_FILE, HTTP_TIMEOUT
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+logger = logging.getLogger(__name__)
 
-from config import SERVICE_ACCOUNT_FILE, CREDENTIALS_FILE, TOKEN_FILE
+# One set of credentials covers both APIs, so Drive and Sheets never disagree on scopes
+SCOPES = ['https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/spreadsheets']
 
-logger = logging.getLogger(__name__)
+_credentials = None
+_credentials_lock = threading.Lock()
+
+# Parsed discovery documents, shared by every service object built in this process
+_discovery_documents = {}
+_build_lock = threading.Lock()
+
+# httplib2 is not thread-safe, so each worker thread gets its own service objects
+_thread_local = threading.local()
+
+# Transport that replaces the authorized Google one, e.g. fake_google's FakeHttp in benchmarks
+_http_override = None
+
+def use_http(http):
+    """Make every service built afterwards send its requests through http instead of Google."""
+    global _http_override
+    _http_override = http
+
+# The Google client libraries are imported where they are first needed, so that importing
+# this module (and everything built on it) stays cheap for commands that never call an API
+
+def _load_credentials():
+    import google_auth_httplib2
+    import httplib2
+
+    # Try service account auth first
+    if SERVICE_ACCOUNT_FILE and os.path.exists(SERVICE_ACCOUNT_FILE):
+        from google.oauth2 import service_account
+
+        return service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+
+    # Fall back to OAuth
+    from google.oauth2.credentials import Credentials
+
+    credentials = None
+    if TOKEN_FILE and os.path.exists(TOKEN_FILE):
+        with open(TOKEN_FILE) as token:
+            credentials = Credentials.from_authorized_user_info(json.load(token), SCOPES)
+
+    if credentials and credentials.valid:
+        return credentials
+
+    if credentials and credentials.expired and credentials.refresh_token:
+        try:
+            credentials.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=HTTP_TIMEOUT)))
+        except Exception as e:
+            logger.warning(f"Could not refresh stored credentials, re-authorizing: {e}")
+
+    if not credentials or not credentials.valid:
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+        credentials = flow.run_local_server(port=0)
+
+    # Save the credentials for the next run
+    with open(TOKEN_FILE, 'w') as token:
+        token.write(credentials.to_json())
+
+    return credentials
+
+def get_credentials():
+    """Load the credentials shared by all services, reading the token file at most once."""
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            _credentials = _load_credentials()
+        return _credentials
+
+def get_authorized_http():
+    """Return the calling thread's keep-alive HTTP transport, authorized with the shared credentials.
+
+    Drive and Sheets services built on the same thread share this transport and its open
+    connections.
+    """
+    if _http_override is not None:
+        return _http_override
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        import google_auth_httplib2
+        import httplib2
+
+        http = google_auth_httplib2.AuthorizedHttp(get_credentials(), http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        _thread_local.http = http
+    return http
+
+def _get_discovery_document(name, version):
+    document = _discovery_documents.get((name, version))
+    if document is None:
+        from googleapiclient.discovery_cache import get_static_doc
+
+        static_document = get_static_doc(name, version)
+        document = json.loads(static_document) if static_document else None
+        _discovery_documents[(name, version)] = document
+    return document
+
+def _build_service(name, version):
+    from googleapiclient.discovery import build, build_from_document
+
+    # build_from_document fills in method parameters on the shared document, so builds are serialized
+    with _build_lock:
+        document = _get_discovery_document(name, version)
+        if document is None:
+            return build(name, version, http=get_authorized_http())
+        return build_from_document(document, http=get_authorized_http())
 
 def get_drive_service():
     """Initialize and return Google Drive API service."""
     try:
-        # Try service account auth first
-        if os.path.exists(SERVICE_ACCOUNT_FILE):
-            credentials = service_account.Credentials.from_service_account_file(
-                SERVICE_ACCOUNT_FILE, 
-                scopes=['https://www.googleapis.com/auth/drive']
-            )
-            return build('drive', 'v3', credentials=credentials)
-        
-        # Fall back to OAuth
-        from google.oauth2.credentials import Credentials
-        from google_auth_oauthlib.flow import InstalledAppFlow
-        
-        SCOPES = ['https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/spreadsheets']
-        
-        credentials = None
-        if os.path.exists(TOKEN_FILE):
-            credentials = Credentials.from_authorized_user_info(
-                json.loads(open(TOKEN_FILE).read()), SCOPES)
-        
-        if not credentials or not credentials.valid:
-            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-            credentials = flow.run_local_server(port=0)
-            
-            # Save the credentials for the next run
-            with open(TOKEN_FILE, 'w') as token:
-                token.write(credentials.to_json())
-                
-        return build('drive', 'v3', credentials=credentials)
-    
+        return _build_service('drive', 'v3')
     except Exception as e:
         logger.error(f"Error setting up Drive service: {e}")
         raise
@@ -49,26 +126,23 @@ def get_drive_service():
 def get_sheets_service():
     """Initialize and return Google Sheets API service."""
     try:
-        # Similar auth logic as drive service
-        if os.path.exists(SERVICE_ACCOUNT_FILE):
-            credentials = service_account.Credentials.from_service_account_file(
-                SERVICE_ACCOUNT_FILE, 
-                scopes=['https://www.googleapis.com/auth/spreadsheets']
-            )
-            return build('sheets', 'v4', credentials=credentials)
-        
-        # Fall back to OAuth using the same credentials as Drive
-        from google.oauth2.credentials import Credentials
-        
-        credentials = None
-        if os.path.exists(TOKEN_FILE):
-            credentials = Credentials.from_authorized_user_info(
-                json.loads(open(TOKEN_FILE).read()), 
-                ['https://www.googleapis.com/auth/spreadsheets']
-            )
-            
-        return build('sheets', 'v4', credentials=credentials)
-    
+        return _build_service('sheets', 'v4')
     except Exception as e:
         logger.error(f"Error setting up Sheets service: {e}")
         raise
+
+def get_thread_drive_service():
+    """Return a Google Drive API service owned by the calling thread."""
+    service = getattr(_thread_local, 'drive_service', None)
+    if service is None:
+        service = get_drive_service()
+        _thread_local.drive_service = service
+    return service
+
+def get_thread_sheets_service():
+    """Return a Google Sheets API service owned by the calling thread."""
+    service = getattr(_thread_local, 'sheets_service', None)
+    if service is None:
+        service = get_sheets_service()
+        _thread_local.sheets_service = service
+    return service
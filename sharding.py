@@ -0,0 +1,92 @@
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+
+def parse_shard(spec):
+    """Parse an 'INDEX/COUNT' shard spec with a zero-based INDEX, e.g. '0/4'."""
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard {spec!r}, expected INDEX/COUNT such as 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {spec!r}, INDEX must be between 0 and COUNT - 1")
+    return index, count
+
+def shard_for_prefix(prefix, count):
+    """Return the shard a prefix belongs to.
+
+    The hash only depends on the prefix, so every worker on every host agrees on it,
+    unlike the built-in hash() whose string hashing is randomized per process.
+    """
+    digest = hashlib.sha1(prefix.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+def shard_path(directory, index, count):
+    return os.path.join(directory, f"shard-{index:04d}-of-{count:04d}.jsonl")
+
+def write_shard_file(path, metadata, positioned_rows):
+    """Write a shard's rows as JSONL: a metadata line, then one {"position", "row"} line per row.
+
+    The file is written under a temporary name and moved into place once complete, so a
+    merge never sees a partial shard.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.shard-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(metadata, sort_keys=True) + '\n')
+            for position, row in positioned_rows:
+                f.write(json.dumps({'position': position, 'row': row}, ensure_ascii=False) + '\n')
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def read_shard_metadata(path):
+    with open(path, encoding='utf-8') as f:
+        return json.loads(f.readline())
+
+def _iter_shard_rows(path):
+    with open(path, encoding='utf-8') as f:
+        f.readline()
+        for line in f:
+            entry = json.loads(line)
+            yield entry['position'], entry['row']
+
+def check_shards(paths):
+    """Check that paths hold every shard of one run and return that run's metadata.
+
+    Raises ValueError when shards are missing, repeated or were built with different settings.
+    """
+    if not paths:
+        raise ValueError("No shard files to merge")
+    metadata = [read_shard_metadata(path) for path in paths]
+    first = metadata[0]
+    for path, shard in zip(paths, metadata):
+        if {key: value for key, value in shard.items() if key != 'shard'} != \
+                {key: value for key, value in first.items() if key != 'shard'}:
+            raise ValueError(f"Shard file {path} was built by a different run than {paths[0]}")
+    found = sorted(shard['shard'] for shard in metadata)
+    if found != list(range(first['shards'])):
+        missing = sorted(set(range(first['shards'])) - set(found))
+        raise ValueError(f"Expected shards 0-{first['shards'] - 1}, missing {missing or 'none'}, got {found}")
+    return first
+
+def merge_shard_rows(paths, row_count):
+    """Yield the rows of all shard files in position order, as a single-process run writes them.
+
+    Each file is already in position order, so this is a streaming k-way merge. Raises
+    ValueError if the positions do not cover 0 .. row_count - 1 exactly once.
+    """
+    expected = 0
+    for position, row in heapq.merge(*(_iter_shard_rows(path) for path in paths), key=lambda entry: entry[0]):
+        if position != expected:
+            raise ValueError(f"Shard files are missing row {expected}" if position > expected
+                             else f"Shard files repeat row {position}")
+        expected += 1
+        yield row
+    if expected != row_count:
+        raise ValueError(f"Shard files hold {expected} rows, expected {row_count}")
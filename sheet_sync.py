@@ -0,0 +1,239 @@
+import hashlib
+import json
+import logging
+from difflib import SequenceMatcher
+
+from api_requests import execute
+from config import THUMBNAIL_SIZE, DEBUG
+
+logger = logging.getLogger(__name__)
+
+# Hidden sheet whose column A holds a hash of the values of each row of the first sheet.
+# Developer metadata would follow rows around by itself, but Sheets caps it at 30,000
+# characters per sheet, a few hundred fingerprints.
+FINGERPRINT_SHEET_TITLE = '_row_fingerprints'
+
+def row_fingerprint(row):
+    """Return a stable hash of a row's cell values."""
+    return hashlib.sha1(json.dumps(row, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def _cell_data(value):
+    """Convert a prepared cell value into Sheets CellData."""
+    if value is None or value == '':
+        return {}
+    if isinstance(value, str) and value.startswith('='):
+        return {'userEnteredValue': {'formulaValue': value}}
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+def column_letter(index):
+    """Convert a zero-based column index to A1 column letters (0 -> 'A', 26 -> 'AA')."""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _row_range(sheet_id, start, end):
+    return {'sheetId': sheet_id, 'dimension': 'ROWS', 'startIndex': start, 'endIndex': end}
+
+def _quoted_title(properties):
+    return "'" + properties['title'].replace("'", "''") + "'"
+
+def find_fingerprint_sheet(sheets):
+    """Return the properties of the fingerprint sheet among the sheets' properties, or None."""
+    return next((sheet for sheet in sheets[1:] if sheet['title'] == FINGERPRINT_SHEET_TITLE), None)
+
+def read_sheet_rows(sheets_service, spreadsheet_id):
+    """Read the Prefix column of the first sheet and the fingerprint stored for each of its rows.
+
+    Returns (properties of every sheet, [(prefix, fingerprint), ...]) with one entry per
+    used row of the first sheet, header included. Rows written without a fingerprint
+    report None.
+    """
+    metadata = execute(sheets_service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        fields='sheets(properties(sheetId,title,gridProperties))'
+    ))
+    sheets = [sheet['properties'] for sheet in metadata['sheets']]
+    properties = sheets[0]
+    fingerprint_properties = find_fingerprint_sheet(sheets)
+
+    ranges = [f"{_quoted_title(properties)}!A:A"]
+    if fingerprint_properties:
+        ranges.append(f"{_quoted_title(fingerprint_properties)}!A:A")
+    response = execute(sheets_service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id,
+        ranges=ranges,
+        includeGridData=True,
+        fields='sheets(properties(sheetId),data(rowData(values(formattedValue))))'
+    ))
+    columns = {}
+    for sheet in response['sheets']:
+        row_data = sheet.get('data', [{}])[0].get('rowData', [])
+        columns[sheet['properties']['sheetId']] = [
+            row['values'][0].get('formattedValue', '') if row.get('values') else '' for row in row_data
+        ]
+
+    prefixes = columns.get(properties['sheetId'], [])
+    fingerprints = columns.get(fingerprint_properties['sheetId'], []) if fingerprint_properties else []
+    rows = [(prefix, fingerprints[index] if index < len(fingerprints) and fingerprints[index] else None)
+            for index, prefix in enumerate(prefixes)]
+
+    # Trailing blank rows are not part of the dataset
+    while rows and rows[-1][0] == '':
+        rows.pop()
+
+    return sheets, rows
+
+def _write_rows_requests(sheet_id, fingerprint_sheet_id, start, rows, width):
+    """Requests that overwrite rows starting at index start and store their fingerprints."""
+    return [{
+        'updateCells': {
+            'rows': [
+                {'values': [_cell_data(value) for value in row] + [{}] * (width - len(row))}
+                for row in rows
+            ],
+            'fields': 'userEnteredValue',
+            'start': {'sheetId': sheet_id, 'rowIndex': start, 'columnIndex': 0}
+        }
+    }, {
+        'updateCells': {
+            'rows': [{'values': [_cell_data(row_fingerprint(row))]} for row in rows],
+            'fields': 'userEnteredValue',
+            'start': {'sheetId': fingerprint_sheet_id, 'rowIndex': start, 'columnIndex': 0}
+        }
+    }]
+
+def plan_sync_requests(sheet_id, fingerprint_sheet_id, existing_rows, data, column_count=0):
+    """Diff existing (prefix, fingerprint) rows against data and build batchUpdate requests.
+
+    Rows are matched by their Prefix value. Matching rows whose fingerprint is unchanged
+    get no request at all. Operations are emitted from the bottom of the sheet upwards,
+    so the row indices of earlier operations stay valid while the batch is applied. Every
+    row insert and delete is repeated on the fingerprint sheet, which keeps its rows lined
+    up with the first sheet's. Returns (requests, summary).
+    """
+    width = max([column_count] + [len(row) for row in data])
+    matcher = SequenceMatcher(a=[prefix for prefix, _ in existing_rows],
+                              b=[str(row[0]) for row in data], autojunk=False)
+
+    requests = []
+    summary = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == 'equal':
+            for offset in range(i2 - i1):
+                index, row = i1 + offset, data[j1 + offset]
+                if existing_rows[index][1] == row_fingerprint(row):
+                    summary['unchanged'] += 1
+                    continue
+                requests.extend(_write_rows_requests(sheet_id, fingerprint_sheet_id, index, [row], width))
+                summary['updated'] += 1
+            continue
+
+        # Insert before deleting so the sheet never runs out of rows
+        new_rows = data[j1:j2]
+        if new_rows:
+            for target_sheet_id in (sheet_id, fingerprint_sheet_id):
+                requests.append({
+                    'insertDimension': {
+                        'range': _row_range(target_sheet_id, i1, i1 + len(new_rows)),
+                        'inheritFromBefore': i1 > 0
+                    }
+                })
+            requests.extend(_write_rows_requests(sheet_id, fingerprint_sheet_id, i1, new_rows, width))
+            image_rows_start = max(i1, 1)  # Skip header row
+            if image_rows_start < i1 + len(new_rows):
+                requests.append({
+                    'updateDimensionProperties': {
+                        'range': _row_range(sheet_id, image_rows_start, i1 + len(new_rows)),
+                        'properties': {'pixelSize': THUMBNAIL_SIZE + 20},
+                        'fields': 'pixelSize'
+                    }
+                })
+            summary['inserted'] += len(new_rows)
+
+        if i2 > i1:
+            shifted_start = i1 + len(new_rows)
+            for target_sheet_id in (sheet_id, fingerprint_sheet_id):
+                requests.append({
+                    'deleteDimension': {
+                        'range': _row_range(target_sheet_id, shifted_start, shifted_start + (i2 - i1))
+                    }
+                })
+            summary['deleted'] += i2 - i1
+
+    return requests, summary
+
+def sync_spreadsheet(sheets_service, spreadsheet_id, data):
+    """Bring the first sheet in line with data using only the row changes that are needed."""
+    sheets, existing_rows = read_sheet_rows(sheets_service, spreadsheet_id)
+    properties = sheets[0]
+    sheet_id = properties['sheetId']
+    column_count = properties.get('gridProperties', {}).get('columnCount', 0)
+    row_count = properties.get('gridProperties', {}).get('rowCount', 0)
+    fingerprint_properties = find_fingerprint_sheet(sheets)
+    if fingerprint_properties:
+        fingerprint_sheet_id = fingerprint_properties['sheetId']
+    else:
+        fingerprint_sheet_id = max(sheet['sheetId'] for sheet in sheets) + 1
+
+    requests, summary = plan_sync_requests(sheet_id, fingerprint_sheet_id, existing_rows, data, column_count)
+
+    if requests:
+        if not fingerprint_properties:
+            requests.insert(0, {
+                'addSheet': {
+                    'properties': {
+                        'sheetId': fingerprint_sheet_id,
+                        'title': FINGERPRINT_SHEET_TITLE,
+                        'hidden': True,
+                        'gridProperties': {'rowCount': row_count, 'columnCount': 1}
+                    }
+                }
+            })
+        elif fingerprint_properties.get('gridProperties', {}).get('rowCount', 0) < row_count:
+            # Rows added to the first sheet by hand have no fingerprint rows yet
+            requests.insert(0, {
+                'appendDimension': {
+                    'sheetId': fingerprint_sheet_id,
+                    'dimension': 'ROWS',
+                    'length': row_count - fingerprint_properties['gridProperties']['rowCount']
+                }
+            })
+        if len(data[0]) > column_count:
+            # updateCells cannot write past the grid, so widen it first
+            requests.insert(0, {
+                'appendDimension': {
+                    'sheetId': sheet_id,
+                    'dimension': 'COLUMNS',
+                    'length': len(data[0]) - column_count
+                }
+            })
+        requests.append({
+            'updateDimensionProperties': {
+                'range': {
+                    'sheetId': sheet_id,
+                    'dimension': 'COLUMNS',
+                    'startIndex': 1,  # Skip prefix column
+                    'endIndex': len(data[0])
+                },
+                'properties': {
+                    'pixelSize': THUMBNAIL_SIZE + 20  # Add some padding
+                },
+                'fields': 'pixelSize'
+            }
+        })
+        execute(sheets_service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={'requests': requests}
+        ))
+
+    logger.info(f"Incremental sync: {summary['inserted']} inserted, {summary['updated']} updated, "
+                f"{summary['deleted']} deleted, {summary['unchanged']} unchanged rows")
+    if DEBUG:
+        print(f"Sent {len(requests)} sheet requests for incremental sync")
+
+    return summary
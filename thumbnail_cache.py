@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from config import USE_THUMBNAIL_CACHE, THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Evict down to this fraction of the budget so that every write does not trigger a scan
+EVICTION_LOW_WATER = 0.9
+
+class ThumbnailCache:
+    """On-disk cache of encoded thumbnails with size-bounded LRU eviction.
+
+    Entries are content addressed by Drive file id plus md5Checksum/modifiedTime, so a
+    changed file gets a new key and stale entries simply age out. Writes go to a
+    temporary file that is renamed into place, which keeps concurrent runs safe.
+    Recency is tracked through file mtimes, which are refreshed on every hit.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+
+    @staticmethod
+    def key_for(file_info, variant=''):
+        """Return the cache key for a listed file, or None if it has no version fields."""
+        version = file_info.get('md5Checksum') or file_info.get('modifiedTime')
+        if not version:
+            return None
+        raw_key = f"{file_info['id']}:{version}:{variant}"
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    yield entry
+
+    def get(self, key):
+        """Return the cached (bytes, mime_type) for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        mime_type, _, data = content.partition(b'\n')
+        with self._lock:
+            self.hits += 1
+        return data, mime_type.decode('ascii')
+
+    def put(self, key, data, mime_type):
+        """Store an encoded thumbnail under key and evict old entries if over budget."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(mime_type.encode('ascii') + b'\n')
+                f.write(data)
+            try:
+                replaced_size = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced_size = 0
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        with self._lock:
+            self.writes += 1
+            self._size += len(data) + len(mime_type) + 1 - replaced_size
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits its budget."""
+        with self._lock:
+            entries = []
+            for entry in self._entries():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            entries.sort()
+
+            size = sum(entry_size for _, entry_size, _ in entries)
+            target = self.max_bytes * EVICTION_LOW_WATER
+            for _, entry_size, path in entries:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                    self.evictions += 1
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+            self._size = size
+
+    def stats(self):
+        """Return hit/miss statistics for this process."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'size_bytes': self._size,
+            }
+
+    def disk_usage(self):
+        """Return the number of cached thumbnails and their total size in bytes, read from disk."""
+        entries = 0
+        size = 0
+        for entry in self._entries():
+            entries += 1
+            size += entry.stat().st_size
+        return entries, size
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_thumbnail_cache():
+    """Return the shared thumbnail cache, or None when caching is disabled."""
+    global _cache
+    if not USE_THUMBNAIL_CACHE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ThumbnailCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES)
+    return _cache
@@ -0,0 +1,75 @@
+import io
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+# Formats that Sheets can render from a data URI, so an original may be kept as-is
+EMBEDDABLE_MIME_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+
+def make_thumbnail(data, size, image_format='JPEG', quality=80):
+    """Downscale image bytes to fit within size x size pixels and re-encode them.
+
+    Returns a (bytes, mime_type) tuple. When the re-encoded image is not smaller than
+    an original that Sheets can already display, the original is returned instead.
+    This runs in worker processes, so it must stay a picklable module-level function.
+    """
+    # Pillow is only needed once an image is resized, so it is imported on first use
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        source_mime = Image.MIME.get(image.format)
+
+        # Let the JPEG decoder scale down while decoding instead of after
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            # JPEG has no alpha channel, so flatten transparency onto white
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+
+        output = io.BytesIO()
+        image.save(output, format=image_format, quality=quality, optimize=True)
+
+    thumbnail = output.getvalue()
+    if len(thumbnail) >= len(data) and source_mime in EMBEDDABLE_MIME_TYPES:
+        return data, source_mime
+
+    return thumbnail, THUMBNAIL_MIME_TYPES.get(image_format, f"image/{image_format.lower()}")
+
+class ThumbnailStats:
+    """Thread-safe totals of the bytes before and after thumbnailing."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.images = 0
+            self.original_bytes = 0
+            self.encoded_bytes = 0
+
+    def record(self, original_size, encoded_size):
+        with self._lock:
+            self.images += 1
+            self.original_bytes += original_size
+            self.encoded_bytes += encoded_size
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - self.encoded_bytes
+
+thumbnail_stats = ThumbnailStats()